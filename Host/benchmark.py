@@ -0,0 +1,352 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Benchmarks the hot paths of the PyPortal code on CPython.
+
+    python Host/benchmark.py                  # compare with the baseline
+    python Host/benchmark.py --save           # store the results as the baseline
+    python Host/benchmark.py --quick          # skip the 10,000 event cases
+    python Host/benchmark.py --only format    # only the names containing "format"
+    python Host/benchmark.py --check 5        # exit 1 if an allocation grew over 5 %
+    python Host/benchmark.py --check-time 50  # exit 1 if a time grew over 50 %
+
+Covers eventDisplay.format_datetime (12 and 24 hour) and the clockFormat that
+replaced it in code.py, eventDisplay.pointInside,
+the touch hit-test (calibrateTouch and touchRegionAt, which replaced
+adjustTouch), eventStore.remainingUpdate, loadSdCard() from code.py with
+generated configs of 10 to 10,000 events (reading the index, rebuilding it
+and the config.json fallback) and removePastEvents() from code.py when 90 %
+of the events have passed.
+
+Each result is the time per call (the best of a few rounds) and the bytes
+allocated by one call (the tracemalloc peak). The results are compared with
+Host/benchmarkBaseline.json. The measured call starts after a gc.collect(),
+and the load cases with a new event store, so that what earlier cases left
+behind does not move its peak: the allocations repeat from run to run, to
+within a few bytes, on one Python version and are the first place to look
+for a regression. Rebuilding the index also allocates the buffers of the
+files it writes, which the file system sizes, so --check allows those cases
+REBUILD_SLACK percent more. The times depend on the machine, so save a
+baseline on the machine (and Python) the comparison runs on.
+"""
+
+import argparse
+import ast
+import contextlib
+import gc
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+from measureEventStore import FIRST_EPOCH, FIRST_TIME, sampleRecords, writeConfig
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+DEVICE_DIR = os.path.join(os.path.dirname(HOST_DIR), "PyPortal")
+STUBS_DIR = os.path.join(HOST_DIR, "stubs")
+BASELINE_FILE = os.path.join(HOST_DIR, "benchmarkBaseline.json")
+# The stand-ins go last so that their asyncio does not shadow the real one
+sys.path.append(STUBS_DIR)
+
+import configLoader  # noqa: E402
+import eventDisplay as eventDisplayModule  # noqa: E402
+import eventIndex  # noqa: E402
+import simhooks  # noqa: E402
+from calendarLoader import calendarFiles, readCalendar  # noqa: E402
+from clockFormat import clockFormat  # noqa: E402
+from configLoader import loadConfig  # noqa: E402
+from eventDisplay import eventDisplay  # noqa: E402
+from eventStore import eventStore  # noqa: E402
+from eventTimeline import eventTimeline  # noqa: E402
+from feedSync import FEED_FILE, feedSync  # noqa: E402
+from simulator import makeGcModule  # noqa: E402
+
+# loadConfig reports gc.mem_free() as it goes, and eventDisplay sizes its
+# background cache from it
+configLoader.gc = makeGcModule(simhooks.Heap())
+eventDisplayModule.gc = configLoader.gc
+
+ROUNDS = 5
+EVENT_COUNTS = (10, 100, 1000, 10000)
+QUICK_EVENT_COUNTS = (10, 100, 1000)
+# Rebuilding the index writes files, whose buffers are sized by the file
+# system (st_blksize): the peak of those cases differs between machines
+REBUILD_SLACK = 30
+# Seconds between the generated events (10,000 of them span seven years)
+EVENT_STEP = 6 * 3600
+
+
+# **************** BENCHMARK ******************
+class Benchmark:
+    """
+    run is called `number` times per round. With a setup, setup() is called
+    before each call (outside the timing) and its result passed to run.
+    --check allows the allocations of the benchmark to grow by slack percent
+    more than its limit.
+    """
+
+    def __init__(self, name, run, setup=None, number=1000, slack=0):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.number = number
+        self.slack = slack
+
+    def time(self):
+        """Best time per call of ROUNDS rounds, in microseconds."""
+        best = None
+        for _ in range(ROUNDS):
+            if self.setup is None:
+                run = self.run
+                start = time.perf_counter_ns()
+                for _ in range(self.number):
+                    run()
+                elapsed = time.perf_counter_ns() - start
+            else:
+                elapsed = 0
+                for _ in range(self.number):
+                    arg = self.setup()
+                    start = time.perf_counter_ns()
+                    self.run(arg)
+                    elapsed += time.perf_counter_ns() - start
+            perCall = elapsed / self.number / 1000
+            if best is None or perCall < best:
+                best = perCall
+        return best
+
+    def allocations(self):
+        """Peak bytes allocated by one call, once warmed up. The garbage
+        collector runs just before the call, which also resets the counts
+        that start it, so it runs at the same points of every call."""
+        arg = self.setup() if self.setup else None
+        self.call(arg)
+        arg = self.setup() if self.setup else None
+        gc.collect()
+        tracemalloc.start()
+        try:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            self.call(arg)
+            return tracemalloc.get_traced_memory()[1] - before
+        finally:
+            tracemalloc.stop()
+
+    def call(self, arg):
+        if self.setup is None:
+            self.run()
+        else:
+            self.run(arg)
+
+
+def codeFunction(name, namespace, path=None):
+    """Compiles the function `name` of code.py (or of the file at path) into
+    namespace, which stands in for the globals of code.py."""
+    if path is None:
+        path = os.path.join(DEVICE_DIR, "code.py")
+    with open(path, "r") as fp:
+        tree = ast.parse(fp.read(), path)
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name == name:
+            exec(compile(ast.Module(body=[node], type_ignores=[]), path, "exec"), namespace)
+            return namespace[name]
+    raise KeyError(f"code.py has no function {name}")
+
+
+def fixedTime(now):
+    """The parts of the time module code.py uses, stopped at now."""
+    return types.SimpleNamespace(time=lambda: now, localtime=lambda: time.gmtime(now),
+                                 monotonic=time.monotonic)
+
+
+# **************** CASES ******************
+def displayBenchmarks():
+    display = eventDisplay(DEVICE_DIR, "/sd")
+    display.setTouchCalibration(20, 18, 319, 230)
+    for rect in (display.touchTemperature, display.touchTime, display.touchEventPrevious,
+                 display.touchAgenda, display.touchEventNext, display.touchBrightnessMinus,
+                 display.touchBrightnessAuto, display.touchBrightnessPlus):
+        display.addTouchRegion(rect, lambda repeat: None)
+
+    moment = time.gmtime(FIRST_EPOCH + 13 * 3600 + 5 * 60 + 9)
+    # Two ticks of the clock per call, one second apart on the same day
+    moments = [time.gmtime(FIRST_EPOCH + 13 * 3600 + s) for s in range(2)]
+    formatter = clockFormat()
+
+    def clockTick(show24hourFormat, moments=moments):
+        formatter.datetime(moments[0], show24hourFormat)
+        return formatter.datetime(moments[1], show24hourFormat)
+    inside = (250, 100, 30000)
+    outside = (5, 200, 30000)
+    raw = (260, 120, 30000)
+
+    return [
+        Benchmark("format_datetime 24h", lambda: eventDisplay.format_datetime(moment, True), number=20000),
+        Benchmark("format_datetime 12h", lambda: eventDisplay.format_datetime(moment, False), number=20000),
+        Benchmark("clockFormat tick 24h", lambda: clockTick(True), number=20000),
+        Benchmark("clockFormat tick 12h", lambda: clockTick(False), number=20000),
+        Benchmark("pointInside hit", lambda: eventDisplay.pointInside(display.touchEventNext, inside),
+                  number=50000),
+        Benchmark("pointInside miss", lambda: eventDisplay.pointInside(display.touchEventNext, outside),
+                  number=50000),
+        Benchmark("touch hit-test", lambda: display.touchRegionAt(display.calibrateTouch(raw)),
+                  number=20000),
+    ]
+
+
+def storeBenchmarks():
+    store = eventStore()
+    for record in sampleRecords(10, EVENT_STEP):
+        store.addRecord(record)
+    store.sort()
+    now = FIRST_EPOCH + 3 * 86400 + 3723
+    return [
+        Benchmark("remainingUpdate", lambda: store.remainingUpdate(now), number=20000),
+    ]
+
+
+def loadBenchmarks(folder, counts):
+    benchmarks = []
+    for count in counts:
+        # The first event ends a day before now, so that none is skipped
+        now = FIRST_EPOCH + 86400
+        path = os.path.join(folder, str(count))
+        os.makedirs(path, exist_ok=True)
+        writeConfig(path, sampleRecords(count, EVENT_STEP))
+
+        namespace = {"events": eventStore(), "sdcardPath": path, "secrets": {},
+                     "eventIndex": eventIndex, "loadConfig": loadConfig,
+                     "time": fixedTime(now), "timeline": eventTimeline(),
+                     "feedSync": feedSync, "FEED_FILE": FEED_FILE,
+                     "calendarFiles": calendarFiles, "readCalendar": readCalendar}
+        for name in ("expiredBefore", "addFeedRecord", "addCalendarRecord"):
+            codeFunction(name, namespace)
+        loadSdCard = codeFunction("loadSdCard", namespace)
+        number = max(1, min(50, 2000 // count))
+
+        # Each call fills an empty store, whatever the one before left
+        def newStore(namespace=namespace):
+            namespace["events"] = eventStore()
+            return namespace["events"]
+
+        def removeIndex(path=path):
+            for name in os.listdir(path):
+                if name != eventIndex.CONFIG_FILE:
+                    os.remove(os.path.join(path, name))
+            return newStore()
+
+        benchmarks.append(Benchmark(f"loadSdCard index {count}",
+                                    lambda arg, load=loadSdCard: load(), setup=newStore,
+                                    number=number))
+        benchmarks.append(Benchmark(f"loadSdCard rebuild {count}",
+                                    lambda arg, load=loadSdCard: load(), setup=removeIndex,
+                                    number=number, slack=REBUILD_SLACK))
+
+        def fallback(store, path=path, now=now):
+            loadConfig(os.path.join(path, eventIndex.CONFIG_FILE), {}, store.addRecord, now - 86400)
+            store.sort()
+        benchmarks.append(Benchmark(f"loadConfig fallback {count}", fallback,
+                                    setup=newStore, number=number))
+    return benchmarks
+
+
+def expiryBenchmarks(counts):
+    benchmarks = []
+    for count in counts:
+        records = sampleRecords(count, EVENT_STEP)
+        # 90 % of the events ended more than a day ago
+        now = FIRST_EPOCH + FIRST_TIME + (count * 9 // 10) * EVENT_STEP + 86400 - 1
+        namespace = {"events": eventStore(), "last_event_index": 0,
+                     "time": fixedTime(now)}
+        codeFunction("printRepeat", namespace)
+        removePastEvents = codeFunction("removePastEvents", namespace)
+
+        def fill(records=records, namespace=namespace):
+            store = eventStore()
+            for record in records:
+                store.addRecord(record)
+            store.sort()
+            namespace["events"] = store
+
+        benchmarks.append(Benchmark(f"removePastEvents 90% of {count}",
+                                    lambda arg, remove=removePastEvents: remove(), setup=fill,
+                                    number=max(1, min(50, 2000 // count))))
+    return benchmarks
+
+
+# **************** REPORT ******************
+def change(value, base):
+    if not base:
+        return ""
+    return f"{100.0 * (value - base) / base:+.1f} %"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--save", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--quick", action="store_true", help="skip the 10,000 event cases")
+    parser.add_argument("--only", help="only run the benchmarks whose name contains this")
+    parser.add_argument("--check", type=float, metavar="PERCENT",
+                        help="exit 1 if an allocation grew by more than PERCENT")
+    parser.add_argument("--check-time", type=float, metavar="PERCENT",
+                        help="exit 1 if a time per call grew by more than PERCENT")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as fp:
+            baseline = json.load(fp)
+
+    counts = QUICK_EVENT_COUNTS if args.quick else EVENT_COUNTS
+    folder = tempfile.mkdtemp(prefix="pyportal_bench_")
+    results = {}
+    regressions = []
+    try:
+        benchmarks = (displayBenchmarks() + storeBenchmarks()
+                      + loadBenchmarks(folder, counts) + expiryBenchmarks(counts))
+        print(f"{'Benchmark':<32} {'us/call':>11} {'baseline':>11} {'change':>9}"
+              f" {'bytes':>9} {'baseline':>9} {'change':>9}")
+        for benchmark in benchmarks:
+            if args.only and args.only not in benchmark.name:
+                continue
+            # The code prints as it loads and removes events
+            with contextlib.redirect_stdout(io.StringIO()):
+                perCall = benchmark.time()
+                allocated = benchmark.allocations()
+            results[benchmark.name] = {"us": round(perCall, 3), "bytes": allocated}
+
+            base = baseline.get(benchmark.name, {})
+            print(f"{benchmark.name:<32} {perCall:>11.3f} {base.get('us', ''):>11}"
+                  f" {change(perCall, base.get('us')):>9} {allocated:>9}"
+                  f" {base.get('bytes', ''):>9} {change(allocated, base.get('bytes')):>9}")
+            checkBytes = args.check
+            if checkBytes is not None:
+                checkBytes += benchmark.slack
+            for key, value, limit in (("us", perCall, args.check_time),
+                                      ("bytes", allocated, checkBytes)):
+                if limit is not None and base.get(key) and value > base[key] * (1 + limit / 100):
+                    regressions.append(f"{benchmark.name}: {key} {base[key]} -> {value:g}")
+    finally:
+        shutil.rmtree(folder)
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, "w") as fp:
+            json.dump(baseline, fp, indent=4, sort_keys=True)
+            fp.write("\n")
+        print(f"Saved {len(results)} results to {args.baseline}")
+
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
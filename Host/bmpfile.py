@@ -0,0 +1,154 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Minimal reader and writer for the uncompressed Windows BMP files used on the
+PyPortal (1, 4 and 8 bit indexed, 16 and 24 bit true color; only indexed
+files are written). Pure Python so the host tools run without any imaging
+library installed.
+"""
+
+import struct
+
+
+class BmpHeader:
+    def __init__(self, width, height, bpp, dataOffset, colors, topDown, fileSize):
+        self.width = width
+        self.height = height
+        self.bpp = bpp
+        self.dataOffset = dataOffset
+        self.colors = colors
+        self.topDown = topDown
+        self.fileSize = fileSize
+
+    @property
+    def indexed(self):
+        return self.bpp <= 8
+
+    @property
+    def rowSize(self):
+        return ((self.width * self.bpp + 31) // 32) * 4
+
+
+class BmpImage:
+    """Decoded image. Indexed images keep one palette index per pixel in
+    `pixels`; true color images keep three bytes (R, G, B) per pixel.
+    """
+
+    def __init__(self, width, height, bpp, palette, pixels):
+        self.width = width
+        self.height = height
+        self.bpp = bpp
+        self.palette = palette
+        self.pixels = pixels
+
+    @property
+    def indexed(self):
+        return self.palette is not None
+
+    def rgb(self, x, y):
+        i = y * self.width + x
+        if self.indexed:
+            return self.palette[self.pixels[i]]
+        return tuple(self.pixels[i * 3:i * 3 + 3])
+
+
+def readHeader(fp):
+    data = fp.read(54)
+    if len(data) < 54 or data[0:2] != b"BM":
+        raise ValueError("Not a BMP file")
+    fileSize, = struct.unpack_from("<I", data, 2)
+    dataOffset, = struct.unpack_from("<I", data, 10)
+    headerSize, width, height, planes, bpp, compression = struct.unpack_from(
+        "<IiiHHI", data, 14)
+    colors, = struct.unpack_from("<I", data, 46)
+    if compression not in (0, 3):
+        raise ValueError("Compressed BMP files are not supported")
+    if bpp <= 8 and colors == 0:
+        colors = 1 << bpp
+    header = BmpHeader(width, abs(height), bpp, dataOffset,
+                       colors, height < 0, fileSize)
+    header.headerSize = headerSize
+    return header
+
+
+def read(path):
+    with open(path, "rb") as fp:
+        header = readHeader(fp)
+        palette = None
+        if header.indexed:
+            fp.seek(14 + header.headerSize)
+            raw = fp.read(4 * header.colors)
+            palette = [(raw[i + 2], raw[i + 1], raw[i])
+                       for i in range(0, len(raw), 4)]
+        fp.seek(header.dataOffset)
+        data = fp.read(header.rowSize * header.height)
+
+    w, h, bpp = header.width, header.height, header.bpp
+    pixels = bytearray(w * h if palette is not None else w * h * 3)
+    for row in range(h):
+        y = row if header.topDown else h - 1 - row
+        src = data[row * header.rowSize:(row + 1) * header.rowSize]
+        if bpp == 8:
+            pixels[y * w:(y + 1) * w] = src[:w]
+        elif bpp < 8:
+            perByte = 8 // bpp
+            mask = (1 << bpp) - 1
+            for x in range(w):
+                b = src[x // perByte]
+                shift = 8 - bpp * (x % perByte + 1)
+                pixels[y * w + x] = (b >> shift) & mask
+        elif bpp == 24:
+            out = y * w * 3
+            for x in range(w):
+                pixels[out + x * 3] = src[x * 3 + 2]
+                pixels[out + x * 3 + 1] = src[x * 3 + 1]
+                pixels[out + x * 3 + 2] = src[x * 3]
+        elif bpp == 16:
+            out = y * w * 3
+            for x in range(w):
+                v = src[x * 2] | (src[x * 2 + 1] << 8)
+                pixels[out + x * 3] = ((v >> 10) & 0x1F) << 3
+                pixels[out + x * 3 + 1] = ((v >> 5) & 0x1F) << 3
+                pixels[out + x * 3 + 2] = (v & 0x1F) << 3
+        else:
+            raise ValueError(f"Unsupported bit depth {bpp}")
+    return BmpImage(w, h, bpp, palette, pixels)
+
+
+def bitsForColors(count):
+    """Smallest BMP bit depth that holds count palette entries."""
+    if count <= 2:
+        return 1
+    if count <= 16:
+        return 4
+    return 8
+
+
+def encodeIndexed(width, height, palette, pixels, bpp=None):
+    """Returns the bytes of a bottom-up palette based BMP file."""
+    bpp = bpp or bitsForColors(len(palette))
+    rowSize = ((width * bpp + 31) // 32) * 4
+    paletteBytes = bytearray()
+    for r, g, b in palette:
+        paletteBytes += bytes((b, g, r, 0))
+    dataOffset = 14 + 40 + len(paletteBytes)
+    fileSize = dataOffset + rowSize * height
+
+    out = bytearray()
+    out += struct.pack("<2sIHHI", b"BM", fileSize, 0, 0, dataOffset)
+    out += struct.pack("<IiiHHIIiiII", 40, width, height, 1, bpp, 0,
+                       rowSize * height, 2835, 2835, len(palette), 0)
+    out += paletteBytes
+    perByte = 8 // bpp
+    for y in range(height - 1, -1, -1):
+        row = bytearray(rowSize)
+        src = pixels[y * width:(y + 1) * width]
+        if bpp == 8:
+            row[:width] = src
+        else:
+            for x, value in enumerate(src):
+                row[x // perByte] |= value << (8 - bpp * (x % perByte + 1))
+        out += row
+    return bytes(out)
@@ -0,0 +1,93 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Builds the compiled event index (events.idx and events.str) next to the
+config.json of an SD card folder, with the same code the device uses, so
+the first boot after editing the card does not have to build it.
+
+    python Host/buildEventIndex.py SD_Card
+    python Host/buildEventIndex.py SD_Card --dump
+
+The device rebuilds the index itself whenever the size or time stamp of
+config.json no longer match the ones recorded in the index.
+"""
+
+import argparse
+import calendar
+import os
+import sys
+import time
+
+# The device RTC holds local time and its mktime() does no time zone
+# conversion; UTC gives the same results on the host.
+ORIGINAL_TZ = os.environ.get("TZ")
+os.environ["TZ"] = "UTC"
+time.tzset()
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HOST_DIR), "PyPortal"))
+
+import eventIndex  # noqa: E402
+from eventStore import eventStore  # noqa: E402
+
+
+def fatSignature(folder, localMtime):
+    """
+    (size, mtime) of config.json as the device sees it. FAT stores local
+    time without a time zone, which the device reads as if it were UTC.
+    """
+    path = os.path.join(folder, eventIndex.CONFIG_FILE)
+    st = os.stat(path)
+    mtime = int(st.st_mtime)
+    if localMtime:
+        mtime = calendar.timegm(hostLocaltime(mtime))
+    return (st.st_size, mtime & ~1)
+
+
+def hostLocaltime(seconds):
+    """time.localtime() in the time zone of this computer."""
+    if ORIGINAL_TZ is None:
+        del os.environ["TZ"]
+    else:
+        os.environ["TZ"] = ORIGINAL_TZ
+    time.tzset()
+    try:
+        return time.localtime(seconds)
+    finally:
+        os.environ["TZ"] = "UTC"
+        time.tzset()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("sd", help="folder with config.json")
+    parser.add_argument("--utc-mtime", action="store_true",
+                        help="record the file time as UTC instead of local time "
+                        "(when the card is not a FAT volume written by this computer)")
+    parser.add_argument("--dump", action="store_true",
+                        help="print the records of the index after building it")
+    args = parser.parse_args(argv)
+
+    signature = fatSignature(args.sd, not args.utc_mtime)
+    start = time.perf_counter()
+    count = eventIndex.build(args.sd, signature)
+    elapsed = time.perf_counter() - start
+    indexSize = os.path.getsize(os.path.join(args.sd, eventIndex.INDEX_FILE))
+    stringsSize = os.path.getsize(os.path.join(args.sd, eventIndex.STRINGS_FILE))
+    configSize = signature[0]
+    print(f"Indexed {count} events in {elapsed * 1000:.1f} ms: "
+          f"{eventIndex.INDEX_FILE} {indexSize} bytes, "
+          f"{eventIndex.STRINGS_FILE} {stringsSize} bytes "
+          f"(config.json {configSize} bytes)")
+
+    if args.dump:
+        events = eventStore()
+        eventIndex.load(args.sd, {}, events)
+        for i in range(events.count()):
+            print(f"  {events.epoch(i):>10}  0x{events.forecolor(i):06X}  {events.describe(i)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Draws a BDF font into one bitmap of fixed size cells for a textGrid.
+
+Each character of CHARACTERS is drawn into a cell of --cell pixels, on the
+baseline of the font and centered across the cell, with a blank column on
+its right between the characters. The font is proportional: the glyphs
+wider than that (M, W, m, w, %...) are narrowed by merging neighbouring
+columns, so that no stroke is lost. The cells go in one row into a 1 bit
+BMP file, next to a manifest listing the cell size and then the characters
+in cell order:
+
+- PyPortal/fonts/Helvetica-Bold-16-grid.bmp
+- PyPortal/fonts/Helvetica-Bold-16-grid.txt
+
+textGrid (PyPortal/textGrid.py) reads both and shows a character by writing
+its cell index into a TileGrid, so the glyphs are drawn here once rather
+than on the device.
+
+    python Host/buildGridFont.py
+    python Host/buildGridFont.py --font PyPortal/fonts/Helvetica-Bold-16.bdf --cell 10 20
+"""
+
+import argparse
+import os
+
+import bmpfile
+from buildIconAtlas import bitmapBytes
+from subsetFonts import BdfFont
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+DEVICE_DIR = os.path.join(os.path.dirname(HOST_DIR), "PyPortal")
+FONT_FILE = os.path.join(DEVICE_DIR, "fonts", "Helvetica-Bold-16.bdf")
+# 32 columns and 12 rows on the 320x240 screen
+CELL_WIDTH = 10
+CELL_HEIGHT = 20
+# The first is the blank cell the grid starts filled with
+CHARACTERS = "".join(chr(c) for c in range(32, 127)) + "°"
+# Background and text; the display sets the text color
+PALETTE = [(0, 0, 0), (255, 255, 255)]
+
+
+# **************** GLYPHS ******************
+def glyphRows(lines):
+    """(width, height, x offset, y offset, rows of bits) of the lines of a
+    BDF glyph, each row an int with the leftmost pixel in its highest bit."""
+    width = height = xOffset = yOffset = 0
+    rows = []
+    inBitmap = False
+    for line in lines:
+        if line.startswith("BBX"):
+            width, height, xOffset, yOffset = (int(v) for v in line.split()[1:5])
+        elif line.startswith("BITMAP"):
+            inBitmap = True
+        elif line.startswith("ENDCHAR"):
+            break
+        elif inBitmap and line.strip():
+            hexRow = line.strip()
+            rows.append((int(hexRow, 16), len(hexRow) * 4))
+    return width, height, xOffset, yOffset, rows
+
+
+def drawCell(pixels, atlasWidth, cell, cellWidth, cellHeight, baseline, lines):
+    """
+    Draws a glyph into its cell of the atlas. Returns True if the glyph was
+    narrowed to fit the cell.
+    """
+    width, height, _, yOffset, rows = glyphRows(lines)
+    # The last column is left blank between the characters
+    inkWidth = cellWidth - 1
+    narrowed = width > inkWidth
+    left = 0 if narrowed else (inkWidth - width) // 2
+    top = baseline - yOffset - height
+    for gy, (bits, rowBits) in enumerate(rows):
+        y = top + gy
+        if not 0 <= y < cellHeight:
+            continue
+        for gx in range(width):
+            if not (bits >> (rowBits - 1 - gx)) & 1:
+                continue
+            # A wider glyph has its columns merged onto the cell's
+            x = gx * inkWidth // width if narrowed else left + gx
+            pixels[y * atlasWidth + cell * cellWidth + x] = 1
+    return narrowed
+
+
+def buildGrid(font, characters=CHARACTERS, cellWidth=CELL_WIDTH, cellHeight=CELL_HEIGHT):
+    """
+    Returns (pixels, width, narrowed, missing) of the atlas: one byte per
+    pixel, the characters narrowed to fit and those the font does not have
+    (left blank).
+    """
+    ascent = descent = 0
+    for line in font.header:
+        if line.startswith("FONT_ASCENT"):
+            ascent = int(line.split()[1])
+        elif line.startswith("FONT_DESCENT"):
+            descent = int(line.split()[1])
+    if ascent + descent > cellHeight:
+        raise ValueError(f"the font is {ascent + descent} pixels high, "
+                         f"more than the {cellHeight} of a cell")
+    # The line of the font centered in the cell
+    baseline = (cellHeight - ascent - descent) // 2 + ascent
+
+    width = len(characters) * cellWidth
+    pixels = bytearray(width * cellHeight)
+    narrowed = []
+    missing = []
+    for cell, character in enumerate(characters):
+        lines = font.glyphs.get(ord(character))
+        if lines is None:
+            missing.append(character)
+            continue
+        if drawCell(pixels, width, cell, cellWidth, cellHeight, baseline, lines):
+            narrowed.append(character)
+    return pixels, width, narrowed, missing
+
+
+def outputPaths(fontPath, folder):
+    base = os.path.splitext(os.path.basename(fontPath))[0] + "-grid"
+    return (os.path.join(folder, base + ".bmp"), os.path.join(folder, base + ".txt"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--font", default=FONT_FILE, help="BDF font to draw")
+    parser.add_argument("--out", default=os.path.join(DEVICE_DIR, "fonts"),
+                        help="folder to write the bitmap and its manifest to")
+    parser.add_argument("--cell", type=int, nargs=2, default=(CELL_WIDTH, CELL_HEIGHT),
+                        metavar=("WIDTH", "HEIGHT"), help="size of a cell in pixels")
+    args = parser.parse_args(argv)
+
+    cellWidth, cellHeight = args.cell
+    font = BdfFont(args.font)
+    pixels, width, narrowed, missing = buildGrid(font, CHARACTERS, cellWidth, cellHeight)
+    bitmapPath, manifestPath = outputPaths(args.font, args.out)
+    data = bmpfile.encodeIndexed(width, cellHeight, PALETTE, pixels)
+    with open(bitmapPath, "wb") as fp:
+        fp.write(data)
+    with open(manifestPath, "w", encoding="utf-8", newline="\n") as fp:
+        fp.write(f"{cellWidth} {cellHeight}\n{CHARACTERS}\n")
+
+    print(f"{os.path.basename(bitmapPath)}: {len(CHARACTERS)} cells of {cellWidth}x{cellHeight}, "
+          f"{len(data)} bytes, {bitmapBytes(width, cellHeight, len(PALETTE))} bytes of heap")
+    print(f"A 320x240 screen holds {320 // cellWidth} columns and {240 // cellHeight} rows")
+    if narrowed:
+        print(f"Narrowed to fit a cell: {''.join(narrowed)}")
+    if missing:
+        print(f"Not in the font (blank): {''.join(missing)!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Packs the icons of the display into one sprite atlas.
+
+Reads the palette based BMP files of the icon folder (Host/icons), cuts each
+into tiles of --tile pixels (wifi.bmp holds one tile per signal level) and
+writes to the PyPortal folder:
+
+- icons.bmp, all the tiles in one row with a single palette,
+- icons.txt, the tile size then one line per icon with its name, first
+  tile and number of tiles, e.g. "wifi 2 5".
+
+eventDisplay reads the atlas into RAM once at boot and shows each icon as a
+tile of it, so changing an icon is a tile index write.
+
+    python Host/buildIconAtlas.py
+    python Host/buildIconAtlas.py --icons Host/icons --out PyPortal
+
+The full screen images (title, connecting, connect_failed, no_events,
+not_found) are not packed: each is a 320x240 image with its own 256 colors,
+so they would not share a palette and would not fit in RAM together.
+"""
+
+import argparse
+import os
+
+import bmpfile
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+DEVICE_DIR = os.path.join(os.path.dirname(HOST_DIR), "PyPortal")
+ATLAS_FILE = "icons.bmp"
+MANIFEST_FILE = "icons.txt"
+TILE_SIZE = 20
+# Effective read rate of the CIRCUITPY flash and the cost of opening a file,
+# for the estimates
+FLASH_BYTES_PER_SECOND = 400000
+OPEN_SECONDS = 0.02
+
+
+# **************** ATLAS ******************
+def iconFiles(folder):
+    """Names of the BMP files in folder, sorted."""
+    return sorted(name for name in os.listdir(folder) if name.lower().endswith(".bmp"))
+
+
+def buildAtlas(folder, tileSize=TILE_SIZE):
+    """
+    Returns (palette, pixels, width, icons) of the atlas of the icons in
+    folder, icons being (name, first tile, tiles, file bytes) in tile order.
+    """
+    palette = []
+    colorIndex = {}
+    tiles = []
+    icons = []
+    for name in iconFiles(folder):
+        path = os.path.join(folder, name)
+        image = bmpfile.read(path)
+        if not image.indexed:
+            raise ValueError(f"{name} is not palette based")
+        if image.height != tileSize or image.width % tileSize:
+            raise ValueError(f"{name} is {image.width}x{image.height}, "
+                             f"not a row of {tileSize}x{tileSize} tiles")
+        pixels = bytearray(len(image.pixels))
+        for i, value in enumerate(image.pixels):
+            rgb = image.palette[value]
+            if rgb not in colorIndex:
+                colorIndex[rgb] = len(palette)
+                palette.append(rgb)
+            pixels[i] = colorIndex[rgb]
+        count = image.width // tileSize
+        icons.append((os.path.splitext(name)[0], len(tiles), count, os.path.getsize(path)))
+        for t in range(count):
+            tile = bytearray()
+            for y in range(tileSize):
+                start = y * image.width + t * tileSize
+                tile += pixels[start:start + tileSize]
+            tiles.append(tile)
+    if len(palette) > 256:
+        raise ValueError(f"the icons have {len(palette)} colors, at most 256 fit one palette")
+
+    width = len(tiles) * tileSize
+    atlas = bytearray(width * tileSize)
+    for t, tile in enumerate(tiles):
+        for y in range(tileSize):
+            start = y * width + t * tileSize
+            atlas[start:start + tileSize] = tile[y * tileSize:(y + 1) * tileSize]
+    return palette, atlas, width, icons
+
+
+def bitmapBytes(width, height, colors):
+    """Heap of a displayio.Bitmap, which packs 1, 2, 4 or 8 bits per pixel
+    into 32 bit words, and its Palette."""
+    bits = 1
+    while (1 << bits) < colors:
+        bits *= 2
+    return ((width * bits + 31) // 32) * 4 * height + 4 * colors
+
+
+def loadSeconds(opens, size):
+    return opens * OPEN_SECONDS + size / FLASH_BYTES_PER_SECOND
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--icons", default=os.path.join(HOST_DIR, "icons"),
+                        help="folder of the icon BMP files")
+    parser.add_argument("--out", default=DEVICE_DIR,
+                        help="folder to write icons.bmp and icons.txt to")
+    parser.add_argument("--tile", type=int, default=TILE_SIZE,
+                        help="width and height of a tile in pixels")
+    args = parser.parse_args(argv)
+
+    palette, atlas, width, icons = buildAtlas(args.icons, args.tile)
+    data = bmpfile.encodeIndexed(width, args.tile, palette, atlas)
+    with open(os.path.join(args.out, ATLAS_FILE), "wb") as fp:
+        fp.write(data)
+    lines = [f"{args.tile} {args.tile}"]
+    lines += [f"{name} {first} {count}" for name, first, count, _ in icons]
+    with open(os.path.join(args.out, MANIFEST_FILE), "w") as fp:
+        fp.write("\n".join(lines) + "\n")
+    manifestSize = os.path.getsize(os.path.join(args.out, MANIFEST_FILE))
+
+    print(f"{'Icon':<20} {'tiles':>5} {'first':>5} {'bytes':>6}")
+    for name, first, count, size in icons:
+        print(f"{name:<20} {count:>5} {first:>5} {size:>6}")
+    before = sum(size for _, _, _, size in icons)
+    after = len(data) + manifestSize
+    print(f"{ATLAS_FILE}: {width}x{args.tile}, {len(palette)} colors, {len(data)} bytes, "
+          f"{bitmapBytes(width, args.tile, len(palette))} bytes of heap")
+    print(f"Boot: {len(icons)} files, {before} bytes ({loadSeconds(len(icons), before):.3f} s) "
+          f"-> 2 files, {after} bytes ({loadSeconds(2, after):.3f} s)")
+
+
+if __name__ == "__main__":
+    main()
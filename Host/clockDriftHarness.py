@@ -0,0 +1,169 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Checks that the clock tick does not leak or churn memory over a day.
+
+Runs updateClock() of code.py (which sets the clock text, removes the past
+events and updates the countdown) once per simulated second for 24 hours,
+against a real eventDisplay on the host stand-ins. For each tick it measures
+the bytes allocated (the tracemalloc peak) and the strings clockFormat made,
+and checks that:
+
+- a tick makes at most one string, apart from a change of day,
+- the memory held after the first hour does not grow by the end of the day
+  (the host stand-in for a gc.mem_free() drift).
+
+    python Host/clockDriftHarness.py
+    python Host/clockDriftHarness.py --hours 2 --format 12
+    python Host/clockDriftHarness.py --code old_code.py
+
+Exits with status 1 if any check fails.
+"""
+
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+import types
+from array import array
+
+from benchmark import DEVICE_DIR, codeFunction
+from measureEventStore import FIRST_EPOCH, sampleRecords
+
+import simhooks  # noqa: E402
+from simulator import SD_CARD_DIR  # noqa: E402
+from clockFormat import clockFormat  # noqa: E402
+from eventDisplay import eventDisplay  # noqa: E402
+from eventStore import eventStore  # noqa: E402
+from eventTimeline import eventTimeline, COUNTDOWN  # noqa: E402
+
+# Memory the run may still take on after the first hour: the change of day
+# and the removal of the first event each keep a little. A leak of even one
+# byte per tick would be 82,800 bytes.
+DRIFT_ALLOWANCE = 4096
+
+
+class VirtualTime:
+    """The parts of the time module that code.py uses, on a clock that the
+    harness moves one second per tick."""
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def localtime(self, secs=None):
+        return time.gmtime(self.now if secs is None else secs)
+
+    def monotonic(self):
+        return float(self.now)
+
+
+def run(hours, show24hourFormat, codePath=None):
+    # Three days of events from noon on; the first one is removed a day
+    # after it passed, in the middle of the run
+    start = FIRST_EPOCH + 12 * 3600
+    events = eventStore()
+    for record in sampleRecords(3, 86400):
+        record["imageCountDown"] = "christmas_background.bmp"
+        record["imageEventDay"] = "christmas_event.bmp"
+        events.addRecord(record)
+    events.sort()
+
+    # The images come from the SD_Card folder. The recorder of the stand-ins
+    # would keep every label write, which is not what is measured here.
+    simhooks.sdRoot = SD_CARD_DIR
+    simhooks.recorder = types.SimpleNamespace(record=lambda kind, target=None, value=None: None)
+
+    clock = VirtualTime(start)
+    namespace = {
+        "events": events, "eventWindow": eventDisplay(DEVICE_DIR, "/sd"),
+        "eventDisplay": eventDisplay, "clock_text": clockFormat(),
+        "clock_set": True, "agenda_shown": False, "timeFormat24": show24hourFormat,
+        "last_event_index": None, "prefetch_pending": False, "time": clock,
+        "last_event_phase": None, "timeline": eventTimeline(), "COUNTDOWN": COUNTDOWN,
+        "print": lambda *args, **kwargs: None,
+    }
+    for name in ("printRepeat", "removePastEvents", "showEvent", "updateClock"):
+        codeFunction(name, namespace, codePath)
+    updateClock = namespace["updateClock"]
+    formatter = namespace["clock_text"]
+
+    ticks = hours * 3600
+    # Made before the tracing starts, so that they are not part of the drift
+    tickBytes = array("l", [0]) * ticks
+    tickStrings = array("l", [0]) * ticks
+    heldAfterHour = None
+    day = time.gmtime(start).tm_yday
+    rollovers = 0
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        for tick in range(ticks):
+            clock.now = start + tick
+            strings = formatter.allocations
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            updateClock()
+            tickBytes[tick] = tracemalloc.get_traced_memory()[1] - before
+
+            # The date part is made on the first tick and at a change of day
+            today = time.gmtime(clock.now).tm_yday
+            if tick == 0 or today != day:
+                rollovers += today != day
+                day = today
+            else:
+                tickStrings[tick] = formatter.allocations - strings
+
+            if tick == 3600:
+                gc.collect()
+                heldAfterHour = tracemalloc.get_traced_memory()[0]
+        gc.collect()
+        heldAtEnd = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    problems = []
+    if max(tickStrings) > 1:
+        problems.append(f"a tick made {max(tickStrings)} strings")
+    drift = None
+    if heldAfterHour is not None:
+        drift = heldAtEnd - heldAfterHour
+        if drift > DRIFT_ALLOWANCE:
+            problems.append(f"{drift} more bytes held at the end than after the first hour")
+
+    tickBytes = sorted(tickBytes)
+    summary = (f"{ticks} ticks, {rollovers} day changes, bytes per tick "
+               f"p50={tickBytes[len(tickBytes) // 2]} p95={tickBytes[int(len(tickBytes) * 0.95)]} "
+               f"max={tickBytes[-1]} mean={sum(tickBytes) / len(tickBytes):.0f}, "
+               f"strings per tick max={max(tickStrings)}, "
+               f"drift {drift if drift is not None else 'n/a'} bytes")
+    return problems, summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--hours", type=int, default=24)
+    parser.add_argument("--format", choices=("12", "24", "both"), default="both")
+    parser.add_argument("--code", help="path of the code.py to take updateClock() from")
+    args = parser.parse_args(argv)
+
+    formats = {"12": (False,), "24": (True,), "both": (True, False)}[args.format]
+    failures = 0
+    for show24hourFormat in formats:
+        problems, summary = run(args.hours, show24hourFormat, args.code)
+        name = "24 hour" if show24hourFormat else "12 hour"
+        print(f"{'FAIL' if problems else 'ok':<5}{name}: {summary}")
+        for problem in problems:
+            print(f"       {problem}")
+        failures += bool(problems)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
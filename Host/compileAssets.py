@@ -0,0 +1,375 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Offline compiler for the images of the SD card.
+
+Reads config.json, converts every image it references to the most compact
+format displayio draws fast (a palette based BMP of at most 320x240 with the
+smallest bit depth that holds its colors), stores identical results once
+(deduplicated by content hash) and writes a config.json that points at the
+compiled images. A compiled image is named after its source; two different
+images with the same file name get the first characters of their hash
+added to the second name.
+
+When the output is the SD card folder itself, the config.json it started
+from is kept as config.source.json on the first run, and later runs compile
+from that file, so running it again gives the same result.
+
+    python Host/compileAssets.py SD_Card
+    python Host/compileAssets.py SD_Card --out build/sd --max-colors 128
+
+24 bit images are reduced to --max-colors colors with a median cut. The
+countdown backgrounds (imageCountDown) are reduced further, to
+--background-colors colors (16 by default, a 4 bit image of 38 KB instead
+of 77 KB at 8 bits), with error diffusion dithering: eventDisplay can then
+keep the next event's background decoded in RAM beside the one on the
+screen. The report lists the bytes saved and an estimate of the time the device needs
+to read each image from the SD card.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+
+import bmpfile
+
+SCREEN_WIDTH = 320
+SCREEN_HEIGHT = 240
+IMAGE_FIELDS = ("imageCountDown", "imageEventDay")
+# Effective SD card read rate over the shared SPI bus of the PyPortal, and
+# the cost of opening a file (FAT directory lookup)
+SD_BYTES_PER_SECOND = 400000
+SD_OPEN_SECONDS = 0.02
+SOURCE_CONFIG = "config.source.json"
+# Hex digits of the hash added to the names of images that would collide
+NAME_DIGEST_LENGTH = 8
+# Colors of the countdown backgrounds, which eventDisplay caches in RAM
+BACKGROUND_FIELD = "imageCountDown"
+BACKGROUND_COLORS = 16
+# Share of the pixels of an exact color that gets its own palette entry
+# when dithering
+ANCHOR_SHARE = 0.02
+
+
+# **************** IMAGE CONVERSION ******************
+def crop(image, width=SCREEN_WIDTH, height=SCREEN_HEIGHT):
+    """Crops the image around its center to at most width x height."""
+    if image.width <= width and image.height <= height:
+        return image
+    w = min(width, image.width)
+    h = min(height, image.height)
+    x0 = (image.width - w) // 2
+    y0 = (image.height - h) // 2
+    step = 1 if image.indexed else 3
+    pixels = bytearray()
+    for y in range(y0, y0 + h):
+        start = (y * image.width + x0) * step
+        pixels += image.pixels[start:start + w * step]
+    return bmpfile.BmpImage(w, h, image.bpp, image.palette, pixels)
+
+
+def compactPalette(image):
+    """Drops the unused palette entries and merges duplicate colors."""
+    remap = {}
+    palette = []
+    colorIndex = {}
+    pixels = bytearray(len(image.pixels))
+    for i, value in enumerate(image.pixels):
+        if value not in remap:
+            rgb = image.palette[value]
+            if rgb not in colorIndex:
+                colorIndex[rgb] = len(palette)
+                palette.append(rgb)
+            remap[value] = colorIndex[rgb]
+        pixels[i] = remap[value]
+    return palette, pixels
+
+
+def medianCut(image, maxColors=256):
+    """
+    Reduces a true color image to at most maxColors colors. Colors are first
+    grouped into 15 bit buckets, then the bucket list is split along the
+    channel with the widest range until there are maxColors boxes.
+    """
+    p = image.pixels
+    count = image.width * image.height
+    bucketOf = [0] * count
+    histogram = {}
+    for i in range(count):
+        key = ((p[i * 3] >> 3) << 10) | ((p[i * 3 + 1] >> 3) << 5) | (p[i * 3 + 2] >> 3)
+        bucketOf[i] = key
+        histogram[key] = histogram.get(key, 0) + 1
+
+    def channels(key):
+        return ((key >> 10) & 31, (key >> 5) & 31, key & 31)
+
+    # Each box is [pixel count, bucket keys]
+    boxes = [[count, list(histogram)]]
+    while len(boxes) < maxColors:
+        # Split the box with the most pixels that can still be split
+        candidates = [b for b in boxes if len(b[1]) > 1]
+        if not candidates:
+            break
+        best = max(candidates, key=lambda b: b[0])
+        weight, keys = best
+        ranges = []
+        for c in range(3):
+            values = [channels(k)[c] for k in keys]
+            ranges.append(max(values) - min(values))
+        axis = ranges.index(max(ranges))
+        keys.sort(key=lambda k: channels(k)[axis])
+        running = 0
+        split = len(keys) - 1
+        for j, key in enumerate(keys):
+            running += histogram[key]
+            if running * 2 >= weight:
+                split = max(1, min(len(keys) - 1, j + 1))
+                break
+        low = keys[:split]
+        lowWeight = sum(histogram[k] for k in low)
+        boxes.remove(best)
+        boxes.append([lowWeight, low])
+        boxes.append([weight - lowWeight, keys[split:]])
+
+    palette = []
+    indexOf = {}
+    for index, (total, box) in enumerate(boxes):
+        rgb = [0, 0, 0]
+        for key in box:
+            for c, v in enumerate(channels(key)):
+                rgb[c] += v * histogram[key]
+        palette.append(tuple(min(255, (v * 8 + 4 * total) // total) for v in rgb))
+        for key in box:
+            indexOf[key] = index
+
+    pixels = bytearray(indexOf[k] for k in bucketOf)
+    return palette, pixels
+
+
+def trueColor(image):
+    """The indexed image as a true color image."""
+    pixels = bytearray(3 * len(image.pixels))
+    for i, value in enumerate(image.pixels):
+        pixels[i * 3:i * 3 + 3] = bytes(image.palette[value])
+    return bmpfile.BmpImage(image.width, image.height, 24, None, pixels)
+
+
+def anchorColors(image, palette, share=ANCHOR_SHARE):
+    """
+    Moves the nearest palette entry onto each exact color that covers more
+    than share of a true color image, so that flat areas stay flat when
+    dithered. Returns the palette.
+    """
+    p = image.pixels
+    counts = {}
+    for i in range(0, len(p), 3):
+        rgb = (p[i], p[i + 1], p[i + 2])
+        counts[rgb] = counts.get(rgb, 0) + 1
+    palette = list(palette)
+    anchored = set()
+    least = share * image.width * image.height
+    for rgb, count in sorted(counts.items(), key=lambda item: -item[1]):
+        if count < least:
+            break
+        free = [j for j in range(len(palette)) if j not in anchored]
+        if not free:
+            break
+        j = min(free, key=lambda j: sum((rgb[c] - palette[j][c]) ** 2 for c in range(3)))
+        palette[j] = rgb
+        anchored.add(j)
+    return palette
+
+
+def dither(image, palette):
+    """
+    Palette indexes of the pixels of a true color image, each the nearest
+    color once the error of the pixels before it is added (Floyd-Steinberg).
+    """
+    width = image.width
+    count = width * image.height
+    # Error carried to this row and the next, per channel
+    error = [[0] * (3 * (width + 2)) for _ in range(2)]
+    nearest = {}
+    pixels = bytearray(count)
+    p = image.pixels
+    for y in range(image.height):
+        here, below = error[y % 2], error[(y + 1) % 2]
+        for k in range(len(below)):
+            below[k] = 0
+        for x in range(width):
+            i = y * width + x
+            e = 3 * (x + 1)
+            rgb = tuple(max(0, min(255, p[i * 3 + c] + here[e + c] // 16)) for c in range(3))
+            index = nearest.get(rgb)
+            if index is None:
+                index = min(range(len(palette)), key=lambda j: sum(
+                    (rgb[c] - palette[j][c]) ** 2 for c in range(3)))
+                nearest[rgb] = index
+            pixels[i] = index
+            for c in range(3):
+                d = rgb[c] - palette[index][c]
+                here[e + 3 + c] += d * 7
+                below[e - 3 + c] += d * 3
+                below[e + c] += d * 5
+                below[e + 3 + c] += d
+    return pixels
+
+
+def compileImage(path, maxColors=256, dithered=False):
+    """
+    Returns the bytes of the compiled BMP file for the image at path. An
+    image with more than maxColors colors is reduced with a median cut, and
+    dithered if asked.
+    """
+    image = crop(bmpfile.read(path))
+    if image.indexed:
+        palette, pixels = compactPalette(image)
+        if len(palette) <= maxColors:
+            return bmpfile.encodeIndexed(image.width, image.height, palette, pixels)
+        image = trueColor(image)
+    palette, pixels = medianCut(image, maxColors)
+    if dithered:
+        palette = anchorColors(image, palette)
+        pixels = dither(image, palette)
+    return bmpfile.encodeIndexed(image.width, image.height, palette, pixels)
+
+
+def loadSeconds(size, sdRate=SD_BYTES_PER_SECOND):
+    return SD_OPEN_SECONDS + size / sdRate
+
+
+# **************** COMPILER ******************
+def compiledName(name, digest, subdir, byName):
+    """
+    Name of the compiled image of the source image name with the content
+    hash digest, recorded in byName. Raises ValueError rather than give two
+    different images the same name.
+    """
+    stem = os.path.splitext(os.path.basename(name))[0]
+    prefix = f"{subdir}/" if subdir else ""
+    for candidate in (f"{prefix}{stem}.bmp", f"{prefix}{stem}_{digest[:NAME_DIGEST_LENGTH]}.bmp"):
+        used = byName.get(candidate.lower())
+        if used is None or used == digest:
+            byName[candidate.lower()] = digest
+            return candidate
+    raise ValueError(f"{name}: {candidate} is already used by another image")
+
+
+def compileAssets(sdDir, outDir=None, subdir="compiled", maxColors=256,
+                  sdRate=SD_BYTES_PER_SECOND, dryRun=False,
+                  backgroundColors=BACKGROUND_COLORS):
+    outDir = outDir or sdDir
+    # The config.json of the first run, if the folder was compiled in place
+    sourcePath = os.path.join(sdDir, SOURCE_CONFIG)
+    if not os.path.exists(sourcePath):
+        sourcePath = os.path.join(sdDir, "config.json")
+    with open(sourcePath, "r") as fp:
+        config = json.load(fp)
+
+    compiled = {}   # (source name, colors) -> compiled name
+    byHash = {}     # content hash -> compiled name
+    byName = {}     # compiled name in lower case (FAT) -> content hash
+    rows = []
+    for item in config.get("events", []):
+        for field in IMAGE_FIELDS:
+            name = item.get(field)
+            colors = min(maxColors, backgroundColors) if field == BACKGROUND_FIELD else maxColors
+            if not name or (name, colors) in compiled:
+                continue
+            source = os.path.join(sdDir, name)
+            if not os.path.exists(source):
+                rows.append((name, None, None, None, "missing"))
+                continue
+            data = compileImage(source, colors, field == BACKGROUND_FIELD)
+            digest = hashlib.sha1(data).hexdigest()
+            duplicate = digest in byHash
+            if not duplicate:
+                byHash[digest] = compiledName(name, digest, subdir, byName)
+                if not dryRun:
+                    target = os.path.join(outDir, byHash[digest])
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    with open(target, "wb") as fp:
+                        fp.write(data)
+            compiled[(name, colors)] = byHash[digest]
+            rows.append((name, os.path.getsize(source), len(data),
+                         byHash[digest], "duplicate" if duplicate else ""))
+
+    for item in config.get("events", []):
+        for field in IMAGE_FIELDS:
+            colors = min(maxColors, backgroundColors) if field == BACKGROUND_FIELD else maxColors
+            if (item.get(field), colors) in compiled:
+                item[field] = compiled[(item[field], colors)]
+
+    if not dryRun:
+        os.makedirs(outDir, exist_ok=True)
+        configPath = os.path.join(outDir, "config.json")
+        if (os.path.abspath(outDir) == os.path.abspath(sdDir)
+                and not os.path.exists(os.path.join(outDir, SOURCE_CONFIG))):
+            # Keep the original so the images can be compiled again
+            shutil.copyfile(configPath, os.path.join(outDir, SOURCE_CONFIG))
+        with open(configPath, "w") as fp:
+            json.dump(config, fp, indent=4, sort_keys=True)
+
+    referenced = {os.path.normpath(n) for n, _ in compiled}
+    unreferenced = []
+    for root, dirs, files in os.walk(sdDir):
+        for f in files:
+            rel = os.path.normpath(os.path.relpath(os.path.join(root, f), sdDir))
+            if f.lower().endswith(".bmp") and rel not in referenced \
+                    and not rel.startswith(subdir + os.sep):
+                unreferenced.append((rel, os.path.getsize(os.path.join(root, f))))
+
+    return rows, unreferenced, sdRate
+
+
+def printReport(rows, unreferenced, sdRate):
+    print(f"{'Image':<32} {'Source':>8} {'Compiled':>8} {'Saved':>8} "
+          f"{'Load s':>7} {'Was s':>7}  Output")
+    sourceTotal = 0
+    storedTotal = 0
+    for name, before, after, target, note in rows:
+        if before is None:
+            print(f"{name:<32} {'':>8} {'':>8} {'':>8} {'':>7} {'':>7}  {note}")
+            continue
+        sourceTotal += before
+        stored = 0 if note == "duplicate" else after
+        storedTotal += stored
+        print(f"{name:<32} {before:>8} {after:>8} {before - stored:>8} "
+              f"{loadSeconds(after, sdRate):>7.3f} {loadSeconds(before, sdRate):>7.3f}"
+              f"  {target} {note}")
+    print(f"Referenced images: {sourceTotal} bytes -> {storedTotal} bytes "
+          f"({sourceTotal - storedTotal} saved)")
+    if unreferenced:
+        total = sum(size for _, size in unreferenced)
+        print(f"Images not referenced by config.json: {len(unreferenced)} files, "
+              f"{total} bytes (for example {unreferenced[0][0]})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("sd", help="folder with config.json and the images")
+    parser.add_argument("--out", help="folder to write to (default: the sd folder)")
+    parser.add_argument("--subdir", default="compiled",
+                        help="folder for the compiled images, relative to --out")
+    parser.add_argument("--max-colors", type=int, default=256,
+                        help="colors kept when reducing 24 bit images (2 to 256)")
+    parser.add_argument("--background-colors", type=int, default=BACKGROUND_COLORS,
+                        help="colors kept in the countdown backgrounds (2 to 256)")
+    parser.add_argument("--sd-rate", type=float, default=SD_BYTES_PER_SECOND,
+                        help="SD card read rate in bytes per second for the estimates")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only print the report")
+    args = parser.parse_args(argv)
+
+    rows, unreferenced, sdRate = compileAssets(
+        args.sd, args.out, args.subdir, max(2, min(256, args.max_colors)),
+        args.sd_rate, args.dry_run, max(2, min(256, args.background_colors)))
+    printReport(rows, unreferenced, sdRate)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Checks that editing config.json on the SD card takes effect without a reset.
+
+Runs code.py in the simulator and rewrites config.json of the sample card
+while it runs (the "sdEdits" of the scenario), and checks that:
+
+- the change is on the screen within one check interval of the watcher,
+- only the events added, changed or removed are applied,
+- the selected event stays selected (in its new version if it changed),
+  and the reload does not mark it as chosen by the user,
+- the backgrounds are not read from the SD card again,
+- a half written file is reported and applied once it is complete,
+- a subtitle with characters that the subset fonts of the card do not have
+  is shown with the full font.
+
+It then times the reload of a one event change against loading the events
+from scratch (rebuilding the index) on this computer.
+
+    python Host/configReloadHarness.py
+    python Host/configReloadHarness.py --case "event added"
+
+Exits with status 1 if any check fails.
+"""
+
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from simulator import Simulator, DEFAULT_SCENARIO, DEVICE_DIR, SD_CARD_DIR, loadScenario
+
+# code.py
+CONFIG_WATCH_INTERVAL = 5.0
+# Between two checks of the watcher
+EDIT_AT = 31.5
+
+with open(os.path.join(SD_CARD_DIR, "config.json"), "r", encoding="utf-8") as _fp:
+    SAMPLE = json.load(_fp)
+# The event shown at the start of the default scenario
+FIRST = SAMPLE["events"][0]
+
+
+def edited(change):
+    config = copy.deepcopy(SAMPLE)
+    change(config["events"])
+    return config
+
+
+def changeSubtitle(events):
+    events[0]["subtitle"] = "10:15 PM, gate C7"
+
+
+def addEvent(events):
+    events.insert(0, dict(FIRST, day="27", hour="08", title="Airport shuttle",
+                          subtitle="8:00 AM"))
+
+
+def removeFirst(events):
+    del events[0]
+
+
+def newCharacters(events):
+    events[0]["subtitle"] = "Zagreb, 9:45 PM"
+
+
+SUBTITLE_CHANGED = edited(changeSubtitle)
+
+# name, SD card edits, expected (added, changed, removed), labels expected
+# once the change is applied, text expected on the console
+CASES = (
+    ("subtitle changed", [{"at": EDIT_AT, "content": SUBTITLE_CHANGED}], (0, 1, 0),
+     {"title": FIRST["title"], "subtitle": "10:15 PM, gate C7"}, None),
+    ("event added", [{"at": EDIT_AT, "content": edited(addEvent)}], (1, 0, 0),
+     {"title": FIRST["title"], "statusEventCount": "2 of 20"}, None),
+    ("selected event removed", [{"at": EDIT_AT, "content": edited(removeFirst)}], (0, 0, 1),
+     {"title": SAMPLE["events"][1]["title"], "statusEventCount": "1 of 18"}, None),
+    ("unchanged rewrite", [{"at": EDIT_AT, "content": SAMPLE}], (0, 0, 0),
+     {"title": FIRST["title"], "statusEventCount": "1 of 19"}, None),
+    ("half written file",
+     [{"at": EDIT_AT, "content": json.dumps(SUBTITLE_CHANGED, indent=4)[:3000]},
+      {"at": EDIT_AT + 2 * CONFIG_WATCH_INTERVAL, "content": SUBTITLE_CHANGED}], (0, 1, 0),
+     {"title": FIRST["title"], "subtitle": "10:15 PM, gate C7"},
+     "Could not parse config.json"),
+    ("characters not in the subset", [{"at": EDIT_AT, "content": edited(newCharacters)}],
+     (0, 1, 0), {"title": FIRST["title"], "subtitle": "Zagreb, 9:45 PM"},
+     "in its subset, using the full font"),
+)
+
+
+def runCase(name, edits, expectedDiff, labels, console, codePath=None):
+    scenario = loadScenario(DEFAULT_SCENARIO)
+    scenario["touches"] = []
+    scenario["console"] = []
+    scenario["duration"] = 60
+    scenario["sdEdits"] = [dict(edit, path="config.json") for edit in edits]
+    sim = Simulator(scenario, codePath=codePath, trackAllocations=False, keepTrace=True)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        sim.run()
+    trace = sim.trace()
+    problems = []
+
+    lastEdit = edits[-1]["at"]
+    shown = {}
+    changedAt = None
+    bootAt = None
+    for r in trace:
+        if r["kind"] == "text" and r["value"][1]:
+            shown[r["target"]] = r["value"][0]
+            if bootAt is None and r["target"] == "title":
+                bootAt = r["at"]
+            if r["at"] >= lastEdit and r["target"] in labels and changedAt is None:
+                changedAt = r["at"]
+    for label, text in labels.items():
+        if shown.get(label) != text:
+            problems.append(f"{label} shows {shown.get(label)!r}, expected {text!r}")
+    if expectedDiff != (0, 0, 0):
+        if changedAt is None:
+            problems.append("the display did not change after the edit")
+        elif changedAt - lastEdit > CONFIG_WATCH_INTERVAL + 1:
+            problems.append(f"the change took {changedAt - lastEdit:.1f} s to show")
+    else:
+        rewritten = [r for r in trace if r["at"] >= lastEdit and r["kind"] == "text"
+                     and r["target"] in ("title", "subtitle") and r["value"][1]]
+        if rewritten:
+            problems.append(f"{len(rewritten)} labels rewritten for an unchanged file")
+
+    watcher = sim.namespace["config_watcher"]
+    diff = (watcher.added, watcher.changed, watcher.removed)
+    if watcher.reloads == 0:
+        problems.append("config.json was not reloaded")
+    elif diff != expectedDiff:
+        problems.append(f"added/changed/removed {diff}, expected {expectedDiff}")
+    reads = [r for r in trace if r["at"] >= edits[0]["at"]
+             and r["kind"] in ("imageload", "ondiskbitmap")]
+    if reads and labels["title"] == FIRST["title"]:
+        problems.append(f"{len(reads)} images read from the SD card after the edit")
+    # No touch chose an event, so expireBefore() may still move the selection
+    if sim.namespace["events"].chosen:
+        problems.append("the reload marked the selected event as chosen")
+    if console and console not in output.getvalue():
+        problems.append(f"no {console!r} on the console")
+
+    summary = f"added/changed/removed {diff}"
+    if changedAt is not None:
+        summary += f", shown {changedAt - lastEdit:.1f} s after the edit"
+    return problems, summary, bootAt
+
+
+def timeReload():
+    """Wall time of applying a one event change, and of loading the events
+    from scratch as loadSdCard() does after a reset."""
+    sys.path.insert(0, DEVICE_DIR)
+    import eventIndex
+    from configWatcher import configWatcher
+    from eventStore import eventStore
+
+    folder = tempfile.mkdtemp(prefix="pyportal_reload_")
+    try:
+        shutil.copy(os.path.join(SD_CARD_DIR, "config.json"), folder)
+        eventIndex.build(folder)
+        events = eventStore()
+        eventIndex.load(folder, {}, events)
+        events.sort()
+        watcher = configWatcher(folder)
+        with open(os.path.join(folder, "config.json"), "w", encoding="utf-8") as fp:
+            json.dump(SUBTITLE_CHANGED, fp, indent=4)
+        reads = events.blob.reads
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            watcher.apply({}, events)
+            reloadMs = (time.perf_counter() - start) * 1000
+        reads = events.blob.reads - reads
+
+        loadMs = None
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(5):
+                start = time.perf_counter()
+                fresh = eventStore()
+                eventIndex.build(folder)
+                eventIndex.load(folder, {}, fresh)
+                fresh.sort()
+                elapsed = (time.perf_counter() - start) * 1000
+                loadMs = elapsed if loadMs is None else min(loadMs, elapsed)
+    finally:
+        shutil.rmtree(folder)
+    return reloadMs, reads, loadMs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--code", help="path of the code.py to run")
+    parser.add_argument("--case", action="append",
+                        help="only run the cases with this name (repeatable)")
+    args = parser.parse_args(argv)
+
+    failures = 0
+    bootAt = None
+    for name, edits, expectedDiff, labels, console in CASES:
+        if args.case and name not in args.case:
+            continue
+        problems, summary, bootAt = runCase(name, edits, expectedDiff, labels, console, args.code)
+        print(f"{'FAIL' if problems else 'ok':<5}{name}: {summary}")
+        for problem in problems:
+            print(f"       {problem}")
+        failures += bool(problems)
+
+    reloadMs, reads, loadMs = timeReload()
+    print(f"One changed event: reload {reloadMs:.2f} ms ({reads} strings read), "
+          f"loading the events from scratch {loadMs:.2f} ms")
+    if bootAt is not None:
+        print(f"After a reset the first event is shown {bootAt:.1f} s (simulated) after the start")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,9 @@
+"""
+The event object that code.py kept for each event before the eventStore.
+No longer used on the device; Host/measureEventStore.py measures it
+against the eventStore.
+"""
+
 import time
 
 
@@ -14,6 +20,8 @@ class event:
         self.date = time.struct_time((year, month, day,
                                       hour, minute, 0,  # we don't track seconds
                                       -1, -1, False))  # we dont know day of week/year or DST
+        # Seconds since the epoch of the event, computed once
+        self.epoch = time.mktime(self.date)
         self.imageCountDown = imageCountDown
         self.imageEventDay = imageEventDay
         self.remainingTime = 365 * 24 * 60 * 60
@@ -23,10 +31,10 @@ class event:
         self.remainingSeconds = 0
 
     def __lt__(self, other):
-        return self.date < other.date
+        return self.epoch < other.epoch
 
     def __gt__(self, other):
-        return self.date > other.date
+        return self.epoch > other.epoch
 
     def __repr__(self):
         return "event()"
@@ -34,9 +42,10 @@ class event:
     def __str__(self):
         return f"event(title: {self.title}, subtitle: {self.subtitle}, remainingTime: {self.remainingTime}) for {self.month}/{self.day}/{self.year} {self.hour:02}:{self.minute:02}"
 
-    def remainingUpdate(self):
-        now = time.localtime()
-        remaining = time.mktime(self.date) - time.mktime(now)
+    def remainingUpdate(self, now=None):
+        if now is None:
+            now = time.time()
+        remaining = self.epoch - now
         self.remainingTime = remaining
 
         self.remainingSeconds = remaining % 60
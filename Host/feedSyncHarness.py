@@ -0,0 +1,211 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Checks the remote event feed against the local HTTP stand-in.
+
+Runs code.py in the simulator with an events_url (or an Adafruit IO
+events_feed) served by Host/timeServer.py and checks that:
+
+- the first fetch adds the events of the feed and writes feed.json with the
+  ETag and Last-Modified of the reply,
+- the hourly fetch of a feed that did not change sends them back and gets
+  304 Not Modified,
+- a new version of the feed is applied as the events added, changed and
+  removed, and the event store matches it,
+- a feed sent in chunks (Transfer-Encoding: chunked) is applied the same,
+- the next boot shows the events of the last version when the feed cannot
+  be reached,
+- the title and subtitle use the full fonts, not the subsets of
+  Host/subsetFonts.py, also when the feed is set in config.json.
+
+    python Host/feedSyncHarness.py
+    python Host/feedSyncHarness.py --case "feed changes"
+
+Exits with status 1 if any check fails.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from simulator import Simulator, DEFAULT_SCENARIO, HOST_DIR, SD_CARD_DIR, loadScenario
+
+FEED_URL = "http://feed.example/events.json"
+
+
+def sampleEvent(day, title, subtitle, image="nyc"):
+    return {"year": "2023", "month": "6", "day": str(day), "hour": "09", "minute": "00",
+            "forecolor": "0xF0C810", "title": title, "subtitle": subtitle,
+            "imageCountDown": f"{image}_background.bmp", "imageEventDay": f"{image}_event.bmp"}
+
+
+VERSION_1 = {"events": [sampleEvent(20, "Harbor tour", "Pier 17"),
+                        sampleEvent(21, "Museum", "10 AM"),
+                        sampleEvent(22, "Flight home", "JFK")]}
+# Museum moved to another subtitle, Harbor tour dropped, Concert added
+VERSION_2 = {"events": [sampleEvent(21, "Museum", "11 AM"),
+                        sampleEvent(22, "Flight home", "JFK"),
+                        sampleEvent(23, "Concert", "8 PM", "halifax")]}
+
+# name, scenario overrides, checks (feed titles -> subtitles expected in the
+# store, expected replies, expected (added, changed, removed) of the last
+# new version), use the SD card left by the case before
+CASES = (
+    ("first fetch", {"duration": 60, "eventFeed": {"versions": [[0, VERSION_1]]}},
+     {"store": {"Harbor tour": "Pier 17", "Museum": "10 AM", "Flight home": "JFK"},
+      "replies": [200], "diff": (3, 0, 0)}, False),
+    ("offline boot", {"duration": 60,
+                      "eventFeed": {"versions": [[0, VERSION_1]], "failures": [[0, 60]]}},
+     {"store": {"Harbor tour": "Pier 17", "Museum": "10 AM", "Flight home": "JFK"},
+      "replies": [500]}, True),
+    ("not modified", {"duration": 3700, "eventFeed": {"versions": [[0, VERSION_1]]}},
+     {"store": {"Harbor tour": "Pier 17", "Museum": "10 AM", "Flight home": "JFK"},
+      "replies": [200, 304], "diff": (3, 0, 0)}, False),
+    ("feed changes", {"duration": 3700,
+                      "eventFeed": {"versions": [[0, VERSION_1], [1800, VERSION_2]]}},
+     {"store": {"Museum": "11 AM", "Flight home": "JFK", "Concert": "8 PM"},
+      "gone": ["Harbor tour"], "replies": [200, 200], "diff": (1, 1, 1)}, False),
+    ("Adafruit IO feed", {"duration": 60,
+                          "secrets": {"events_feed": "countdown-events", "events_url": ""},
+                          "eventFeed": {"versions": [[0, VERSION_1]], "aio": True}},
+     {"store": {"Harbor tour": "Pier 17", "Museum": "10 AM", "Flight home": "JFK"},
+      "replies": [200], "diff": (3, 0, 0)}, False),
+    ("feed set in config.json", {"duration": 60, "secrets": {},
+                                 "eventFeed": {"versions": [[0, VERSION_1]]}},
+     {"store": {"Harbor tour": "Pier 17", "Museum": "10 AM", "Flight home": "JFK"},
+      "replies": [200], "diff": (3, 0, 0), "configFeed": True}, False),
+    ("chunked feed", {"duration": 3700,
+                      "eventFeed": {"versions": [[0, VERSION_1], [1800, VERSION_2]],
+                                    "chunked": True}},
+     {"store": {"Museum": "11 AM", "Flight home": "JFK", "Concert": "8 PM"},
+      "gone": ["Harbor tour"], "replies": [200, 200], "diff": (1, 1, 1)}, False),
+)
+
+
+def configFeedCard():
+    """A copy of the sample SD card with the feed set in the secrets of its
+    config.json, and fonts subset to it."""
+    folder = tempfile.mkdtemp(prefix="pyportal_feed_sd_")
+    shutil.copytree(SD_CARD_DIR, folder, dirs_exist_ok=True)
+    path = os.path.join(folder, "config.json")
+    with open(path, "r", encoding="utf-8") as fp:
+        config = json.load(fp)
+    config.setdefault("secrets", {})["events_url"] = FEED_URL
+    with open(path, "w", encoding="utf-8") as fp:
+        json.dump(config, fp, indent=4)
+    # In its own process, as it imports the device modules with the gc of
+    # CPython rather than the one of the simulator
+    subprocess.run([sys.executable, os.path.join(HOST_DIR, "subsetFonts.py"), folder],
+                   check=True, stdout=subprocess.DEVNULL)
+    return folder
+
+
+def runCase(name, overrides, expected, sdSource, codePath=None):
+    scenario = loadScenario(DEFAULT_SCENARIO)
+    scenario["touches"] = []
+    scenario["console"] = []
+    scenario["secrets"] = {"events_url": FEED_URL}
+    scenario.update(overrides)
+    card = configFeedCard() if expected.get("configFeed") else None
+    try:
+        sim = Simulator(scenario, codePath=codePath, sdSource=card or sdSource,
+                        trackAllocations=False, keepTrace=True, keepSd=True)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            sim.run()
+    finally:
+        if card is not None:
+            shutil.rmtree(card, ignore_errors=True)
+    trace = sim.trace()
+    problems = []
+
+    # The feed's titles are not known when the fonts are subset
+    window = sim.namespace["eventWindow"]
+    for label in ("title", "subtitle"):
+        if getattr(window, label).font in window._subsetFonts:
+            problems.append(f"the {label} uses a subset font")
+
+    requests = [r for r in trace if r["kind"] == "feed_request"]
+    replies = [r["value"] for r in trace if r["kind"] == "feed_reply"]
+    if replies[:len(expected["replies"])] != expected["replies"]:
+        problems.append(f"replies {replies}, expected {expected['replies']}")
+    # Every request after a new version sends its validators back
+    for request, reply in zip(requests[1:], replies):
+        if reply == 200 and not request["value"]["etag"]:
+            problems.append(f"the request at {request['at']:.0f} s had no If-None-Match")
+
+    # The event store, with the strings on the SD card of the run
+    originals = sim._patchPaths()
+    try:
+        store = sim.namespace["events"]
+        shown = {store.title(i): store.subtitle(i) for i in range(store.count())}
+    finally:
+        sim._restorePaths(originals)
+    for title, subtitle in expected["store"].items():
+        if shown.get(title) != subtitle:
+            problems.append(f"{title!r} is {shown.get(title)!r} in the store, expected {subtitle!r}")
+    for title in expected.get("gone", ()):
+        if title in shown:
+            problems.append(f"{title!r} is still in the store")
+
+    feed = sim.namespace.get("feed_sync")
+    if "diff" in expected and feed is not None:
+        diff = (feed.added, feed.changed, feed.removed)
+        if diff != expected["diff"]:
+            problems.append(f"last version added/changed/removed {diff}, expected {expected['diff']}")
+    path = os.path.join(sim.sdRoot, "feed.json")
+    if not os.path.exists(path):
+        problems.append("feed.json was not written")
+    else:
+        with open(path, "r", encoding="utf-8") as fp:
+            saved = json.load(fp)
+        if not saved.get("etag") or not saved.get("lastModified"):
+            problems.append("feed.json has no ETag or Last-Modified")
+        if sorted(e["title"] for e in saved["events"]) != sorted(expected["store"]):
+            problems.append("feed.json does not hold the events of the last version")
+
+    summary = (f"{len(requests)} requests, replies {replies}, "
+               f"{store.count()} events in the store")
+    return problems, summary, sim.sdRoot
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--code", help="path of the code.py to run")
+    parser.add_argument("--case", action="append",
+                        help="only run the cases with this name (repeatable)")
+    args = parser.parse_args(argv)
+
+    failures = 0
+    lastSd = None
+    folders = []
+    try:
+        for name, overrides, expected, useLastSd in CASES:
+            if args.case and name not in args.case:
+                continue
+            if useLastSd and lastSd is None:
+                print(f"skip {name}: needs the case before it")
+                continue
+            problems, summary, lastSd = runCase(name, overrides, expected,
+                                                lastSd if useLastSd else None, args.code)
+            folders.append(lastSd)
+            print(f"{'FAIL' if problems else 'ok':<5}{name}: {summary}")
+            for problem in problems:
+                print(f"       {problem}")
+            failures += bool(problems)
+    finally:
+        for folder in folders:
+            shutil.rmtree(folder, ignore_errors=True)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Checks the Wi-Fi bars shown for scripted signal strengths.
+
+Runs code.py in the simulator with a steady signal in each band, jumps of
+several levels, a move that stays within the hysteresis and a reconnect,
+and checks that:
+
+- the first reading after the link comes up sets the bars at once,
+- a jump moves the bars all the way to the level of the new signal,
+- a move of less than the hysteresis past a threshold keeps the bars,
+- the Wi-Fi sprite shows the bars of linkMonitor.
+
+    python Host/linkMonitorHarness.py
+    python Host/linkMonitorHarness.py --case "steady mid-range"
+
+Exits with status 1 if any check fails.
+"""
+
+import argparse
+import contextlib
+import io
+import sys
+
+from simulator import Simulator, DEFAULT_SCENARIO, loadScenario
+
+# name, scenario overrides, bars expected at the end
+CASES = (
+    ("steady mid-range", {"duration": 60, "rssi": [[0, -54]]}, 3),
+    ("steady strong", {"duration": 60, "rssi": [[0, -28]]}, 4),
+    ("steady weak", {"duration": 60, "rssi": [[0, -80]]}, 1),
+    ("drop of two levels", {"duration": 90, "rssi": [[0, -25], [30, -66]]}, 2),
+    ("rise of three levels", {"duration": 90, "rssi": [[0, -85], [30, -45]]}, 3),
+    ("within the hysteresis", {"duration": 90, "rssi": [[0, -54], [30, -57]]}, 3),
+    ("reconnect", {"duration": 90, "rssi": [[0, -80], [30, -40]],
+                   "connected": [[0, True], [20, False], [40, True]]}, 3),
+)
+
+
+def runCase(name, overrides, expected, codePath=None):
+    scenario = loadScenario(DEFAULT_SCENARIO)
+    scenario["touches"] = []
+    scenario["console"] = []
+    scenario.update(overrides)
+    sim = Simulator(scenario, codePath=codePath, trackAllocations=False, keepTrace=True)
+    # The console output of code.py is not part of the checks
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim.run()
+    problems = []
+
+    monitor = sim.namespace["link_monitor"]
+    window = sim.namespace["eventWindow"]
+    if monitor.bars != expected:
+        problems.append(f"{monitor.bars} bars at {monitor.dBm()} dBm, expected {expected}")
+    if window.spritesWifi and window.spritesWifi[0] != window.iconTile(window.ICON_WIFI, monitor.bars):
+        problems.append(f"the sprite shows tile {window.spritesWifi[0]}, not {monitor.bars} bars")
+
+    print(f"{'FAIL' if problems else 'ok':<5}{name}: {monitor.bars} bars at {monitor.dBm()} dBm, "
+          f"{monitor.reads} link reads")
+    for problem in problems:
+        print(f"       {problem}")
+    return not problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--case", action="append",
+                        help="only run the cases with this name (repeatable)")
+    parser.add_argument("--code", help="path of the code.py to run")
+    args = parser.parse_args(argv)
+
+    failures = 0
+    for name, overrides, expected in CASES:
+        if args.case and name not in args.case:
+            continue
+        if not runCase(name, overrides, expected, args.code):
+            failures += 1
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Measures the agenda: its frames against the event view's, and the heap of
+its text grid against the Labels it replaces.
+
+Runs Host/scenarios/agenda.json in the simulator (open the agenda, scroll
+it a row at a time and held, close it, leave it open across the minute
+boundaries) and splits the frames into those that wrote the agenda, those
+that changed the event on the screen and the clock ticks, with the wall
+time and the allocations of each and the cells the agenda frames wrote.
+
+The heap is estimated for the rows the agenda shows at the end of the run.
+The text grid is the font bitmap, one TileGrid and a byte per cell. The same rows
+drawn with Labels take two per row (the title and the time left), each
+with a TileGrid per character, plus the glyphs of the titles that the
+status font does not load for the interface. A Label also makes its
+TileGrids again whenever its text changes, which the grid never does.
+
+    python Host/measureAgenda.py
+"""
+
+import argparse
+import bisect
+import contextlib
+import io
+import os
+import struct
+
+from buildIconAtlas import bitmapBytes
+from simulator import Simulator, HOST_DIR, DEVICE_DIR, loadScenario, percentiles
+from subsetFonts import BdfFont
+from eventDisplay import eventDisplay
+
+AGENDA_SCENARIO = os.path.join(HOST_DIR, "scenarios", "agenda.json")
+FONTS_DIR = os.path.join(DEVICE_DIR, "fonts")
+# Heap of the objects on the device, estimated from the C structures of
+# CircuitPython 8 and the MicroPython object headers
+TILEGRID_BYTES = 80
+# A Label besides its glyphs: the object and its attributes, its two
+# Groups and its Palette
+LABEL_BYTES = 320
+# The textGrid object and its attributes, besides its tables
+TEXTGRID_BYTES = 96
+# The character to tile table of textGrid
+ASCII_TABLE_BYTES = 128
+
+
+# **************** FRAMES ******************
+def frameKinds(traced, measured):
+    """
+    Splits the frames of the measured run by what they drew in the traced
+    run of the same scenario: agenda, event or clock. The trace itself
+    allocates, so it is kept out of the measured run. Returns the frames of
+    each and the agenda cells each agenda frame wrote.
+    """
+    iterations = sorted(f["at"] for f in traced.metrics.frames + traced.metrics.idle)
+    # The Wi-Fi icon is the other TileGrid that changes
+    first, count = traced.namespace["eventWindow"].icons[eventDisplay.ICON_WIFI]
+    cells = {}
+    kinds = {}
+    for r in traced.trace():
+        # The records of an iteration come at or after its start
+        at = iterations[max(0, bisect.bisect_right(iterations, round(r["at"], 3)) - 1)]
+        if r["kind"] == "tile" and not (r["target"] == 0 and first <= r["value"] < first + count):
+            kinds.setdefault(at, set()).add("agenda")
+            cells[at] = cells.get(at, 0) + 1
+        elif r["kind"] == "text" and r["value"][1] and r["target"] in ("title", "countMinutes"):
+            kinds.setdefault(at, set()).add("event")
+    groups = {"agenda": [], "event": [], "clock": []}
+    written = []
+    for frame in measured.metrics.frames:
+        drawn = kinds.get(frame["at"], ())
+        if "agenda" in drawn:
+            groups["agenda"].append(frame)
+            written.append(cells[frame["at"]])
+        elif "event" in drawn:
+            groups["event"].append(frame)
+        else:
+            groups["clock"].append(frame)
+    return groups, written
+
+
+def agendaRows(sim):
+    """The text of the rows of the agenda at the end of the run."""
+    with open(os.path.join(FONTS_DIR, eventDisplay.FONT_GRID_MANIFEST), "r", encoding="utf-8") as fp:
+        fp.readline()
+        characters = fp.readline().rstrip("\n")
+    agenda = sim.namespace["eventWindow"].agenda
+    text = "".join(characters[agenda.grid[i]] for i in range(agenda.columns * agenda.rows))
+    return [text[i:i + agenda.columns] for i in range(0, len(text), agenda.columns)]
+
+
+# **************** HEAP ******************
+def gridHeap():
+    with open(os.path.join(FONTS_DIR, eventDisplay.FONT_GRID), "rb") as fp:
+        header = fp.read(30)
+    width, height, _, bpp = struct.unpack_from("<iiHH", header, 18)
+    cells = eventDisplay.AGENDA_COLUMNS * eventDisplay.AGENDA_ROWS
+    return {
+        "font bitmap": bitmapBytes(width, abs(height), 1 << bpp),
+        "TileGrid": TILEGRID_BYTES,
+        f"tiles ({cells} cells)": cells,
+        "textGrid and its table": TEXTGRID_BYTES + ASCII_TABLE_BYTES,
+    }
+
+
+def labelHeap(rows):
+    """Heap of the rows drawn with two Labels each, and the TileGrids one
+    scroll (all the rows written again) makes."""
+    font = BdfFont(os.path.join(FONTS_DIR, eventDisplay.FONT_STATUS))
+    inked = {}
+    for code, lines in font.glyphs.items():
+        for line in lines:
+            if line.startswith("BBX"):
+                width, height = (int(v) for v in line.split()[1:3])
+                inked[code] = width > 0 and height > 0
+                break
+    column = eventDisplay.AGENDA_COLUMNS - eventDisplay.AGENDA_TIME_WIDTH
+    texts = []
+    for row in rows:
+        for text in (row[:column].strip(), row[column:].strip()):
+            if text:
+                texts.append(text)
+    glyphs = sum(1 for text in texts for c in text if inked.get(ord(c)))
+    extra = {ord(c) for text in texts for c in text} - {ord(c) for c in eventDisplay.GLYPHS_STATUS}
+    labels = 2 * eventDisplay.AGENDA_ROWS
+    return {
+        f"Labels ({labels})": labels * LABEL_BYTES,
+        f"TileGrids ({glyphs} characters)": glyphs * TILEGRID_BYTES,
+        f"glyphs not loaded for the interface ({len(extra)})": font.bitmapBytes(extra),
+    }, glyphs * TILEGRID_BYTES
+
+
+def printHeap(name, parts):
+    total = sum(parts.values())
+    print(f"{name}: {total} bytes")
+    for part, size in parts.items():
+        print(f"  {part:<40} {size:>6}")
+    return total
+
+
+def formatFrames(name, frames):
+    if not frames:
+        return f"{name:<14} (none)"
+    wall = percentiles([f["wallUs"] for f in frames])
+    alloc = percentiles([f["allocBytes"] for f in frames])
+    return (f"{name:<14} n={wall['count']:<4} wall p50={wall['p50']:.0f} p95={wall['p95']:.0f} "
+            f"max={wall['max']:.0f} us  allocations p50={alloc['p50']:.0f} "
+            f"max={alloc['max']:.0f} bytes")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("scenario", nargs="?", default=AGENDA_SCENARIO)
+    args = parser.parse_args(argv)
+
+    runs = []
+    for keepTrace in (True, False):
+        sim = Simulator(loadScenario(args.scenario), trackAllocations=not keepTrace,
+                        keepTrace=keepTrace)
+        with contextlib.redirect_stdout(io.StringIO()):
+            sim.run()
+        runs.append(sim)
+    traced, measured = runs
+    groups, cells = frameKinds(traced, measured)
+    # The first agenda frame reads the font
+    opened = groups["agenda"].pop(0)
+    cells.pop(0)
+    print(f"Frames of {os.path.basename(args.scenario)} (CPython):")
+    print(f"  {'agenda open':<14} {opened['wallUs']:.0f} us, {opened['allocBytes']} bytes "
+          f"allocated (reads the font the first time)")
+    for name in ("agenda", "event", "clock"):
+        print("  " + formatFrames(name, groups[name]))
+    if cells:
+        print(f"  cells written by an agenda frame: p50={percentiles(cells)['p50']} "
+              f"max={max(cells)} of {eventDisplay.AGENDA_COLUMNS * eventDisplay.AGENDA_ROWS}")
+
+    # The scenario ends with the agenda open at its first row
+    rows = agendaRows(traced)
+    print("\nAgenda at the end of the run:")
+    for row in rows:
+        print(f"  |{row}|")
+    print()
+    grid = printHeap("Text grid", gridHeap())
+    parts, churn = labelHeap(rows)
+    labels = printHeap("Labels", parts)
+    print(f"The grid takes {grid} bytes, {100 * grid / labels:.0f} % of the {labels} bytes of "
+          f"the Labels. A scroll only changes its tile indices, where the Labels make "
+          f"about {churn} bytes of TileGrids again.")
+
+
+if __name__ == "__main__":
+    main()
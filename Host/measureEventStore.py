@@ -0,0 +1,176 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Compares the heap used by a list of event objects with the eventStore, for
+10, 100 and 1000 events.
+
+    python Host/measureEventStore.py
+    python Host/measureEventStore.py --counts 10 100 1000 5000
+
+Three layouts are measured with tracemalloc: the list of event objects the
+code used to keep (Host/event.py), the eventStore with its strings in RAM (config.json
+without an index) and the eventStore loaded from the compiled index (strings
+left on the SD card). CPython objects are larger than CircuitPython ones, so
+compare the ratios rather than the byte counts.
+
+A second table compares a daily event stored as one event per occurrence
+with the same event stored once with a repeat rule, and the peak heap of
+taking all its occurrences from eventStore.upcoming().
+"""
+
+import argparse
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ["TZ"] = "UTC"
+time.tzset()
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HOST_DIR), "PyPortal"))
+
+import eventIndex  # noqa: E402
+from event import event  # noqa: E402
+from eventRecurrence import DAILY, makeRule  # noqa: E402
+from eventStore import eventStore  # noqa: E402
+
+# 2024-01-01 00:00 UTC
+FIRST_EPOCH = 1704067200
+# Time of day of the first event, 09:30
+FIRST_TIME = 9 * 3600 + 30 * 60
+IMAGES = ("images/birthday.bmp", "images/cruise.bmp", "images/holiday.bmp",
+          "images/flight.bmp", "images/hotel.bmp")
+
+
+def sampleRecords(count, step=86400):
+    """config.json style records: unique titles, a few shared subtitles and
+    images, one event every `step` seconds from FIRST_EPOCH 09:30."""
+    records = []
+    for i in range(count):
+        t = time.gmtime(FIRST_EPOCH + FIRST_TIME + i * step)
+        records.append({
+            "title": f"Event number {i + 1}",
+            "subtitle": ("Barcelona, Spain", "Rome, Italy", "At Sea")[i % 3],
+            "year": t.tm_year, "month": t.tm_mon, "day": t.tm_mday,
+            "hour": t.tm_hour, "minute": t.tm_min,
+            "imageCountDown": IMAGES[i % len(IMAGES)],
+            "imageEventDay": IMAGES[(i + 1) % len(IMAGES)],
+            "forecolor": "0xF0C810",
+        })
+    return records
+
+
+def buildEvents(records):
+    events = []
+    for r in records:
+        events.append(event(r["title"], r["subtitle"], r["year"], r["month"], r["day"],
+                            r["hour"], r["minute"], r["imageCountDown"],
+                            r["imageEventDay"], int(r["forecolor"], 16)))
+    return events
+
+
+def buildStore(records):
+    store = eventStore()
+    for r in records:
+        store.addRecord(r)
+    store.sort()
+    return store
+
+
+def buildIndexedStore(folder):
+    store = eventStore()
+    eventIndex.load(folder, {}, store)
+    return store
+
+
+def buildExpanded(count):
+    store = eventStore()
+    for i in range(count):
+        store.add(FIRST_EPOCH + FIRST_TIME + i * 86400, 0xF0C810, "Daily event",
+                  "At Sea", IMAGES[0], IMAGES[1])
+    store.sort()
+    return store
+
+
+def buildRepeating(count):
+    store = eventStore()
+    store.add(FIRST_EPOCH + FIRST_TIME, 0xF0C810, "Daily event", "At Sea", IMAGES[0],
+              IMAGES[1], makeRule(DAILY), FIRST_EPOCH + count * 86400)
+    store.sort()
+    return store
+
+
+def upcomingPeak(store, count):
+    """Peak bytes allocated while taking count occurrences from upcoming()."""
+    gc.collect()
+    tracemalloc.start()
+    taken = 0
+    for epoch, i in store.upcoming():
+        taken += 1
+        if taken == count:
+            break
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def measure(build, *args):
+    """Bytes still allocated by the object that build returns."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build(*args)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return used
+
+
+def writeConfig(folder, records):
+    with open(os.path.join(folder, eventIndex.CONFIG_FILE), "w") as fp:
+        json.dump({"secrets": {}, "events": records}, fp)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--counts", type=int, nargs="+", default=[10, 100, 1000])
+    args = parser.parse_args(argv)
+
+    print(f"{'Events':>7} {'event objects':>14} {'store (RAM)':>12} {'store (index)':>14}"
+          f" {'per event':>22} {'events/KB':>20}")
+    folder = tempfile.mkdtemp(prefix="pyportal_store_")
+    try:
+        for count in args.counts:
+            records = sampleRecords(count)
+            writeConfig(folder, records)
+            eventIndex.build(folder)
+
+            objects = measure(buildEvents, records)
+            store = measure(buildStore, records)
+            indexed = measure(buildIndexedStore, folder)
+            perEvent = f"{objects // count}/{store // count}/{indexed // count}"
+            perKb = (f"{1024 * count / objects:.1f}/{1024 * count / store:.1f}/"
+                     f"{1024 * count / indexed:.1f}")
+            print(f"{count:>7} {objects:>14} {store:>12} {indexed:>14} {perEvent:>22} {perKb:>20}")
+    finally:
+        shutil.rmtree(folder)
+
+    print()
+    print(f"{'Occurrences':>11} {'one per occurrence':>19} {'repeating':>10} {'upcoming() peak':>16}")
+    for count in args.counts:
+        expanded = measure(buildExpanded, count)
+        repeating = measure(buildRepeating, count)
+        peak = upcomingPeak(buildRepeating(count), count)
+        print(f"{count:>11} {expanded:>19} {repeating:>10} {peak:>16}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,482 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Headless host simulator for the PyPortal_Events code.
+
+Runs PyPortal/code.py under CPython against the stand-in modules in
+Host/stubs, driven by a virtual clock and a scripted input feed (touch
+points, light and temperature readings, RSSI, time sync behaviour). Every
+label text change, background swap and brightness write is recorded, and the
+wall time and allocations of each main loop iteration are measured.
+
+    python Host/simulator.py Host/scenarios/default.json
+    python Host/simulator.py --duration 600 --trace trace.json
+
+Times and allocations are those of CPython on the host. They are not the
+numbers of the SAMD51 but they move the same way when the hot path changes,
+which is what a regression check needs.
+"""
+
+import argparse
+import builtins
+import calendar
+import datetime
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time as _time
+import tracemalloc
+import types
+
+import compileAssets
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(HOST_DIR)
+STUBS_DIR = os.path.join(HOST_DIR, "stubs")
+DEVICE_DIR = os.path.join(REPO_DIR, "PyPortal")
+SD_CARD_DIR = os.path.join(REPO_DIR, "SD_Card")
+DEFAULT_SCENARIO = os.path.join(HOST_DIR, "scenarios", "default.json")
+
+if STUBS_DIR not in sys.path:
+    sys.path.insert(0, STUBS_DIR)
+
+import simhooks  # noqa: E402
+from timeServer import TimeServer  # noqa: E402
+
+# Record kinds that change what is on the screen
+WRITE_KINDS = ("text", "color", "brightness", "auto_refresh", "refresh",
+               "ondiskbitmap", "imageload", "tile", "show")
+
+
+# **************** HELPERS ******************
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    n = len(ordered)
+    return {
+        "count": n,
+        "min": ordered[0],
+        "p50": ordered[n // 2],
+        "p95": ordered[min(n - 1, (n * 95) // 100)],
+        "max": ordered[-1],
+        "mean": sum(ordered) / n,
+    }
+
+
+def parseStart(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    moment = datetime.datetime.fromisoformat(value)
+    return float(calendar.timegm(moment.timetuple()))
+
+
+def loadScenario(path):
+    with open(path, "r") as fp:
+        return json.load(fp)
+
+
+def micropythonInt(value=0, base=None):
+    """int() as in CircuitPython, where a string without an explicit base is
+    parsed with its prefix (the config file stores colors as "0xF0C810").
+    """
+    if base is not None:
+        return int(value, base)
+    if isinstance(value, (str, bytes, bytearray)):
+        text = value.strip().lower()
+        if isinstance(text, (bytes, bytearray)):
+            text = text.decode()
+        sign = text[:1] if text[:1] in "+-" else ""
+        if text[len(sign):len(sign) + 2] in ("0x", "0o", "0b"):
+            return int(text, 0)
+        return int(text, 10)
+    return int(value)
+
+
+def makeGcModule(heap):
+    """The CPython gc module with the CircuitPython mem_free()/mem_alloc()
+    added, backed by the heap model of the simulator.
+    """
+    import gc as _gc
+    module = types.ModuleType("gc")
+    for name in dir(_gc):
+        if not name.startswith("__"):
+            setattr(module, name, getattr(_gc, name))
+    module.mem_free = heap.memFree
+    module.mem_alloc = lambda: heap.bitmapBytes
+    return module
+
+
+def makeTimeModule(clock):
+    """Build a replacement for the CircuitPython `time` module driven by the
+    virtual clock. The device RTC holds local time, so localtime() and
+    mktime() are plain conversions without any time zone.
+    """
+    module = types.ModuleType("time")
+    module.struct_time = _time.struct_time
+
+    def now():
+        return int(clock.rtc())
+
+    def sleep(seconds):
+        simhooks.idle(seconds)
+
+    def localtime(secs=None):
+        return _time.gmtime(int(clock.rtc()) if secs is None else secs)
+
+    def mktime(t):
+        return calendar.timegm(tuple(t)[:6] + (0, 0, 0))
+
+    module.time = now
+    module.sleep = sleep
+    module.monotonic = clock.monotonic
+    # The virtual clock only moves while code.py sleeps, so the wall time
+    # is added in for the profiler to have durations to measure
+    wallStart = _time.perf_counter_ns()
+    module.monotonic_ns = lambda: (int(clock.monotonic() * 1000000000)
+                                   + _time.perf_counter_ns() - wallStart)
+    module.localtime = localtime
+    module.mktime = mktime
+    return module
+
+
+# **************** METRICS ******************
+class LoopMetrics:
+    """Measures each main loop iteration, delimited by the touch poll at the
+    top of the loop. Iterations that wrote to the display are frames; the
+    others are idle iterations (spins of a busy-wait, or polls with nothing
+    to do).
+
+    Also measures the touch to screen latency: from the scripted start of
+    each touch to the first display refresh after the code read it.
+    """
+
+    def __init__(self, trackAllocations=True):
+        self.trackAllocations = trackAllocations
+        self.frames = []
+        self.idle = []
+        self.writes = 0
+        self.labelWrites = 0
+        self.labelChanges = 0
+        self._start = None
+        self._startVirtual = 0.0
+        self.touchLatencies = []
+        self._touchesSeen = set()
+        self._touchPending = None
+
+    def onRecord(self, kind, target, value):
+        if kind in WRITE_KINDS:
+            self.writes += 1
+        if kind == "touch":
+            touch = simhooks.feed.touchAt(simhooks.elapsed())
+            if touch is not None and id(touch) not in self._touchesSeen:
+                self._touchesSeen.add(id(touch))
+                if self._touchPending is None:
+                    self._touchPending = touch["at"]
+        elif kind == "refresh" and self._touchPending is not None:
+            self.touchLatencies.append((simhooks.elapsed() - self._touchPending) * 1000.0)
+            self._touchPending = None
+        if kind == "text":
+            self.labelWrites += 1
+            if value[1]:
+                self.labelChanges += 1
+
+    def onLoop(self):
+        now = _time.perf_counter_ns()
+        if self._start is not None:
+            sample = {
+                "at": round(self._startVirtual, 3),
+                "wallUs": (now - self._start) / 1000.0,
+                "writes": self.writes,
+            }
+            if self.trackAllocations:
+                current, peak = tracemalloc.get_traced_memory()
+                sample["allocBytes"] = peak - self._baseline
+                sample["netBytes"] = current - self._baseline
+            if self.writes:
+                self.frames.append(sample)
+            else:
+                self.idle.append(sample)
+        self.writes = 0
+        if self.trackAllocations:
+            tracemalloc.reset_peak()
+            self._baseline = tracemalloc.get_traced_memory()[0]
+        self._startVirtual = simhooks.elapsed()
+        self._start = _time.perf_counter_ns()
+
+    def summary(self):
+        result = {
+            "iterations": len(self.frames) + len(self.idle),
+            "frames": len(self.frames),
+            "frameWallUs": percentiles([f["wallUs"] for f in self.frames]),
+            "idleWallUs": percentiles([f["wallUs"] for f in self.idle]),
+            "labelWrites": self.labelWrites,
+            "labelChanges": self.labelChanges,
+            "touchToScreenMs": percentiles(self.touchLatencies),
+        }
+        if self.trackAllocations:
+            result["frameAllocBytes"] = percentiles(
+                [f["allocBytes"] for f in self.frames])
+            result["frameNetBytes"] = percentiles(
+                [f["netBytes"] for f in self.frames])
+        return result
+
+
+# **************** SIMULATOR ******************
+class Simulator:
+    def __init__(self, scenario=None, codePath=None, sdSource=None,
+                 trackAllocations=True, keepTrace=False, keepSd=False, nvm=None):
+        self.scenario = scenario or {}
+        self.codePath = codePath or os.path.join(DEVICE_DIR, "code.py")
+        self.sdSource = sdSource or SD_CARD_DIR
+        self.trackAllocations = trackAllocations
+        self.keepTrace = keepTrace
+        # Leave the SD card folder (sdRoot) for the caller to look at and remove
+        self.keepSd = keepSd
+        # The NVM at the start of the run (erased if None), then at its end,
+        # to be passed to the next run to simulate a reset
+        self.nvm = bytearray(nvm) if nvm is not None else None
+        self.namespace = None
+        self.recorder = None
+        self.metrics = None
+        self.sdRoot = None
+
+    def _patchPaths(self):
+        originals = {"open": builtins.open}
+        mapPath = simhooks.mapPath
+
+        def mappedOpen(file, *args, **kwargs):
+            return originals["open"](mapPath(file), *args, **kwargs)
+
+        builtins.open = mappedOpen
+        for name in ("stat", "listdir", "remove", "rename", "mkdir", "rmdir"):
+            original = getattr(os, name)
+            originals[name] = original
+
+            def wrapper(path, *args, _original=original, **kwargs):
+                args = [mapPath(a) for a in args]
+                return _original(mapPath(path), *args, **kwargs)
+
+            setattr(os, name, wrapper)
+        return originals
+
+    def _restorePaths(self, originals):
+        builtins.open = originals.pop("open")
+        for name, original in originals.items():
+            setattr(os, name, original)
+
+    def labelNames(self):
+        """Map id(label) to the attribute name on the eventDisplay object."""
+        names = {}
+        window = (self.namespace or {}).get("eventWindow")
+        if window is not None:
+            for name, value in vars(window).items():
+                if hasattr(value, "bounding_box"):
+                    names[id(value)] = name
+        return names
+
+    def run(self):
+        start = parseStart(self.scenario.get("start", "2023-05-26T20:00:00"))
+        duration = float(self.scenario.get("duration", 60))
+        clock = simhooks.Clock(start, bool(self.scenario.get("rtcSet", False)))
+        recorder = simhooks.Recorder(clock)
+        if not self.keepTrace:
+            recorder.records = _Discard()
+        metrics = LoopMetrics(self.trackAllocations)
+        recorder.listeners.append(metrics.onRecord)
+        self.recorder = recorder
+        self.metrics = metrics
+
+        self.sdRoot = tempfile.mkdtemp(prefix="pyportal_sd_")
+        shutil.copytree(self.sdSource, self.sdRoot, dirs_exist_ok=True)
+        if self.scenario.get("compileAssets"):
+            # The images as Host/compileAssets.py writes them for the device
+            compileAssets.compileAssets(self.sdRoot)
+        heap = simhooks.Heap(int(self.scenario.get("memFree", 120000)))
+        timeServer = TimeServer()
+        # Repeatable backoff jitter
+        random.seed(self.scenario.get("seed", 0))
+        simhooks.configure(clock, simhooks.Feed(self.scenario), recorder,
+                           self.sdRoot, start + duration, metrics.onLoop, heap,
+                           timeServer, self.nvm)
+        self.nvm = simhooks.nvm
+
+        savedPath = list(sys.path)
+        savedModules = set(sys.modules)
+        savedTime = sys.modules["time"]
+        savedGc = sys.modules.get("gc")
+        # The stand-in asyncio runs the tasks on the virtual clock
+        savedAsyncio = sys.modules.pop("asyncio", None)
+        # The device modules shadow standard library names (secrets, code)
+        for name in ("secrets", "event", "eventDisplay"):
+            sys.modules.pop(name, None)
+        sys.path[:0] = [STUBS_DIR, HOST_DIR, DEVICE_DIR]
+
+        import adafruit_touchscreen
+        adafruit_touchscreen.pollCost = float(self.scenario.get("pollInterval", 0.01))
+        # Settings of secrets.py for this scenario, e.g. the events_url
+        import secrets as deviceSecrets
+        deviceSecrets.secrets.update(self.scenario.get("secrets", {}))
+
+        originals = self._patchPaths()
+        sys.modules["time"] = makeTimeModule(clock)
+        sys.modules["gc"] = makeGcModule(heap)
+        savedStdin = sys.stdin
+        sys.stdin = simhooks.feed.console
+        self.namespace = {"__name__": "__main__", "__file__": self.codePath,
+                          "int": micropythonInt}
+        if self.trackAllocations:
+            tracemalloc.start()
+        wallStart = _time.perf_counter()
+        try:
+            with originals["open"](self.codePath, "r") as fp:
+                source = fp.read()
+            exec(compile(source, self.codePath, "exec"), self.namespace)
+        except simhooks.SimulationComplete:
+            pass
+        finally:
+            metrics.onLoop()
+            wallSeconds = _time.perf_counter() - wallStart
+            if self.trackAllocations:
+                tracemalloc.stop()
+            sys.modules["time"] = savedTime
+            sys.stdin = savedStdin
+            if savedGc is None:
+                sys.modules.pop("gc", None)
+            else:
+                sys.modules["gc"] = savedGc
+            self._restorePaths(originals)
+            sys.path[:] = savedPath
+            for name in set(sys.modules) - savedModules:
+                if name != "simhooks":
+                    del sys.modules[name]
+            if savedAsyncio is not None:
+                sys.modules["asyncio"] = savedAsyncio
+            if not self.keepSd:
+                shutil.rmtree(self.sdRoot, ignore_errors=True)
+            timeServer.server_close()
+
+        report = {
+            "start": datetime.datetime.fromtimestamp(
+                start, datetime.timezone.utc).replace(tzinfo=None).isoformat(),
+            "simulatedSeconds": round(clock.elapsed(), 3),
+            "idleSeconds": round(clock.idle, 3),
+            "wallSeconds": round(wallSeconds, 3),
+            "counts": dict(recorder.counts),
+        }
+        report.update(metrics.summary())
+        window = self.namespace.get("eventWindow")
+        if hasattr(window, "pixelsRedrawn"):
+            report["redrawn"] = {"labels": window.labelsRedrawn,
+                                 "pixels": window.pixelsRedrawn}
+        if hasattr(window, "backgroundCacheHits"):
+            report["backgroundCache"] = {
+                "hits": window.backgroundCacheHits,
+                "misses": window.backgroundCacheMisses,
+                "bytes": window.backgroundCacheUsed,
+                "budget": window.backgroundCacheBytes,
+                "entries": len(window.backgroundCache),
+                "prefetchSkipped": window.backgroundPrefetchSkipped}
+        return report
+
+    def trace(self):
+        names = self.labelNames()
+        out = []
+        for at, kind, target, value in self.recorder.records:
+            if kind in ("text", "color"):
+                target = names.get(target, target)
+            out.append({"at": at, "kind": kind, "target": target, "value": value})
+        return out
+
+
+class _Discard(list):
+    def append(self, item):
+        pass
+
+
+# **************** REPORT ******************
+def formatStats(name, stats, unit):
+    if not stats or not stats.get("count"):
+        return f"{name:<22} (none)"
+    return (f"{name:<22} n={stats['count']:<6} min={stats['min']:.1f} "
+            f"p50={stats['p50']:.1f} p95={stats['p95']:.1f} "
+            f"max={stats['max']:.1f} {unit}")
+
+
+def printReport(report):
+    print(f"Simulated {report['simulatedSeconds']} s from {report['start']} "
+          f"in {report['wallSeconds']} s of wall time")
+    busy = 0.0
+    if report["simulatedSeconds"]:
+        busy = 100.0 * (1.0 - report["idleSeconds"] / report["simulatedSeconds"])
+    print(f"Loop iterations: {report['iterations']}  frames: {report['frames']}  "
+          f"busy: {busy:.1f} % of the time (sleeping {report['idleSeconds']} s)")
+    print(formatStats("Frame time", report["frameWallUs"], "us"))
+    print(formatStats("Idle iteration time", report["idleWallUs"], "us"))
+    print(formatStats("Touch to screen", report["touchToScreenMs"], "ms"))
+    if "frameAllocBytes" in report:
+        print(formatStats("Frame allocations", report["frameAllocBytes"], "bytes"))
+    print(f"Label writes: {report['labelWrites']} "
+          f"(changed {report['labelChanges']})")
+    counts = report["counts"]
+    print(f"Backgrounds opened: {counts.get('ondiskbitmap', 0)}  "
+          f"brightness writes: {counts.get('brightness', 0)}  "
+          f"I2C reads: {counts.get('i2c', 0)}  SPI calls: {counts.get('spi', 0)}  "
+          f"time syncs: {counts.get('rtc_set', 0)} "
+          f"of {counts.get('get_local_time', 0) + counts.get('http_request', 0)} requests")
+    print(f"Display refreshes: {counts.get('refresh', 0)} "
+          f"(over an OnDiskBitmap: {counts.get('sd_refresh', 0)})  "
+          f"auto_refresh writes: {counts.get('auto_refresh', 0)}")
+    if "redrawn" in report:
+        print(f"Redrawn by eventDisplay: {report['redrawn']['labels']} labels, "
+              f"{report['redrawn']['pixels']} pixels")
+    if "backgroundCache" in report:
+        cache = report["backgroundCache"]
+        print(f"Background cache: {cache['hits']} hits, {cache['misses']} misses, "
+              f"{cache['entries']} entries using {cache['bytes']} of {cache['budget']} bytes, "
+              f"{cache['prefetchSkipped']} prefetches skipped")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("scenario", nargs="?", default=DEFAULT_SCENARIO)
+    parser.add_argument("--duration", type=float,
+                        help="seconds of virtual time to simulate")
+    parser.add_argument("--poll", type=float,
+                        help="virtual seconds consumed by one touch poll")
+    parser.add_argument("--sd", help="folder used as the SD card")
+    parser.add_argument("--code", help="path of the code.py to run")
+    parser.add_argument("--trace", help="write every recorded side effect to this JSON file")
+    parser.add_argument("--json", help="write the report to this JSON file")
+    parser.add_argument("--no-alloc", action="store_true",
+                        help="do not track allocations (faster)")
+    args = parser.parse_args(argv)
+
+    scenario = loadScenario(args.scenario)
+    if args.duration is not None:
+        scenario["duration"] = args.duration
+    if args.poll is not None:
+        scenario["pollInterval"] = args.poll
+
+    sim = Simulator(scenario, codePath=args.code, sdSource=args.sd,
+                    trackAllocations=not args.no_alloc,
+                    keepTrace=bool(args.trace))
+    report = sim.run()
+    printReport(report)
+
+    if args.trace:
+        with open(args.trace, "w") as fp:
+            json.dump(sim.trace(), fp, indent=1, default=str)
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump(report, fp, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Host stand-in for the ADT7410 temperature sensor driver. The temperature
+comes from the "temperature" channel of the scenario feed.
+"""
+
+import simhooks
+
+
+class ADT7410:
+    def __init__(self, i2c_bus, address=0x48):
+        self.i2c_bus = i2c_bus
+        self.address = address
+        self.high_resolution = False
+
+    @property
+    def temperature(self):
+        simhooks.recorder.record("i2c", "ADT7410", None)
+        value = float(simhooks.feed.value("temperature", simhooks.elapsed(), 22.0))
+        step = 0.0078125 if self.high_resolution else 0.0625
+        return round(value / step) * step
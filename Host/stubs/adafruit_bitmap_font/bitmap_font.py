@@ -0,0 +1,80 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Host stand-in for `adafruit_bitmap_font.bitmap_font`. BDF files are parsed
+for their metrics only (bounding box and advance widths) so labels can
+report realistic sizes without rasterizing any glyphs.
+"""
+
+import simhooks
+
+
+class Glyph:
+    def __init__(self, width, height, dx, dy, shift_x, shift_y):
+        self.bitmap = None
+        self.tile_index = 0
+        self.width = width
+        self.height = height
+        self.dx = dx
+        self.dy = dy
+        self.shift_x = shift_x
+        self.shift_y = shift_y
+
+
+class BDF:
+    def __init__(self, path):
+        self.path = path
+        self._boundingBox = (0, 0, 0, 0)
+        self._metrics = {}
+        self._glyphs = {}
+        self._parse()
+
+    def _parse(self):
+        code = None
+        shift = 0
+        box = (0, 0, 0, 0)
+        with open(simhooks.mapPath(self.path), "r") as fp:
+            for line in fp:
+                if line.startswith("FONTBOUNDINGBOX"):
+                    w, h, x, y = (int(v) for v in line.split()[1:5])
+                    self._boundingBox = (w, h, x, y)
+                elif line.startswith("ENCODING"):
+                    code = int(line.split()[1])
+                elif line.startswith("DWIDTH"):
+                    shift = int(line.split()[1])
+                elif line.startswith("BBX"):
+                    box = tuple(int(v) for v in line.split()[1:5])
+                elif line.startswith("ENDCHAR") and code is not None:
+                    self._metrics[code] = Glyph(box[0], box[1], box[2], box[3], shift, 0)
+                    code = None
+
+    def get_bounding_box(self):
+        return self._boundingBox
+
+    def load_glyphs(self, code_points):
+        if isinstance(code_points, int):
+            code_points = (code_points,)
+        elif isinstance(code_points, (str, bytes)):
+            code_points = [c if isinstance(c, int) else ord(c) for c in code_points]
+        loaded = 0
+        for cp in code_points:
+            if cp not in self._glyphs and cp in self._metrics:
+                self._glyphs[cp] = self._metrics[cp]
+                loaded += 1
+        simhooks.recorder.record("load_glyphs", self.path, loaded)
+
+    def get_glyph(self, code_point):
+        if code_point not in self._glyphs:
+            if code_point not in self._metrics:
+                return None
+            # The real library loads missing glyphs from the file on demand
+            simhooks.recorder.record("glyph_miss", self.path, code_point)
+            self._glyphs[code_point] = self._metrics[code_point]
+        return self._glyphs[code_point]
+
+
+def load_font(filename, bitmap=None):
+    simhooks.recorder.record("load_font", filename, None)
+    return BDF(filename)
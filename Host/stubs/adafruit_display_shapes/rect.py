@@ -0,0 +1,19 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Host stand-in for `adafruit_display_shapes.rect`.
+"""
+
+
+class Rect:
+    def __init__(self, x, y, width, height, *, fill=None, outline=None, stroke=1):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.fill = fill
+        self.outline = outline
+        self.stroke = stroke
+        self.hidden = False
@@ -0,0 +1,85 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Host stand-in for `adafruit_display_text.label`. Every assignment to `text`
+or `color` is reported to the simulator recorder, flagged with whether the
+value actually changed.
+"""
+
+import simhooks
+
+
+class Label:
+    def __init__(self, font, *, text="", color=0xFFFFFF, background_color=None,
+                 anchor_point=None, anchored_position=None, scale=1, **kwargs):
+        self.font = font
+        self.background_color = background_color
+        self.scale = scale
+        self.hidden = False
+        self.x = 0
+        self.y = 0
+        self._color = color
+        self._text = ""
+        self._anchor_point = anchor_point or (0, 0)
+        self._anchored_position = anchored_position or (0, 0)
+        self._box = (0, 0, 0, 0)
+        self._setText(text)
+
+    def _setText(self, text):
+        width = 0
+        for ch in text:
+            glyph = self.font.get_glyph(ord(ch))
+            if glyph:
+                width += glyph.shift_x
+        height = self.font.get_bounding_box()[1] if text else 0
+        self._text = text
+        self._box = (0, 0, width * self.scale, height * self.scale)
+        self._reposition()
+
+    def _reposition(self):
+        ax, ay = self._anchor_point
+        px, py = self._anchored_position
+        self.x = int(px - ax * self._box[2])
+        self.y = int(py - ay * self._box[3])
+
+    @property
+    def text(self):
+        return self._text
+
+    @text.setter
+    def text(self, value):
+        simhooks.recorder.record("text", id(self), (value, value != self._text))
+        self._setText(value)
+
+    @property
+    def color(self):
+        return self._color
+
+    @color.setter
+    def color(self, value):
+        simhooks.recorder.record("color", id(self), (value, value != self._color))
+        self._color = value
+
+    @property
+    def bounding_box(self):
+        return self._box
+
+    @property
+    def anchor_point(self):
+        return self._anchor_point
+
+    @anchor_point.setter
+    def anchor_point(self, value):
+        self._anchor_point = value
+        self._reposition()
+
+    @property
+    def anchored_position(self):
+        return self._anchored_position
+
+    @anchored_position.setter
+    def anchored_position(self, value):
+        self._anchored_position = value
+        self._reposition()
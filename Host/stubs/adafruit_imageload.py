@@ -0,0 +1,38 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Host stand-in for `adafruit_imageload`. Decodes BMP files into the given
+bitmap and palette types. True color files are returned as a 16 bit
+bitmap with a ColorConverter, as on the device.
+"""
+
+import bmpfile
+import displayio
+import simhooks
+
+
+def load(file_or_filename, *, bitmap=None, palette=None):
+    bitmap = bitmap or displayio.Bitmap
+    palette = palette or displayio.Palette
+    path = file_or_filename
+    if not isinstance(path, str):
+        path = file_or_filename.name
+    image = bmpfile.read(simhooks.mapPath(path))
+    simhooks.recorder.record("imageload", path, (image.width, image.height))
+
+    if image.indexed:
+        result = bitmap(image.width, image.height, len(image.palette))
+        result._data[:] = image.pixels
+        shader = palette(len(image.palette))
+        for i, rgb in enumerate(image.palette):
+            shader[i] = rgb
+        return result, shader
+
+    result = bitmap(image.width, image.height, 65535)
+    p = image.pixels
+    for i in range(image.width * image.height):
+        r, g, b = p[i * 3], p[i * 3 + 1], p[i * 3 + 2]
+        result._data[i] = ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+    return result, displayio.ColorConverter()
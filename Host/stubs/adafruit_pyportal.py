@@ -0,0 +1,178 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Host stand-in for `adafruit_pyportal`. The Wi-Fi link state and RSSI come
+from the "connected" and "rssi" channels of the scenario feed. Time sync
+latency and failure windows come from its "timeSync" entry.
+
+The sockets of the ESP32 co-processor are real sockets connected to the
+local HTTP stand-in of the simulator (Host/timeServer.py), whatever host
+the code asks for. TLS is not emulated.
+"""
+
+import select
+import socket
+import struct
+
+import board
+import simhooks
+
+
+class _Socket:
+    def __init__(self):
+        self.sock = None
+        self.received = bytearray()
+        self.closed = False
+        self.lost = False
+        self.readyAt = None
+
+
+class _ESP:
+    TCP_MODE = 0
+    TLS_MODE = 2
+
+    def __init__(self):
+        self._sockets = {}
+        self._nextSocket = 0
+
+    @property
+    def rssi(self):
+        simhooks.recorder.record("spi", "esp.rssi", None)
+        return int(simhooks.feed.value("rssi", simhooks.elapsed(), -60))
+
+    @property
+    def is_connected(self):
+        simhooks.recorder.record("spi", "esp.is_connected", None)
+        return bool(simhooks.feed.value("connected", simhooks.elapsed(), True))
+
+    def wifi_set_passphrase(self, ssid, passphrase):
+        simhooks.recorder.record("spi", "esp.wifi_set_passphrase", None)
+
+    def get_socket(self):
+        simhooks.recorder.record("spi", "esp.get_socket", None)
+        self._nextSocket += 1
+        self._sockets[self._nextSocket] = _Socket()
+        return self._nextSocket
+
+    def socket_open(self, socket_num, dest, port, conn_mode=TCP_MODE):
+        simhooks.recorder.record("spi", "esp.socket_open", (dest, port))
+        server = simhooks.network
+        if server is None or not self.is_connected:
+            raise RuntimeError("Failed to establish connection")
+        entry = self._sockets[socket_num]
+        entry.sock = socket.create_connection(server.server_address)
+
+    def socket_connected(self, socket_num):
+        simhooks.recorder.record("spi", "esp.socket_connected", None)
+        entry = self._sockets.get(socket_num)
+        if entry is None or entry.sock is None:
+            return False
+        self._receive(entry)
+        if entry.lost:
+            return False
+        return not (entry.closed and self._ready(entry))
+
+    def socket_write(self, socket_num, buffer, conn_mode=TCP_MODE):
+        simhooks.recorder.record("spi", "esp.socket_write", None)
+        entry = self._sockets[socket_num]
+        entry.sock.sendall(bytes(buffer))
+        simhooks.recorder.record("http_request", None, bytes(buffer).split(b"\r\n")[0])
+        # The stand-in answers at once; the reply is held back for the
+        # latency it asked for (None: never)
+        latency = simhooks.network.handle()
+        if latency is not None:
+            entry.readyAt = simhooks.clock.now + latency
+
+    def socket_available(self, socket_num):
+        simhooks.recorder.record("spi", "esp.socket_available", None)
+        entry = self._sockets[socket_num]
+        self._receive(entry)
+        if not self._ready(entry):
+            return 0
+        return len(entry.received)
+
+    def socket_read(self, socket_num, size):
+        simhooks.recorder.record("spi", "esp.socket_read", size)
+        entry = self._sockets[socket_num]
+        if not self._ready(entry):
+            return b""
+        data = bytes(entry.received[:size])
+        del entry.received[:size]
+        return data
+
+    def socket_close(self, socket_num):
+        simhooks.recorder.record("spi", "esp.socket_close", None)
+        entry = self._sockets.pop(socket_num, None)
+        if entry is not None and entry.sock is not None:
+            entry.sock.close()
+
+    def _ready(self, entry):
+        return (not entry.lost and entry.readyAt is not None
+                and simhooks.clock.now >= entry.readyAt)
+
+    def _receive(self, entry):
+        # A Wi-Fi outage drops the open connections, and what they had received
+        if not entry.lost and not simhooks.feed.value("connected", simhooks.elapsed(), True):
+            entry.lost = True
+            entry.received = bytearray()
+        while entry.sock is not None and not entry.closed:
+            readable, _, _ = select.select([entry.sock], [], [], 0)
+            if not readable:
+                return
+            data = entry.sock.recv(4096)
+            if not data:
+                entry.closed = True
+            entry.received.extend(data)
+
+
+class _WiFi:
+    def __init__(self):
+        self.esp = _ESP()
+
+    @property
+    def is_connected(self):
+        simhooks.recorder.record("spi", "is_connected", None)
+        return bool(simhooks.feed.value("connected", simhooks.elapsed(), True))
+
+
+class _Network:
+    def __init__(self):
+        self._wifi = _WiFi()
+
+    @property
+    def is_connected(self):
+        return self._wifi.is_connected
+
+
+class PyPortal:
+    def __init__(self, *, url=None, status_neopixel=None, debug=False, **kwargs):
+        self.display = board.DISPLAY
+        self.network = _Network()
+
+    def get_local_time(self, location=None):
+        simhooks.recorder.record("get_local_time", location, None)
+        simhooks.clock.advance(simhooks.feed.syncLatency)
+        simhooks.checkDeadline()
+        if simhooks.feed.syncFails(simhooks.elapsed()):
+            raise RuntimeError("Simulated time sync failure")
+        simhooks.recorder.record("rtc_set", None, simhooks.clock.now)
+        simhooks.clock.setRtc()
+        return simhooks.clock.now
+
+    def play_file(self, file_name, wait_to_finish=True):
+        simhooks.recorder.record("play_file", file_name, wait_to_finish)
+        if wait_to_finish:
+            simhooks.clock.advance(_wavDuration(file_name))
+
+
+def _wavDuration(path):
+    try:
+        with open(simhooks.mapPath(path), "rb") as fp:
+            header = fp.read(44)
+        byteRate, = struct.unpack_from("<I", header, 28)
+        dataSize, = struct.unpack_from("<I", header, 40)
+        return dataSize / byteRate
+    except (OSError, struct.error, ZeroDivisionError):
+        return 0.0
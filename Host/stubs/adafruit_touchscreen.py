@@ -0,0 +1,32 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Host stand-in for the resistive touchscreen driver. Touches come from the
+"touches" list of the scenario feed, already scaled to the screen size as
+the real driver reports them.
+
+Reading `touch_point` marks the top of a main loop iteration and advances
+the virtual clock by the poll cost of the simulator.
+"""
+
+import simhooks
+
+pollCost = 0.01
+
+
+class Touchscreen:
+    def __init__(self, x1_pin, x2_pin, y1_pin, y2_pin, *,
+                 x_resistance=None, samples=4, z_threshold=10000,
+                 calibration=None, size=None):
+        self.calibration = calibration
+        self.size = size
+
+    @property
+    def touch_point(self):
+        simhooks.loopTick(pollCost)
+        point = simhooks.feed.touch(simhooks.elapsed())
+        if point:
+            simhooks.recorder.record("touch", None, point)
+        return point
@@ -0,0 +1,25 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Host stand-in for the CircuitPython `analogio` module. The light sensor
+reading comes from the "light" channel of the scenario feed.
+"""
+
+import simhooks
+
+
+class AnalogIn:
+    def __init__(self, pin):
+        self.pin = pin
+        self.reference_voltage = 3.3
+
+    @property
+    def value(self):
+        simhooks.recorder.record("adc", str(self.pin), None)
+        value = int(simhooks.feed.value("light", simhooks.elapsed(), 20000))
+        return max(0, min(65535, value))
+
+    def deinit(self):
+        pass
@@ -0,0 +1,174 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Host stand-in for the CircuitPython `asyncio` library (the subset code.py
+uses: run, create_task, gather, sleep, sleep_ms and Event).
+
+Tasks are scheduled on the virtual clock. When no task is ready the clock
+jumps to the next wake up time, and that time is counted as idle (the
+processor would be sleeping), so the simulator can report how busy the loop
+keeps the device.
+"""
+
+import heapq
+import itertools
+
+import simhooks
+
+
+class CancelledError(BaseException):
+    pass
+
+
+class _Yield:
+    """Awaitable that hands an instruction to the scheduler."""
+
+    def __init__(self, op, arg=None):
+        self.op = op
+        self.arg = arg
+
+    def __await__(self):
+        return (yield self)
+
+
+class Task:
+    def __init__(self, coro):
+        self.coro = coro
+        self.done = False
+        self.result = None
+        self.exception = None
+        self.waiters = []
+
+    def __await__(self):
+        if not self.done:
+            yield _Yield("join", self)
+        if self.exception is not None:
+            raise self.exception
+        return self.result
+
+
+class Event:
+    def __init__(self):
+        self.state = False
+        self.waiters = []
+
+    def is_set(self):
+        return self.state
+
+    def set(self):
+        self.state = True
+        waiters = self.waiters
+        self.waiters = []
+        for task in waiters:
+            _scheduler.ready(task)
+
+    def clear(self):
+        self.state = False
+
+    async def wait(self):
+        if not self.state:
+            await _Yield("event", self)
+        return True
+
+
+class _Scheduler:
+    def __init__(self):
+        self.queue = []
+        self.sequence = itertools.count()
+        self.current = None
+
+    def schedule(self, task, at, value=None):
+        heapq.heappush(self.queue, (at, next(self.sequence), task, value))
+
+    def ready(self, task, value=None):
+        self.schedule(task, simhooks.clock.now, value)
+
+    def step(self, task, value):
+        self.current = task
+        try:
+            op = task.coro.send(value)
+        except StopIteration as e:
+            self.finish(task, e.value, None)
+            return
+        except CancelledError as e:
+            self.finish(task, None, e)
+            return
+        except Exception as e:
+            self.finish(task, None, e)
+            if not task.waiters:
+                raise
+            return
+        finally:
+            self.current = None
+
+        if op.op == "sleep":
+            self.schedule(task, simhooks.clock.now + max(0.0, op.arg))
+        elif op.op == "event":
+            op.arg.waiters.append(task)
+        elif op.op == "join":
+            op.arg.waiters.append(task)
+        else:
+            raise RuntimeError(f"unknown scheduler operation {op.op}")
+
+    def finish(self, task, result, exception):
+        task.done = True
+        task.result = result
+        task.exception = exception
+        for waiter in task.waiters:
+            self.ready(waiter)
+        task.waiters = []
+
+    def run(self, main):
+        while not main.done:
+            if not self.queue:
+                raise RuntimeError("all tasks are waiting")
+            at, _, task, value = heapq.heappop(self.queue)
+            if task.done:
+                continue
+            idle = at - simhooks.clock.now
+            if idle > 0:
+                simhooks.idle(idle)
+            simhooks.checkDeadline()
+            self.step(task, value)
+        if main.exception is not None:
+            raise main.exception
+        return main.result
+
+
+_scheduler = _Scheduler()
+
+
+def create_task(coro):
+    task = Task(coro)
+    _scheduler.ready(task)
+    return task
+
+
+def sleep(seconds):
+    return _Yield("sleep", seconds)
+
+
+def sleep_ms(milliseconds):
+    return _Yield("sleep", milliseconds / 1000)
+
+
+async def gather(*aws, return_exceptions=False):
+    results = []
+    for aw in aws:
+        if not isinstance(aw, Task):
+            aw = create_task(aw)
+        try:
+            results.append(await aw)
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            results.append(e)
+    return results
+
+
+def run(coro):
+    global _scheduler
+    _scheduler = _Scheduler()
+    return _scheduler.run(create_task(coro))
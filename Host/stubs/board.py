@@ -0,0 +1,78 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Host stand-in for the CircuitPython `board` module of the PyPortal.
+"""
+
+import simhooks
+
+
+class Pin:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f"board.{self.name}"
+
+
+class Display:
+    def __init__(self, width=320, height=240):
+        self.width = width
+        self.height = height
+        self.root_group = None
+        self._brightness = 1.0
+        self._auto_refresh = True
+
+    @property
+    def brightness(self):
+        return self._brightness
+
+    @brightness.setter
+    def brightness(self, value):
+        simhooks.recorder.record("brightness", "DISPLAY", value)
+        self._brightness = value
+
+    @property
+    def auto_refresh(self):
+        return self._auto_refresh
+
+    @auto_refresh.setter
+    def auto_refresh(self, value):
+        simhooks.recorder.record("auto_refresh", "DISPLAY", value)
+        self._auto_refresh = value
+
+    def show(self, group):
+        simhooks.recorder.record("show", "DISPLAY", None)
+        self.root_group = group
+
+    def refresh(self, target_frames_per_second=None, minimum_frames_per_second=0):
+        simhooks.recorder.record("refresh", "DISPLAY", None)
+        # An OnDiskBitmap is read again from the SD card whenever an area
+        # over it is redrawn, which every refresh does for a background
+        if _showsOnDiskBitmap(self.root_group, self.width, self.height):
+            simhooks.recorder.record("sd_refresh", "DISPLAY", None)
+        return True
+
+
+def _showsOnDiskBitmap(group, width, height):
+    if group is None or getattr(group, "hidden", False):
+        return False
+    bitmap = getattr(group, "bitmap", None)
+    if bitmap is not None:
+        return (type(bitmap).__name__ == "OnDiskBitmap"
+                and bitmap.width >= width and bitmap.height >= height)
+    if hasattr(group, "__iter__"):
+        for layer in group:
+            if _showsOnDiskBitmap(layer, width, height):
+                return True
+    return False
+
+
+for _name in ("NEOPIXEL", "TOUCH_XL", "TOUCH_XR", "TOUCH_YD", "TOUCH_YU",
+              "SCL", "SDA", "LIGHT", "SCK", "MOSI", "MISO", "SD_CS",
+              "ESP_CS", "ESP_BUSY", "ESP_RESET", "SPEAKER", "SPEAKER_ENABLE"):
+    globals()[_name] = Pin(_name)
+
+DISPLAY = Display()
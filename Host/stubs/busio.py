@@ -0,0 +1,21 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Host stand-in for the CircuitPython `busio` module.
+"""
+
+
+class I2C:
+    def __init__(self, scl, sda, frequency=100000):
+        self.scl = scl
+        self.sda = sda
+        self.frequency = frequency
+
+
+class SPI:
+    def __init__(self, clock, MOSI=None, MISO=None):
+        self.clock = clock
+        self.MOSI = MOSI
+        self.MISO = MISO
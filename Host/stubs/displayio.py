@@ -0,0 +1,177 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Host stand-in for the CircuitPython `displayio` module. Only the parts used
+by the PyPortal_Events code are provided. Opening an OnDiskBitmap and
+changing a tile index are reported to the simulator recorder.
+"""
+
+import weakref
+from array import array
+
+import bmpfile
+import simhooks
+
+
+class Group:
+    def __init__(self, *, scale=1, x=0, y=0):
+        self.scale = scale
+        self.x = x
+        self.y = y
+        self.hidden = False
+        self._items = []
+
+    def append(self, layer):
+        self._items.append(layer)
+
+    def insert(self, index, layer):
+        self._items.insert(index, layer)
+
+    def pop(self, i=-1):
+        return self._items.pop(i)
+
+    def remove(self, layer):
+        self._items.remove(layer)
+
+    def index(self, layer):
+        return self._items.index(layer)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __setitem__(self, index, value):
+        self._items[index] = value
+
+    def __contains__(self, layer):
+        return layer in self._items
+
+    def __iter__(self):
+        return iter(self._items)
+
+
+class Palette:
+    def __init__(self, color_count):
+        self._colors = [0] * color_count
+        self._transparent = set()
+
+    def __len__(self):
+        return len(self._colors)
+
+    def __getitem__(self, index):
+        return self._colors[index]
+
+    def __setitem__(self, index, value):
+        if isinstance(value, (tuple, list, bytes, bytearray)):
+            value = (value[0] << 16) | (value[1] << 8) | value[2]
+        self._colors[index] = value
+
+    def make_transparent(self, index):
+        self._transparent.add(index)
+
+    def make_opaque(self, index):
+        self._transparent.discard(index)
+
+    def is_transparent(self, index):
+        return index in self._transparent
+
+
+class ColorConverter:
+    def __init__(self, *, input_colorspace=None, dither=False):
+        self.dither = dither
+
+
+class Bitmap:
+    def __init__(self, width, height, value_count):
+        self.width = width
+        self.height = height
+        self.value_count = value_count
+        if value_count <= 256:
+            self._data = bytearray(width * height)
+        else:
+            self._data = array("H", bytes(2 * width * height))
+        # Size of the buffer on the device, which packs 1, 2, 4, 8 or 16 bits
+        # per value into 32 bit words
+        bits = 1
+        while (1 << bits) < value_count and bits < 16:
+            bits *= 2
+        size = ((width * bits + 31) // 32) * 4 * height
+        heap = simhooks.heap
+        heap.allocate(size)
+        weakref.finalize(self, heap.release, size)
+
+    def __getitem__(self, index):
+        if isinstance(index, tuple):
+            index = index[1] * self.width + index[0]
+        return self._data[index]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, tuple):
+            index = index[1] * self.width + index[0]
+        self._data[index] = value
+
+    def fill(self, value):
+        for i in range(len(self._data)):
+            self._data[i] = value
+
+    def blit(self, x, y, source_bitmap, *, x1=0, y1=0, x2=None, y2=None,
+             skip_index=None):
+        x2 = source_bitmap.width if x2 is None else x2
+        y2 = source_bitmap.height if y2 is None else y2
+        for sy in range(y1, y2):
+            for sx in range(x1, x2):
+                value = source_bitmap[sx, sy]
+                if value != skip_index:
+                    self[x + sx - x1, y + sy - y1] = value
+
+
+class OnDiskBitmap:
+    def __init__(self, file):
+        path = simhooks.mapPath(file) if isinstance(file, str) else file.name
+        with open(path, "rb") as fp:
+            header = bmpfile.readHeader(fp)
+        self.width = header.width
+        self.height = header.height
+        if header.indexed:
+            self.pixel_shader = Palette(header.colors)
+        else:
+            self.pixel_shader = ColorConverter()
+        simhooks.recorder.record("ondiskbitmap", file, (self.width, self.height))
+
+
+class TileGrid:
+    def __init__(self, bitmap, *, pixel_shader, width=1, height=1,
+                 tile_width=None, tile_height=None, default_tile=0, x=0, y=0):
+        self.bitmap = bitmap
+        self.pixel_shader = pixel_shader
+        self.width = width
+        self.height = height
+        self.tile_width = bitmap.width if tile_width is None else tile_width
+        self.tile_height = bitmap.height if tile_height is None else tile_height
+        self.x = x
+        self.y = y
+        self.hidden = False
+        self.flip_x = False
+        self.flip_y = False
+        self.transpose_xy = False
+        self._tiles = bytearray([default_tile] * (width * height))
+
+    def __getitem__(self, index):
+        if isinstance(index, tuple):
+            index = index[1] * self.width + index[0]
+        return self._tiles[index]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, tuple):
+            index = index[1] * self.width + index[0]
+        if self._tiles[index] != value:
+            simhooks.recorder.record("tile", index, value)
+        self._tiles[index] = value
+
+
+def release_displays():
+    pass
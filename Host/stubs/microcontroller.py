@@ -0,0 +1,34 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Host stand-in for the CircuitPython `microcontroller` module. Only `nvm` is
+provided: the NVM bytes of the simulator (simhooks.nvm), which a scenario
+can carry over to the next run to simulate a reset. Writes are reported to
+the simulator recorder.
+"""
+
+import simhooks
+
+
+class _ByteArray:
+    def __len__(self):
+        return len(simhooks.nvm)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return bytearray(simhooks.nvm[index])
+        return simhooks.nvm[index]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            if len(simhooks.nvm[index]) != len(value):
+                raise ValueError("NVM slice size mismatch")
+            simhooks.recorder.record("nvm_write", index.start, len(value))
+        else:
+            simhooks.recorder.record("nvm_write", index, 1)
+        simhooks.nvm[index] = value
+
+
+nvm = _ByteArray()
@@ -0,0 +1,25 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Host stand-in for the CircuitPython `rtc` module. Setting the date and time
+sets the RTC of the virtual clock.
+"""
+
+import calendar
+import time
+
+import simhooks
+
+
+class RTC:
+    @property
+    def datetime(self):
+        return time.gmtime(int(simhooks.clock.rtc()))
+
+    @datetime.setter
+    def datetime(self, value):
+        seconds = calendar.timegm(tuple(value)[:6] + (0, 0, 0))
+        simhooks.recorder.record("rtc_set", None, seconds)
+        simhooks.clock.setRtc(seconds)
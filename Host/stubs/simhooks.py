@@ -0,0 +1,264 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Shared state for the host stand-ins of the CircuitPython modules.
+
+The simulator configures the clock, the scripted input feed and the
+recorder before running code.py. The stand-in modules (board, displayio,
+adafruit_touchscreen, ...) read their inputs from the feed and report every
+observable side effect to the recorder.
+"""
+
+import json
+import os
+import random
+
+
+class SimulationComplete(BaseException):
+    """Raised when the virtual clock passes the end of the scenario.
+    Derived from BaseException so the broad `except Exception` handlers in
+    code.py do not swallow it.
+    """
+
+
+# **************** CLOCK ******************
+# 2000-01-01 00:00:00, where the RTC of the device starts after a reset
+RTC_RESET_EPOCH = 946684800
+
+
+class Clock:
+    """Virtual time. `now` is the true local time of the scenario; the RTC of
+    the device only follows it once it has been set (by a time sync).
+    """
+
+    def __init__(self, start=0.0, rtcSet=False):
+        self.now = float(start)
+        self.start = float(start)
+        self.monotonicStart = 1000.0
+        self.rtcOffset = 0.0 if rtcSet else RTC_RESET_EPOCH - float(start)
+        # Time spent sleeping (time.sleep or waiting for the next task)
+        self.idle = 0.0
+
+    def advance(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+
+    def elapsed(self):
+        return self.now - self.start
+
+    def monotonic(self):
+        return self.monotonicStart + self.elapsed()
+
+    def rtc(self):
+        return self.now + self.rtcOffset
+
+    def setRtc(self, seconds=None):
+        self.rtcOffset = 0.0 if seconds is None else seconds - self.now
+
+
+# **************** SCRIPTED INPUTS ******************
+class Feed:
+    """Scripted sensor and network inputs, keyed by seconds since the start
+    of the scenario. Each channel is a list of [time, value] pairs and holds
+    its value until the next pair (a step function).
+    """
+
+    def __init__(self, scenario=None):
+        scenario = scenario or {}
+        self.channels = {}
+        for name in ("light", "temperature", "rssi", "connected"):
+            if name in scenario:
+                self.channels[name] = sorted(scenario[name], key=lambda p: p[0])
+        # Random noise added to a channel, as a fraction of its value, e.g.
+        # {"light": 0.1} for readings within 10 % of the scripted one
+        self.noise = scenario.get("noise", {})
+        self.touches = sorted(scenario.get("touches", []), key=lambda t: t["at"])
+        self.console = Console(scenario.get("console", []))
+        timeSync = scenario.get("timeSync", {})
+        self.syncLatency = timeSync.get("latency", 0.0)
+        self.syncFailures = timeSync.get("failures", [])
+        self.syncFailureMode = timeSync.get("failureMode", "error")
+        self.syncChunked = timeSync.get("chunked", False)
+        # The remote event feed served by the HTTP stand-in (timeServer.py)
+        self.eventFeed = scenario.get("eventFeed")
+        # Files written to the SD card while the code runs, each
+        # {"at": seconds, "path": "config.json", "content": text or JSON}
+        self.sdEdits = sorted(scenario.get("sdEdits", []), key=lambda e: e["at"])
+        self.sdEditsDone = 0
+
+    def value(self, name, elapsed, default=None):
+        result = default
+        for t, v in self.channels.get(name, ()):
+            if t > elapsed:
+                break
+            result = v
+        noise = self.noise.get(name)
+        if noise and result is not None:
+            result = result * (1 + random.uniform(-noise, noise))
+        return result
+
+    def touch(self, elapsed):
+        t = self.touchAt(elapsed)
+        if t is None:
+            return None
+        return (t["x"], t["y"], t.get("pressure", 30000))
+
+    def touchAt(self, elapsed):
+        """The scripted touch that is down at elapsed, or None."""
+        for t in self.touches:
+            if t["at"] > elapsed:
+                break
+            if elapsed < t["at"] + t.get("hold", 0.1):
+                return t
+        return None
+
+    def syncFails(self, elapsed):
+        for start, end in self.syncFailures:
+            if start <= elapsed < end:
+                return True
+        return False
+
+
+class Console:
+    """Serial console input: the text of each [time, text] pair of the
+    scenario's "console" entry is typed at that time. Stands in for
+    sys.stdin while code.py runs.
+    """
+
+    def __init__(self, entries=()):
+        self.entries = sorted(entries, key=lambda e: e[0])
+        self.typed = 0
+        self.pending = ""
+
+    def available(self):
+        while self.typed < len(self.entries) and self.entries[self.typed][0] <= elapsed():
+            self.pending += self.entries[self.typed][1]
+            self.typed += 1
+        return len(self.pending)
+
+    def read(self, size=-1):
+        self.available()
+        if size < 0:
+            size = len(self.pending)
+        text, self.pending = self.pending[:size], self.pending[size:]
+        return text
+
+
+# **************** RECORDER ******************
+class Recorder:
+    """Keeps every observable side effect as (elapsed, kind, target, value)."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.records = []
+        self.counts = {}
+        self.listeners = []
+
+    def record(self, kind, target=None, value=None):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        self.records.append((round(self.clock.elapsed(), 6), kind, target, value))
+        for listener in self.listeners:
+            listener(kind, target, value)
+
+
+# **************** MEMORY ******************
+class Heap:
+    """Rough model of the device heap for gc.mem_free(): a fixed amount of
+    free memory at the start, less the buffers of the live displayio bitmaps,
+    which are by far the largest allocations of this code.
+    """
+
+    def __init__(self, free=120000):
+        self.free = free
+        self.bitmapBytes = 0
+
+    def allocate(self, size):
+        self.bitmapBytes += size
+
+    def release(self, size):
+        self.bitmapBytes -= size
+
+    def memFree(self):
+        return self.free - self.bitmapBytes
+
+
+# **************** MODULE STATE ******************
+# Size of microcontroller.nvm on the SAMD51 of the PyPortal
+NVM_SIZE = 8192
+
+clock = Clock()
+feed = Feed()
+recorder = Recorder(clock)
+sdRoot = None
+deadline = None
+loopListener = None
+heap = Heap()
+# Local HTTP stand-in that the ESP32 sockets connect to (Host/timeServer.py)
+network = None
+# The bytes of microcontroller.nvm, erased flash until written
+nvm = bytearray(b"\xff" * NVM_SIZE)
+
+
+def configure(newClock, newFeed, newRecorder, newSdRoot, newDeadline,
+              newLoopListener=None, newHeap=None, newNetwork=None, newNvm=None):
+    global clock, feed, recorder, sdRoot, deadline, loopListener, heap, network, nvm
+    clock = newClock
+    feed = newFeed
+    recorder = newRecorder
+    sdRoot = newSdRoot
+    deadline = newDeadline
+    loopListener = newLoopListener
+    heap = newHeap or Heap()
+    network = newNetwork
+    nvm = newNvm if newNvm is not None else bytearray(b"\xff" * NVM_SIZE)
+
+
+def checkDeadline():
+    applySdEdits()
+    if deadline is not None and clock.now >= deadline:
+        raise SimulationComplete()
+
+
+def applySdEdits():
+    """Writes the scripted SD card edits that are due, with the virtual time
+    as their time stamp."""
+    while feed.sdEditsDone < len(feed.sdEdits) and feed.sdEdits[feed.sdEditsDone]["at"] <= elapsed():
+        edit = feed.sdEdits[feed.sdEditsDone]
+        feed.sdEditsDone += 1
+        content = edit["content"]
+        if not isinstance(content, str):
+            content = json.dumps(content, indent=4)
+        path = os.path.join(sdRoot, edit["path"])
+        with open(path, "w", encoding="utf-8") as fp:
+            fp.write(content)
+        os.utime(path, (clock.now, clock.now))
+        recorder.record("sd_edit", edit["path"], len(content))
+
+
+def idle(seconds):
+    """Let the virtual time pass with the processor sleeping."""
+    if seconds > 0:
+        clock.idle += seconds
+        clock.advance(seconds)
+    checkDeadline()
+
+
+def loopTick(cost):
+    """Called from the touch poll at the top of the main loop."""
+    if loopListener:
+        loopListener()
+    clock.advance(cost)
+    checkDeadline()
+
+
+def mapPath(path):
+    """Map the device paths /sd/... to the host copy of the SD card."""
+    if sdRoot and isinstance(path, str) and (path == "/sd" or path.startswith("/sd/")):
+        return os.path.join(sdRoot, path[4:])
+    return path
+
+
+def elapsed():
+    return clock.elapsed()
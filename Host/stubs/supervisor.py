@@ -0,0 +1,23 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Host stand-in for the CircuitPython `supervisor` module. The serial console
+input comes from the "console" entry of the scenario feed.
+"""
+
+import simhooks
+
+
+class _Runtime:
+    @property
+    def serial_bytes_available(self):
+        return simhooks.feed.console.available()
+
+    @property
+    def serial_connected(self):
+        return True
+
+
+runtime = _Runtime()
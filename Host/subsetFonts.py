@@ -0,0 +1,193 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Subsets the BDF fonts of the PyPortal to the glyphs the display shows.
+
+Reads config.json, the last version of the remote feed (feed.json) and the
+.ics calendars of the SD card folder and the interface texts of each font
+(the GLYPHS_* constants of eventDisplay), and writes to <folder>/fonts:
+
+- one BDF file per font with only the glyphs its labels need: the event
+  titles use the large font, the subtitles the medium one,
+- glyphs.txt, the CRC-32 of each file they were made from and the glyphs of
+  each font, which eventDisplay preloads at boot.
+
+    python Host/subsetFonts.py SD_Card
+    python Host/subsetFonts.py SD_Card --fonts PyPortal/fonts
+
+The report compares the full fonts with their default glyph set and the
+subsets: the glyphs preloaded, the characters that would be loaded lazily
+(in the middle of a frame) and estimates of the bytes read at boot, the boot
+time and the heap used by the glyph bitmaps. Run it again whenever the
+titles or subtitles change: eventDisplay falls back to the full fonts when
+one of those files changed, was added or was removed, and a label switches
+to its full font when it is given a character that its subset does not have
+(e.g. after config.json is reloaded). With a remote feed configured, the
+full fonts are always used.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+DEVICE_DIR = os.path.join(os.path.dirname(HOST_DIR), "PyPortal")
+sys.path.insert(0, DEVICE_DIR)
+# The stand-ins go last so that their asyncio does not shadow the real one
+sys.path.append(os.path.join(HOST_DIR, "stubs"))
+
+from calendarLoader import calendarFiles, readCalendar  # noqa: E402
+from eventDisplay import eventDisplay  # noqa: E402
+from feedSync import FEED_FILE, feedRecords  # noqa: E402
+
+# The BDF loader of adafruit_bitmap_font reads through the font file for each
+# load_glyphs() call; this is its rate on the PyPortal (flash or SD card)
+FONT_BYTES_PER_SECOND = 150000
+# Heap of a glyph besides its bitmap (Glyph and Bitmap objects)
+GLYPH_OVERHEAD_BYTES = 96
+
+
+# **************** BDF ******************
+class BdfFont:
+    """The header lines of a BDF file and its glyphs by code point, each
+    kept as the lines from STARTCHAR to ENDCHAR."""
+
+    def __init__(self, path):
+        self.path = path
+        self.header = []
+        self.glyphs = {}
+        self.size = os.path.getsize(path)
+        self._parse()
+
+    def _parse(self):
+        with open(self.path, "r", encoding="utf-8", errors="replace") as fp:
+            lines = fp.read().splitlines()
+        block = None
+        code = None
+        for line in lines:
+            if block is None:
+                if line.startswith("STARTCHAR"):
+                    block = [line]
+                    code = None
+                elif line.startswith("CHARS ") or line.startswith("ENDFONT"):
+                    continue
+                else:
+                    self.header.append(line)
+                continue
+            block.append(line)
+            if line.startswith("ENCODING"):
+                code = int(line.split()[1])
+            elif line.startswith("ENDCHAR"):
+                if code is not None and code >= 0:
+                    self.glyphs[code] = block
+                block = None
+
+    def bitmapBytes(self, codes):
+        """Heap of the glyph bitmaps of codes (1 bit per pixel, rows of
+        32 bit words) and their objects."""
+        total = 0
+        for code in codes:
+            for line in self.glyphs.get(code, ()):
+                if line.startswith("BBX"):
+                    width, height = (int(v) for v in line.split()[1:3])
+                    total += ((width + 31) // 32) * 4 * height + GLYPH_OVERHEAD_BYTES
+                    break
+        return total
+
+    def write(self, path, codes):
+        codes = sorted(c for c in codes if c in self.glyphs)
+        with open(path, "w", encoding="utf-8", newline="\n") as fp:
+            for line in self.header:
+                fp.write(line + "\n")
+            fp.write(f"CHARS {len(codes)}\n")
+            for code in codes:
+                for line in self.glyphs[code]:
+                    fp.write(line + "\n")
+            fp.write("ENDFONT\n")
+        return codes
+
+
+# **************** SUBSET ******************
+def fontTexts(config):
+    """The characters each font shows: its interface texts and the event
+    texts of its labels."""
+    titles = "".join(str(e.get("title", "")) for e in config.get("events", []))
+    subtitles = "".join(str(e.get("subtitle", "")) for e in config.get("events", []))
+    return {
+        eventDisplay.FONT_STATUS: eventDisplay.GLYPHS_STATUS,
+        eventDisplay.FONT_LARGE: eventDisplay.GLYPHS_LARGE + titles,
+        eventDisplay.FONT_MEDIUM: eventDisplay.GLYPHS_MEDIUM + subtitles,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("folder", help="SD card folder with config.json")
+    parser.add_argument("--fonts", default=os.path.join(DEVICE_DIR, "fonts"),
+                        help="folder of the full BDF fonts")
+    args = parser.parse_args(argv)
+
+    configPath = os.path.join(args.folder, "config.json")
+    with open(configPath, "r", encoding="utf-8") as fp:
+        config = json.load(fp)
+    # The titles of the feed and of the calendars are shown with the same labels
+    sources = eventDisplay.textSources(args.folder)
+    if FEED_FILE in sources:
+        config["events"].extend(record for _, record in feedRecords(os.path.join(args.folder, FEED_FILE)))
+    for name in calendarFiles(args.folder):
+        readCalendar(args.folder + "/" + name, config["events"].append)
+    outFolder = os.path.join(args.folder, "fonts")
+    os.makedirs(outFolder, exist_ok=True)
+
+    defaultCodes = set(ord(c) for c in eventDisplay.GLYPHS_DEFAULT)
+    lines = [f"{eventDisplay.FONT_GLYPHS_SOURCE}{name} "
+             f"{eventDisplay.fileCrc(os.path.join(args.folder, name)):08x}" for name in sources]
+    totals = {"readBefore": 0, "readAfter": 0, "heapBefore": 0, "heapAfter": 0}
+    print(f"{'Font':<28} {'glyphs':>11} {'file bytes':>16} {'preloaded':>10}"
+          f" {'lazy':>5} {'glyph heap':>16}")
+    for name, text in fontTexts(config).items():
+        font = BdfFont(os.path.join(args.fonts, name))
+        needed = set(ord(c) for c in text)
+        missing = sorted(c for c in needed if c not in font.glyphs)
+        codes = font.write(os.path.join(outFolder, name), needed)
+        subsetSize = os.path.getsize(os.path.join(outFolder, name))
+        lines.append(f"{name} {''.join(chr(c) for c in codes)}")
+
+        # Before: the default set is preloaded, the other characters shown are
+        # loaded when a label first draws them. After: exactly what is shown.
+        preloaded = [c for c in defaultCodes if c in font.glyphs]
+        lazy = [c for c in needed if c in font.glyphs and c not in defaultCodes]
+        heapBefore = font.bitmapBytes(preloaded) + font.bitmapBytes(lazy)
+        heapAfter = font.bitmapBytes(codes)
+        totals["readBefore"] += font.size
+        totals["readAfter"] += subsetSize
+        totals["heapBefore"] += heapBefore
+        totals["heapAfter"] += heapAfter
+
+        print(f"{name:<28} {len(font.glyphs):>5} -> {len(codes):>3} {font.size:>7} -> {subsetSize:>6}"
+              f" {len(preloaded):>3} -> {len(codes):>3} {len(lazy):>5} {heapBefore:>6} -> {heapAfter:>6}")
+        if lazy:
+            print(f"    loaded lazily from the full font: {''.join(chr(c) for c in sorted(lazy))}")
+        if missing:
+            print(f"    WARN: not in the font: {''.join(chr(c) for c in missing)}")
+
+    with open(os.path.join(outFolder, eventDisplay.FONT_GLYPHS_FILE), "w",
+              encoding="utf-8", newline="\n") as fp:
+        for line in lines:
+            fp.write(line + "\n")
+
+    before = totals["readBefore"] / FONT_BYTES_PER_SECOND
+    after = totals["readAfter"] / FONT_BYTES_PER_SECOND
+    print(f"Read at boot: {totals['readBefore']} -> {totals['readAfter']} bytes, "
+          f"about {before:.2f} -> {after:.2f} s")
+    print(f"Glyph heap: {totals['heapBefore']} -> {totals['heapAfter']} bytes "
+          f"({totals['heapAfter'] - totals['heapBefore']:+d})")
+    print(f"Wrote the subset fonts and {eventDisplay.FONT_GLYPHS_FILE} to {outFolder}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Local HTTP stand-in for the Adafruit IO time service and the remote event
+feed, used by the simulator.
+
+It answers GET .../integrations/time/strftime?fmt=... with the local time
+of the virtual clock, formatted like the real service. The scenario feed
+decides how each request goes ("timeSync" entry):
+
+    "latency"      seconds of virtual time before the reply reaches the device
+    "failures"     [[start, end], ...] windows (scenario seconds) that fail
+    "failureMode"  how they fail: "error" (HTTP 500), "drop" (the connection
+                   is closed without a reply) or "hang" (no reply at all)
+    "chunked"      true to send the reply in chunks (HTTP/1.1 Transfer-Encoding:
+                   chunked) rather than with a Content-Length
+
+Any other path is the event feed ("eventFeed" entry), a document in the
+format of config.json:
+
+    "versions"     [[start, document], ...] the document served from start on
+                   (an object, or a file name relative to Host/scenarios)
+    "aio"          true to answer like an Adafruit IO feed: the document is
+                   the string "value" of the reply and X-AIO-Key is required
+    "failures"     [[start, end], ...] windows that answer HTTP 500
+    "chunked"      true to send the new versions in chunks
+
+The feed sends an ETag and a Last-Modified (the start of the version) and
+answers 304 Not Modified to a request that has either of them.
+
+The server runs on the simulator thread: the ESP32 stand-in calls handle()
+right after it sends a request, so every run is repeatable.
+"""
+
+import email.utils
+import hashlib
+import http.server
+import json
+import os
+import time
+import urllib.parse
+
+import simhooks
+
+
+SCENARIO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scenarios")
+# Bytes per chunk of a chunked reply: the time takes a few chunks, and the
+# chunks of the feed straddle the 256 byte reads of the device
+CHUNK_BYTES = 16
+
+
+def feedVersion(eventFeed, elapsed):
+    """(start, body) of the version of the event feed served at elapsed."""
+    start = None
+    document = None
+    for at, version in sorted(eventFeed.get("versions", []), key=lambda v: v[0]):
+        if at > elapsed:
+            break
+        start, document = at, version
+    if isinstance(document, str):
+        with open(os.path.join(SCENARIO_DIR, document), "r", encoding="utf-8") as fp:
+            document = json.load(fp)
+    if document is None:
+        document = {"events": []}
+    body = json.dumps(document, indent=1)
+    if eventFeed.get("aio"):
+        body = json.dumps({"id": "0", "feed_key": "events", "value": body})
+    return (start or 0, body.encode("utf-8"))
+
+
+class TimeRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.0"
+
+    def do_GET(self):
+        feed = simhooks.feed
+        server = self.server
+        server.requests += 1
+        server.latency = feed.syncLatency
+
+        url = urllib.parse.urlsplit(self.path)
+        if feed.eventFeed is not None and not url.path.endswith("/integrations/time/strftime"):
+            self.serveFeed(feed.eventFeed)
+            return
+
+        if feed.syncFails(simhooks.elapsed()):
+            server.failures += 1
+            mode = feed.syncFailureMode
+            if mode == "hang":
+                server.latency = None
+                return
+            if mode == "drop":
+                self.close_connection = True
+                return
+            self.send_error(500, "Simulated time service failure")
+            return
+
+        if not url.path.endswith("/integrations/time/strftime"):
+            self.send_error(404)
+            return
+        query = urllib.parse.parse_qs(url.query)
+        fmt = query.get("fmt", ["%Y-%m-%d %H:%M:%S.%L %j %u %z %Z"])[0]
+        now = simhooks.clock.now
+        millis = int((now - int(now)) * 1000)
+        body = time.strftime(fmt.replace("%L", f"{millis:03}"),
+                             time.gmtime(int(now))).encode("utf-8")
+        if feed.syncChunked:
+            self.protocol_version = "HTTP/1.1"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.sendBody(body, feed.syncChunked)
+
+    def serveFeed(self, eventFeed):
+        elapsed = simhooks.elapsed()
+        simhooks.recorder.record("feed_request", self.path, {
+            "etag": self.headers.get("If-None-Match"),
+            "lastModified": self.headers.get("If-Modified-Since")})
+        status = 200
+        for start, end in eventFeed.get("failures", []):
+            if start <= elapsed < end:
+                status = 500
+        if eventFeed.get("aio") and not self.headers.get("X-AIO-Key"):
+            status = 401
+        if status != 200:
+            simhooks.recorder.record("feed_reply", self.path, status)
+            self.send_error(status)
+            return
+
+        start, body = feedVersion(eventFeed, elapsed)
+        chunked = eventFeed.get("chunked", False)
+        if chunked:
+            self.protocol_version = "HTTP/1.1"
+        etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+        modified = email.utils.formatdate(simhooks.clock.start + start, usegmt=True)
+        since = self.headers.get("If-Modified-Since")
+        if self.headers.get("If-None-Match") == etag or (
+                since is not None and self.headers.get("If-None-Match") is None
+                and email.utils.parsedate_to_datetime(since).timestamp() >= simhooks.clock.start + start):
+            status = 304
+        simhooks.recorder.record("feed_reply", self.path, status)
+        self.send_response(status)
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", modified)
+        if status == 304:
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_header("Content-Type", "application/json")
+        self.sendBody(body, chunked)
+
+    def sendBody(self, body, chunked):
+        """Ends the headers and sends the body, in chunks of CHUNK_BYTES with
+        a chunk extension on the first when chunked."""
+        if not chunked:
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i in range(0, len(body), CHUNK_BYTES):
+            chunk = body[i:i + CHUNK_BYTES]
+            extension = ";part=first" if i == 0 else ""
+            self.wfile.write(f"{len(chunk):x}{extension}\r\n".encode("ascii") + chunk + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TimeServer(http.server.HTTPServer):
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), TimeRequestHandler)
+        self.timeout = 1.0
+        self.latency = None
+        self.requests = 0
+        self.failures = 0
+
+    def handle(self):
+        """
+        Serves the request the device just sent. Returns the virtual seconds
+        before the reply may be read, or None if it never comes.
+        """
+        self.latency = None
+        # Connections the device opened and closed without a request are
+        # accepted first and answer nothing
+        before = self.requests
+        for _ in range(8):
+            self.handle_request()
+            if self.requests > before:
+                break
+        return self.latency
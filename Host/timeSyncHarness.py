@@ -0,0 +1,140 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Checks that syncing the time never holds up the clock on the screen.
+
+Runs code.py in the simulator against the local HTTP stand-in of the time
+service (Host/timeServer.py) with slow replies, server errors, dropped and
+hanging connections, a chunked reply, a Wi-Fi outage and a link lost during
+a request, and checks that:
+
+- the clock label keeps changing once per second (no gap longer than the
+  one repeated second a tick can show, and at least one change per second
+  on average),
+- the last good time stays on the screen while a sync is in flight,
+- failed attempts are retried with a growing backoff,
+- the clock is set once the failures stop.
+
+    python Host/timeSyncHarness.py
+    python Host/timeSyncHarness.py --code old_code.py
+
+Exits with status 1 if any check fails.
+"""
+
+import argparse
+import contextlib
+import io
+import sys
+
+from simulator import Simulator, DEFAULT_SCENARIO, loadScenario
+
+# Default of timeSync
+BACKOFF_BASE = 5
+
+CASES = (
+    ("slow reply", {"duration": 60, "timeSync": {"latency": 8.0}}, None),
+    ("server errors", {"duration": 180,
+                       "timeSync": {"latency": 1.0, "failures": [[0, 60]],
+                                    "failureMode": "error"}}, 60),
+    ("dropped connections", {"duration": 90,
+                             "timeSync": {"latency": 1.0, "failures": [[0, 30]],
+                                          "failureMode": "drop"}}, 30),
+    ("hanging requests", {"duration": 120,
+                          "timeSync": {"latency": 1.0, "failures": [[0, 40]],
+                                       "failureMode": "hang"}}, 40),
+    ("chunked reply", {"duration": 60,
+                       "timeSync": {"latency": 1.0, "chunked": True}}, None),
+    ("Wi-Fi down", {"duration": 120, "connected": [[0, False], [45, True]],
+                    "timeSync": {"latency": 1.0}}, 45),
+    ("link lost mid request", {"duration": 300,
+                               "connected": [[0, True], [1, False], [200, True]],
+                               "timeSync": {"latency": 2.0}}, 200),
+    ("hourly resync fails", {"duration": 3700,
+                             "timeSync": {"latency": 2.0,
+                                          "failures": [[3590, 3700]],
+                                          "failureMode": "hang"}}, None),
+)
+
+
+def runCase(name, overrides, failUntil, codePath=None):
+    scenario = loadScenario(DEFAULT_SCENARIO)
+    # A touch on the clock switches to the 12 hour format, without seconds
+    scenario["touches"] = []
+    scenario.update(overrides)
+    sim = Simulator(scenario, codePath=codePath, trackAllocations=False, keepTrace=True)
+    # The console output of code.py is not part of the checks
+    with contextlib.redirect_stdout(io.StringIO()):
+        report = sim.run()
+    trace = sim.trace()
+    problems = []
+
+    clock = [(r["at"], r["value"][0]) for r in trace
+             if r["kind"] == "text" and r["target"] == "statusDateTime" and r["value"][1]]
+    requests = [r["at"] for r in trace if r["kind"] in ("http_request", "get_local_time")]
+    syncs = [r["at"] for r in trace if r["kind"] == "rtc_set"]
+
+    # One second cadence of the clock label
+    ticks = [at for at, text in clock if text != "Updating Time"]
+    gaps = [b - a for a, b in zip(ticks, ticks[1:])]
+    longest = max(gaps) if gaps else float("inf")
+    if longest > 2.0:
+        at = ticks[gaps.index(longest)]
+        problems.append(f"the clock label did not change for {longest:.2f} s at {at:.2f} s")
+    if ticks and (ticks[-1] - ticks[0]) > 0 and len(gaps) < 0.95 * (ticks[-1] - ticks[0]):
+        problems.append(f"the clock label changed {len(gaps)} times in "
+                        f"{ticks[-1] - ticks[0]:.0f} s")
+
+    # The last good time stays on the screen
+    if any(text == "Updating Time" for _, text in clock):
+        problems.append("the clock label was replaced by 'Updating Time'")
+    if syncs:
+        resets = [at for at, text in clock if at > syncs[0] and "/2000 " in text]
+        if resets:
+            problems.append(f"the clock went back to the reset time at {resets[0]:.2f} s")
+
+    # Backoff between the failed attempts
+    if failUntil is not None:
+        failed = [at for at in requests if at < failUntil]
+        for k, (a, b) in enumerate(zip(failed, failed[1:])):
+            minimum = BACKOFF_BASE * (2 ** k) / 2
+            if b - a < minimum:
+                problems.append(f"retry {k + 1} came {b - a:.1f} s after the last one, "
+                                f"expected at least {minimum:.1f} s")
+                break
+        if not [at for at in syncs if at >= failUntil]:
+            problems.append(f"the clock was not set after the failures stopped at {failUntil} s")
+    elif not syncs:
+        problems.append("the clock was never set")
+
+    summary = (f"{len(requests)} requests, {len(syncs)} syncs, "
+               f"longest clock gap {longest:.2f} s, busy "
+               f"{100.0 * (1 - report['idleSeconds'] / report['simulatedSeconds']):.1f} %")
+    recovered = [at for at in syncs if failUntil is not None and at >= failUntil]
+    if recovered:
+        summary += f", set {recovered[0] - failUntil:.1f} s after the failures stopped"
+    return problems, summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--code", help="path of the code.py to run")
+    parser.add_argument("--case", action="append",
+                        help="only run the cases with this name (repeatable)")
+    args = parser.parse_args(argv)
+
+    failures = 0
+    for name, overrides, failUntil in CASES:
+        if args.case and name not in args.case:
+            continue
+        problems, summary = runCase(name, overrides, failUntil, args.code)
+        print(f"{'FAIL' if problems else 'ok':<5}{name}: {summary}")
+        for problem in problems:
+            print(f"       {problem}")
+        failures += bool(problems)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Checks that the PyPortal starts where it left off after a reset.
+
+Runs code.py in the simulator once from an erased NVM, selecting another
+event and changing the settings by touch, then runs it again from the NVM
+that run left (a reset) and checks that:
+
+- the first useful frame (an event and the clock on the screen) comes
+  before the time sync instead of after it, and the connecting screens are
+  not shown,
+- the selected event, the backlight, the temperature unit and the clock
+  format are those of the first run,
+- after a power cycle, which clears the RTC, the clock is estimated from
+  the last record and corrected by the time sync,
+- a record cut short by the reset (on the SD card) is skipped for the one
+  before it,
+- the records are only written when a value changed and held for the
+  settle time of stateStore, so the touches of the first run write one
+  record, and the hourly time syncs of an idle board and the backlight
+  following the light sensor do not write one each.
+
+    python Host/warmStartHarness.py
+    python Host/warmStartHarness.py --case "power cycle"
+
+Exits with status 1 if any check fails.
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import sys
+
+from simulator import Simulator, DEFAULT_SCENARIO, loadScenario
+
+# stateStore
+SLOT_SIZE = 32
+MAGIC = b"\x53\x50"
+# code.py
+STATE_SAVE_INTERVAL = 10.0
+# stateStore.SETTLE_TIME
+SETTLE_TIME = 60
+# Three hourly time syncs and the light changes of the default scenario
+IDLE_RUN = 3 * 3600 + 60
+
+# Long enough for the last change to settle and be written
+FIRST_RUN = 120
+# Next event twice, then the temperature unit, the clock format and the
+# backlight; the first time sync and the settled changes write a record each
+FIRST_RUN_RECORDS = 2
+TOUCHES = [
+    {"at": 10, "x": 260, "y": 120, "hold": 0.1},
+    {"at": 20, "x": 260, "y": 120, "hold": 0.1},
+    {"at": 30, "x": 30, "y": 25, "hold": 0.1},
+    {"at": 35, "x": 160, "y": 25, "hold": 0.1},
+    {"at": 40, "x": 30, "y": 225, "hold": 0.1},
+]
+STATE_SCREENS = ("connecting.bmp", "connect_failed.bmp")
+
+# name, seconds the board is off, RTC kept, scenario changes, damage to the
+# NVM, expected to start warm
+CASES = (
+    ("soft reset", 5, True, {}, None, True),
+    ("power cycle", 300, False, {}, None, True),
+    ("power cycle, slow time sync", 300, False, {"timeSync": {"latency": 8.0}}, None, True),
+    ("power cycle, Wi-Fi down", 300, False,
+     {"connected": [[0, False]], "timeSync": {"latency": 2.5}}, None, True),
+    ("torn last record", 300, False, {}, "tear", True),
+    ("erased NVM", 300, False, {}, "erase", False),
+)
+
+
+def scenarioAt(start, duration, touches, changes):
+    scenario = loadScenario(DEFAULT_SCENARIO)
+    scenario["start"] = start.isoformat()
+    scenario["duration"] = duration
+    scenario["touches"] = touches
+    scenario["console"] = []
+    scenario.update(changes)
+    return scenario
+
+
+def simulate(scenario, nvm=None, rtcKept=False):
+    scenario["rtcSet"] = rtcKept
+    sim = Simulator(scenario, trackAllocations=False, keepTrace=True, nvm=nvm)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        sim.run()
+    return sim, output.getvalue()
+
+
+def firstUsefulFrame(trace):
+    """(time, labels shown) of the first refresh with an event and the
+    clock on the screen, or (None, labels at the end)."""
+    shown = {}
+    for r in trace:
+        if r["kind"] == "text":
+            shown[r["target"]] = r["value"][0]
+        elif (r["kind"] == "refresh" and shown.get("title")
+              and shown.get("statusDateTime", "No Time Info") != "No Time Info"):
+            return r["at"], dict(shown)
+    return None, shown
+
+
+def syncedAt(trace):
+    """When the time sync set the clock (not the clock restored at boot)."""
+    requested = False
+    for r in trace:
+        if r["kind"] == "http_request":
+            requested = True
+        elif r["kind"] == "rtc_set" and requested:
+            return r["at"]
+    return None
+
+
+def records(nvm):
+    """(sequence, offset) of the slots of the NVM holding a record."""
+    return [(int.from_bytes(nvm[start + 2:start + 6], "little"), start)
+            for start in range(0, len(nvm), SLOT_SIZE)
+            if nvm[start:start + 2] == MAGIC]
+
+
+def damage(nvm, how):
+    nvm = bytearray(nvm)
+    if how == "erase":
+        nvm[:] = b"\xff" * len(nvm)
+    elif how == "tear":
+        # The second half of the newest record was not written
+        _, newest = max(records(nvm))
+        nvm[newest + SLOT_SIZE // 2:newest + SLOT_SIZE] = b"\xff" * (SLOT_SIZE // 2)
+    return nvm
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--case", action="append",
+                        help="only run the cases with this name (repeatable)")
+    args = parser.parse_args(argv)
+
+    start = datetime.datetime.fromisoformat(loadScenario(DEFAULT_SCENARIO)["start"])
+    first, _ = simulate(scenarioAt(start, FIRST_RUN, TOUCHES, {}))
+    firstTrace = first.trace()
+    coldAt, _ = firstUsefulFrame(firstTrace)
+    _, expected = firstUsefulFrame([r for r in firstTrace if r["kind"] == "text"])
+    nvmWrites = sum(1 for r in firstTrace if r["kind"] == "nvm_write")
+    problems = ([] if nvmWrites == FIRST_RUN_RECORDS
+                else [f"{nvmWrites} records written, expected {FIRST_RUN_RECORDS}"])
+    print(f"{'FAIL' if problems else 'ok':<5}first run: first useful frame at {coldAt:.2f} s "
+          f"(time synced at {syncedAt(firstTrace):.2f} s), {nvmWrites} records written for "
+          f"{len(TOUCHES)} changes in {FIRST_RUN} s")
+    for problem in problems:
+        print(f"       {problem}")
+    failures = bool(problems)
+    for name, offSeconds, rtcKept, changes, how, warm in CASES:
+        if args.case and name not in args.case:
+            continue
+        restart = start + datetime.timedelta(seconds=FIRST_RUN + offSeconds)
+        scenario = scenarioAt(restart, 30, [], changes)
+        sim, output = simulate(scenario, damage(first.nvm, how), rtcKept)
+        trace = sim.trace()
+        problems = []
+
+        at, shown = firstUsefulFrame(trace)
+        synced = syncedAt(trace)
+        if at is None:
+            problems.append("no event was shown")
+        elif warm and synced is not None and at >= synced:
+            problems.append(f"the first event was shown at {at:.2f} s, after the time sync")
+        elif not warm and (synced is None or at < synced):
+            problems.append("an event was shown before the clock was set")
+        screens = [r["target"] for r in trace if r["kind"] in ("ondiskbitmap", "imageload")
+                   and str(r["target"]).endswith(STATE_SCREENS)]
+        if warm and screens:
+            problems.append(f"showed {', '.join(screens)}")
+
+        # A torn record (in state.bin on the SD card) is skipped for the one
+        # before it, which has older settings
+        if warm and at is not None and how is None:
+            for label in ("title", "statusTemperature", "statusBrightness"):
+                if label == "statusTemperature":
+                    same = shown.get(label, "")[-1:] == expected.get(label, "")[-1:]
+                else:
+                    same = shown.get(label) == expected.get(label)
+                if not same:
+                    problems.append(f"{label} shows {shown.get(label)!r}, "
+                                    f"was {expected.get(label)!r}")
+            if ("M" in shown["statusDateTime"]) != ("M" in expected["statusDateTime"]):
+                problems.append(f"the clock shows {shown['statusDateTime']!r}, "
+                                f"was {expected['statusDateTime']!r}")
+
+        # How far the restored clock was off, as corrected by the sync
+        correction = None
+        if warm and synced is not None:
+            correction = sim.namespace["clock_correction"]
+        if warm and not rtcKept and "estimated" not in output:
+            problems.append("the clock was not estimated from the last run")
+
+        summary = f"first useful frame at {at:.2f} s" if at is not None else "no useful frame"
+        if synced is not None:
+            summary += f", time synced at {synced:.2f} s"
+        if correction is not None:
+            summary += f", which moved the clock by {correction} s"
+        print(f"{'FAIL' if problems else 'ok':<5}{name}: {summary}")
+        for problem in problems:
+            print(f"       {problem}")
+        failures += bool(problems)
+
+    # Writes while the default scenario keeps changing the settings
+    busy, _ = simulate(loadScenario(DEFAULT_SCENARIO))
+    busyTrace = busy.trace()
+    changes = sum(1 for r in busyTrace if r["kind"] == "text"
+                  and r["target"] in ("statusBrightness", "title")
+                  and r["value"][1])
+    writes = sum(1 for r in busyTrace if r["kind"] == "nvm_write")
+    duration = busyTrace[-1]["at"]
+    print(f"Default scenario: {writes} records for {changes} backlight and event changes in "
+          f"{duration:.0f} s ({len(records(busy.nvm))} slots used, a change written once it held "
+          f"{SETTLE_TIME} s)")
+
+    # Left alone, only the first time sync is written
+    idle, _ = simulate(scenarioAt(start, IDLE_RUN, [], {}))
+    idleTrace = idle.trace()
+    syncs = sum(1 for r in idleTrace if r["kind"] == "http_request")
+    writes = sum(1 for r in idleTrace if r["kind"] == "nvm_write")
+    problems = [] if writes == 1 else [f"{writes} records written, expected 1"]
+    print(f"{'FAIL' if problems else 'ok':<5}idle board: {writes} records for {syncs} time syncs "
+          f"in {IDLE_RUN / 3600:.1f} hours")
+    for problem in problems:
+        print(f"       {problem}")
+    failures += bool(problems)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Reads the events of the iCalendar (.ics) files on the SD card one line at a
+time and turns each VEVENT into an event record in the format of
+config.json, so they are stored like the events of config.json:
+
+- SUMMARY is the title, LOCATION the subtitle (else DESCRIPTION),
+- DTSTART the date and time, midnight for an all day event,
+- RRULE with FREQ=DAILY, WEEKLY, MONTHLY or YEARLY, INTERVAL and UNTIL or
+  COUNT becomes repeat, interval and until (eventRecurrence),
+- X-PYPORTAL-COLOR, X-PYPORTAL-IMAGE and X-PYPORTAL-EVENT-IMAGE set the
+  forecolor, imageCountDown and imageEventDay. Without them the images are
+  named after the file, e.g. holidays_background.bmp and holidays_event.bmp
+  for holidays.ics.
+
+The device clock has no time zones, so the times are taken as local time
+whatever their TZID or Z suffix. The BYDAY, BYMONTHDAY... parts of a rule
+are not supported: the event repeats on the day of DTSTART.
+"""
+
+import os
+import time
+from configLoader import eventEpoch
+from eventRecurrence import FREQUENCIES, makeRule, nextOccurrence, recordRule
+
+CALENDAR_EXTENSION = ".ics"
+# Parts of an RRULE that are understood
+RULE_PARTS = ("FREQ", "INTERVAL", "UNTIL", "COUNT", "WKST")
+
+
+# **************** FUNCTIONS ******************
+def calendarFiles(folder):
+    """Names of the .ics files in folder, sorted."""
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return []
+    return sorted(name for name in names
+                  if name.lower().endswith(CALENDAR_EXTENSION) and not name.startswith("."))
+
+
+def _unescape(text):
+    if text.find("\\") < 0:
+        return text
+    result = []
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c == "\\" and i + 1 < len(text):
+            i += 1
+            c = text[i]
+            if c in "nN":
+                c = " "
+        result.append(c)
+        i += 1
+    return "".join(result)
+
+
+def _split(line):
+    # "NAME;PARAM=VALUE:value" -> (NAME, value); a colon in a quoted
+    # parameter value is not the separator
+    quoted = False
+    for i in range(len(line)):
+        c = line[i]
+        if c == '"':
+            quoted = not quoted
+        elif c == ":" and not quoted:
+            name = line[:i]
+            semicolon = name.find(";")
+            if semicolon >= 0:
+                name = name[:semicolon]
+            return (name.upper(), line[i + 1:])
+    return (line.upper(), "")
+
+
+def _lines(fp):
+    # Yields the unfolded lines: a line that starts with a space or a tab
+    # continues the one before
+    pending = None
+    for line in fp:
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t"):
+            if pending is not None:
+                pending += line[1:]
+            continue
+        if pending is not None:
+            yield pending
+        pending = line
+    if pending:
+        yield pending
+
+
+def _date(value):
+    # (year, month, day, hour, minute) of "20231225" or "20231225T090000Z"
+    if len(value) < 8:
+        raise ValueError(f"date {value} is too short")
+    hour = 0
+    minute = 0
+    if len(value) >= 13 and value[8] == "T":
+        hour = int(value[9:11])
+        minute = int(value[11:13])
+    return (int(value[0:4]), int(value[4:6]), int(value[6:8]), hour, minute)
+
+
+def _rule(value, start, title):
+    # repeat, interval and until entries of a record from an RRULE
+    parts = {}
+    for part in value.split(";"):
+        name, _, partValue = part.partition("=")
+        parts[name.upper()] = partValue
+    frequency = parts.get("FREQ", "").lower()
+    if not frequency or frequency not in FREQUENCIES:
+        print(f"WARN: {title}: FREQ={parts.get('FREQ')} is not supported, the event does not repeat")
+        return {}
+    unsupported = [name for name in parts if name not in RULE_PARTS]
+    if unsupported:
+        print(f"WARN: {title}: {', '.join(unsupported)} of the RRULE ignored, "
+              "the event repeats on the day it starts")
+    entries = {"repeat": frequency}
+    interval = int(parts.get("INTERVAL") or 1)
+    if interval != 1:
+        entries["interval"] = str(interval)
+    if "UNTIL" in parts:
+        year, month, day, _, _ = _date(parts["UNTIL"])
+        entries["until"] = f"{year:04}-{month:02}-{day:02}"
+    elif "COUNT" in parts:
+        # The end is the day of the last occurrence
+        rule = makeRule(FREQUENCIES.index(frequency), interval)
+        epoch = int(time.mktime(start + (0, -1, -1, -1)))
+        last = epoch
+        for _ in range(int(parts["COUNT"]) - 1):
+            following = nextOccurrence(epoch, rule, 0, last + 1)
+            if following is None:
+                break
+            last = following
+        d = time.localtime(last)
+        entries["until"] = f"{d.tm_year:04}-{d.tm_mon:02}-{d.tm_mday:02}"
+    return entries
+
+
+def _record(properties, baseName):
+    # Event record of config.json from the properties of a VEVENT
+    title = properties.get("SUMMARY", "")
+    year, month, day, hour, minute = _date(properties["DTSTART"])
+    record = {
+        "year": str(year), "month": str(month), "day": str(day),
+        "hour": f"{hour:02}", "minute": f"{minute:02}",
+        "forecolor": properties.get("X-PYPORTAL-COLOR", "0xF0C810"),
+        "title": title,
+        "subtitle": properties.get("LOCATION") or properties.get("DESCRIPTION", ""),
+        "imageCountDown": properties.get("X-PYPORTAL-IMAGE", baseName + "_background.bmp"),
+        "imageEventDay": properties.get("X-PYPORTAL-EVENT-IMAGE", baseName + "_event.bmp"),
+    }
+    if "RRULE" in properties:
+        record.update(_rule(properties["RRULE"], (year, month, day, hour, minute), title))
+    return record
+
+
+def readCalendar(path, onEvent, skipBefore=None):
+    """
+    Streams the iCalendar file at path and calls onEvent(record) for each
+    event that does not start before skipBefore (seconds since the epoch, or
+    None to keep all) or repeats. Returns (eventsLoaded, eventsSkipped).
+    """
+    loaded = 0
+    skipped = 0
+    start = time.monotonic_ns()
+    name = path[path.rfind("/") + 1:]
+    baseName = name[:name.rfind(".")]
+
+    properties = None
+    depth = 0
+    with open(path, "r") as fp:
+        for line in _lines(fp):
+            key, value = _split(line)
+            if key == "BEGIN":
+                if properties is not None:
+                    # e.g. a VALARM of the event
+                    depth += 1
+                elif value.upper() == "VEVENT":
+                    properties = {}
+                    depth = 0
+            elif key == "END":
+                if properties is None:
+                    continue
+                if depth:
+                    depth -= 1
+                    continue
+                try:
+                    record = _record(properties, baseName)
+                    recordRule(record)
+                except (KeyError, ValueError) as e:
+                    print(f"WARN: {name}: skipped {properties.get('SUMMARY', 'an event')}, no valid DTSTART or RRULE\r\n{e}")
+                    skipped += 1
+                    properties = None
+                    continue
+                properties = None
+                if (skipBefore is not None and not record.get("repeat")
+                        and eventEpoch(record) < skipBefore):
+                    skipped += 1
+                else:
+                    onEvent(record)
+                    loaded += 1
+            elif properties is not None and depth == 0 and key not in properties:
+                properties[key] = _unescape(value)
+
+    elapsed = (time.monotonic_ns() - start) // 1000000
+    print(f"INFO: {name}: {loaded} events loaded, {skipped} skipped in {elapsed} ms")
+    return (loaded, skipped)
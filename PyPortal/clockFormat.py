@@ -0,0 +1,119 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Clock and countdown text that allocates as little as possible per tick.
+
+eventDisplay.format_datetime() formats the whole date and time every second.
+clockFormat keeps the text in a bytearray instead: the date part is written
+when the day (or the format) changes, and each tick only writes the digits
+of the time into it, from tables of the digits of 0 to 99. The one string a
+tick allocates is the text handed to the label, and none at all when the
+text did not change (the 12 hour format shows no seconds).
+
+number() returns the text of a count from a table of "0" to "99", so the
+countdown hours and minutes allocate nothing either.
+
+`allocations` counts the strings and buffers made so far, so the caller
+can check how many a tick takes.
+"""
+
+DOW = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+# The characters of 0 to 99 as two digits, and with a space for a leading 0
+TENS = bytes(b"0123456789"[n // 10] for n in range(100))
+ONES = bytes(b"0123456789"[n % 10] for n in range(100))
+SPACED_TENS = bytes(b" 123456789"[n // 10] for n in range(100))
+NUMBERS = tuple(str(n) for n in range(100))
+
+# Characters of the time of day at the end of the text
+TIME_LENGTH = 8
+
+
+# **************** CLASS ******************
+class clockFormat:
+    def __init__(self):
+        self.allocations = 0
+        self._buffer = None
+        self._date = None
+        self._format24 = None
+        self._time = -1
+        self._text = None
+        self._number = None
+        self._numberText = None
+
+    # **************** INTERNAL METHODS ******************
+    def _setDate(self, t, show24hourFormat):
+        if show24hourFormat:
+            # MM/DD/YYYY HH:MM:SS
+            prefix = "{:02}/{:02}/{} ".format(t.tm_mon, t.tm_mday, t.tm_year)
+        else:
+            # Dow MM/DD/YYYY HH:MM AM
+            prefix = "{} {:2}/{:2}/{} ".format(DOW[t.tm_wday], t.tm_mon, t.tm_mday, t.tm_year)
+        self._buffer = bytearray(len(prefix) + TIME_LENGTH)
+        self._buffer[0:len(prefix)] = bytes(prefix, "utf-8")
+        self.allocations += 3
+
+        p = len(prefix)
+        self._buffer[p + 2] = 58        # ':'
+        if show24hourFormat:
+            self._buffer[p + 5] = 58
+        else:
+            self._buffer[p + 5] = 32    # ' '
+            self._buffer[p + 7] = 77    # 'M'
+
+        self._date = (t.tm_year * 13 + t.tm_mon) * 32 + t.tm_mday
+        self._format24 = show24hourFormat
+        self._time = -1
+
+    # **************** PUBLIC METHODS ******************
+    def datetime(self, t, show24hourFormat):
+        """The text of eventDisplay.format_datetime(t, show24hourFormat)."""
+        date = (t.tm_year * 13 + t.tm_mon) * 32 + t.tm_mday
+        if date != self._date or show24hourFormat != self._format24:
+            self._setDate(t, show24hourFormat)
+
+        if show24hourFormat:
+            value = (t.tm_hour * 60 + t.tm_min) * 60 + t.tm_sec
+        else:
+            value = t.tm_hour * 60 + t.tm_min
+        if value == self._time:
+            return self._text
+        self._time = value
+
+        buffer = self._buffer
+        p = len(buffer) - TIME_LENGTH
+        m = t.tm_min
+        if show24hourFormat:
+            h = t.tm_hour
+            s = t.tm_sec
+            buffer[p] = TENS[h]
+            buffer[p + 1] = ONES[h]
+            buffer[p + 3] = TENS[m]
+            buffer[p + 4] = ONES[m]
+            buffer[p + 6] = TENS[s]
+            buffer[p + 7] = ONES[s]
+        else:
+            h = t.tm_hour
+            buffer[p + 6] = 80 if h >= 12 else 65   # 'P' or 'A'
+            if h > 12:
+                h = h - 12
+            buffer[p] = SPACED_TENS[h]
+            buffer[p + 1] = ONES[h]
+            buffer[p + 3] = TENS[m]
+            buffer[p + 4] = ONES[m]
+
+        self._text = str(buffer, "utf-8")
+        self.allocations += 1
+        return self._text
+
+    def number(self, n):
+        """str(n), from the table for 0 to 99 and else kept until n changes."""
+        if 0 <= n < 100:
+            return NUMBERS[n]
+        if n != self._number:
+            self._number = n
+            self._numberText = str(n)
+            self.allocations += 1
+        return self._numberText
@@ -7,16 +7,32 @@ This example will figure out the current local time using the internet, and
 then draw out a countdown clock until an event occurs!
 Once the event is happening, a new graphic is shown
 """
-import math
+import asyncio
+import sys
 import time
 import board
+import microcontroller
+import rtc
+import supervisor
 import busio
-import json
 import adafruit_adt7410
 import adafruit_touchscreen
 from adafruit_pyportal import PyPortal
 from analogio import AnalogIn
-from event import event
+import eventIndex
+from clockFormat import clockFormat
+from calendarLoader import calendarFiles, readCalendar
+from configLoader import loadConfig
+from configWatcher import configWatcher
+from lightSensor import lightSensor
+from linkMonitor import linkMonitor
+from profiler import profiler
+from stateStore import stateStore, fileStorage
+from temperatureSensor import temperatureSensor
+from eventStore import eventStore, SOURCE_FEED, SOURCE_CALENDAR
+from eventTimeline import eventTimeline, COUNTDOWN
+from feedSync import feedSync, FEED_FILE
+from timeSync import timeSync, IDLE, CONNECTING, BACKING_OFF
 from secrets import secrets
 from eventDisplay import eventDisplay
 
@@ -28,207 +44,483 @@ def adjustBacklight(val=-1.0):
     LIGHT (CircuitPython) or A2 (Arduino) you can read it as any analog value ranging 
     from 0 (dark) to 1023 (in Arduino) or 65535 (CircuitPython) when bright.
     """
+    global backlightShown, backlightShownAuto
+
     if (backlightAuto):
-        # startAutoDimAt = 32768
-        minAutoBrightness = 0.01
-        MAXIMUM_LUX_BREAKPOINT = 1254.0
-
-        # val = light_sensor.value/startAutoDimAt + minAutoBrightness
-        lightReading = light_sensor.value
-        lightLuxApprox = (lightReading/65536)*2000
-        val = 1.0
-        # https://www.analog.com/en/design-notes/a-simple-implementation-of-lcd-brightness-control-using-the-max44009-ambientlight-sensor.html
-        if lightLuxApprox < MAXIMUM_LUX_BREAKPOINT:
-            val = (9.9323*math.log(lightLuxApprox) + 27.059)/100.0
-            # print(f"lightReading = {lightReading} & lightLuxApprox = {lightLuxApprox} & val = {val}")
-        # Make certain that the screen is still lit by maintaining min value
-        if val < minAutoBrightness:
-            val = minAutoBrightness
+        # Smoothed and mapped through a table by lightSensor, which only
+        # changes the level when the light really changed
+        val = light_sensor.brightness()
 
     # https://learn.adafruit.com/making-a-pyportal-user-interface-displayio/display
     val = max(0, min(1.0, val))
+    # Write the PWM and the label only when they change
+    if val == backlightShown and backlightAuto == backlightShownAuto:
+        return val
+    backlightShown = val
+    backlightShownAuto = backlightAuto
+
     # board.DISPLAY.auto_brightness = False
     board.DISPLAY.brightness = val
 
     if backlightAuto:
-        eventWindow.statusBrightness.text = "Auto"
+        eventWindow.setText(eventWindow.statusBrightness, "Auto")
     else:
-        eventWindow.statusBrightness.text = "{:3.0f} %".format(val * 100.0)
+        eventWindow.setText(eventWindow.statusBrightness,
+                            "{:3.0f} %".format(val * 100.0))
 
     return val
 
 
-"""
-Most likely, this can be replaced with proper values when initializing
-the touch display with the calibration parameter/attribute. The values
-for MIN_X, MIN_Y, MAX_X, MAX_Y where determined by touching the corners
-of the screen and reading the reported values using a print statement.
-"""
+def onTouchBrightnessAuto(repeat):
+    global backlightAuto, backlightVal
 
+    backlightAuto = True
+    backlightVal = adjustBacklight(backlightVal)
 
-def adjustTouch(touchTuple):
-    MIN_X = 20
-    MIN_Y = 18
-    MAX_X = 319
-    MAX_Y = 230
 
-    x = touchTuple[0] - MIN_X
-    y = touchTuple[1] - MIN_Y
-    x = x * screen_width/(MAX_X - MIN_X)
-    y = y * screen_height/(MAX_Y - MIN_Y)
+def onTouchBrightnessMinus(repeat):
+    global backlightAuto, backlightVal
 
-    if x < 0:
-        x = 0
-    elif x > screen_width:
-        x = screen_width
-    if y < 0:
-        y = 0
-    elif y > screen_height:
-        y = screen_height
+    # A tap takes a full step, holding the button ramps in small steps
+    backlightAuto = False
+    if repeat:
+        backlightVal = backlightVal - backlightRampStep
+    else:
+        backlightVal = backlightVal - backlightStepSize
+    backlightVal = adjustBacklight(backlightVal)
 
-    return (x, y, touchTuple[2])
 
+def onTouchBrightnessPlus(repeat):
+    global backlightAuto, backlightVal
 
-def getTime(lastRefreshedTime, secondsToUpdate):
-    if pyportal is None:
-        return None
-    if (not lastRefreshedTime) or (time.monotonic() - lastRefreshedTime) > secondsToUpdate:
-        eventWindow.statusDateTime.text = "Updating Time"
-        try:
-            print("INFO: Getting time from internet!")
-            if (not lastRefreshedTime):
-                eventWindow.changeBackground(
-                    eventWindow.IMG_FILE_CONNECTING_BACKGROUND, False)
+    backlightAuto = False
+    if repeat:
+        backlightVal = backlightVal + backlightRampStep
+    else:
+        backlightVal = backlightVal + backlightStepSize
+    backlightVal = adjustBacklight(backlightVal)
 
-            start = time.time()
-            pyportal.get_local_time()  # pyportal.get_local_time(false) non-blocking?
-            print(f"INFO: Getting time took {time.time() - start} seconds.")
-            lastRefreshedTime = time.monotonic()
-            print("INFO: Success the time has been set.")
-        except RuntimeError as e:
-            print(f"WARN: Some error occured, retrying!\r\n{e}")
-            if (not lastRefreshedTime):
-                eventWindow.changeBackground(
-                    eventWindow.IMG_FILE_CONNECT_FAILED_BACKGROUND, False)
-        # Use try catch here as there is an error in adafruit_portalbase
-        #   File "adafruit_portalbase/network.py", line 208, in get_strftime
-        #   AttributeError: 'NoneType' object has no attribute 'get'
-        except Exception as e:
-            print(f"ERROR: Failed to getTime\r\n{e}")
-            eventWindow.changeBackground(
-                eventWindow.IMG_FILE_CONNECT_FAILED_BACKGROUND, False)
 
-    if lastRefreshedTime:
-        removePastEvents()
+def onTouchAgenda(repeat):
+    showAgenda(not agenda_shown)
+
+
+def onTouchEventNext(repeat):
+    # Scrolls the agenda while it is shown, also while held
+    if agenda_shown:
+        scrollAgenda(1)
+        return
+    if repeat:
+        return
+    events.next()
+    updateClock()
+
+
+def onTouchEventPrevious(repeat):
+    if agenda_shown:
+        scrollAgenda(-1)
+        return
+    if repeat:
+        return
+    events.previous()
+    updateClock()
+
+
+def onTouchTemperature(repeat):
+    global temperatureInF
+
+    temperatureInF = not temperatureInF
+    updateTemperature(temperatureInF)
+
 
-    return lastRefreshedTime
+def onTouchTime(repeat):
+    global timeFormat24
+
+    timeFormat24 = not timeFormat24
+    updateClock()
+
+
+def expiredBefore():
+    # Events that ended more than a day ago are skipped, once the clock is set
+    if time.localtime().tm_year >= 2020:
+        return time.time() - 86400
+    return None
+
+
+def addFeedRecord(record):
+    events.addRecord(record, SOURCE_FEED)
+
+
+def addCalendarRecord(record):
+    events.addRecord(record, SOURCE_CALENDAR)
 
 
 def loadSdCard():
     # load events from SD Card
-    # Attempt to load config.json from SD Card
-    try:
-        with open("/sd/config.json", "r") as fp:
-            x = fp.read()
-            # parse x:
-            y = json.loads(x)
-            secrets["ssid"] = y["secrets"]["ssid"]
-            secrets["password"] = y["secrets"]["password"]
-            secrets["timezone"] = y["secrets"]["timezone"]
-            secrets["aio_username"] = y["secrets"]["aio_username"]
-            secrets["aio_key"] = y["secrets"]["aio_key"]
-
-            imagePathRoot = "/sd"
-
-            events.clear()
-
-            for i in range(len(y["events"])):
-                # title, subtitle, year, month, day, hour, minute, imageCountDown, imageEventDay, forecolor=0xF0C810):
-                events.append(event(y["events"][i]["title"],
-                                    y["events"][i]["subtitle"],
-                                    int(y["events"][i]["year"]),
-                                    int(y["events"][i]["month"]),
-                                    int(y["events"][i]["day"]),
-                                    int(y["events"][i]["hour"]),
-                                    int(y["events"][i]["minute"]),
-                                    y["events"][i]["imageCountDown"],
-                                    y["events"][i]["imageEventDay"],
-                                    int(y["events"][i]["forecolor"])))
+    # The events are read from the compiled index when it is current. It is
+    # rebuilt from config.json when that file changed (size or time stamp).
+    # The events of the remote feed, as last fetched, and of the iCalendar
+    # (.ics) files on the card are added to them.
+    events.clear()
+    timeline.invalidate()
 
+    skipBefore = expiredBefore()
+
+    try:
+        signature = eventIndex.jsonSignature(sdcardPath)
+        if not eventIndex.isCurrent(sdcardPath, signature):
+            start = time.monotonic()
+            count = eventIndex.build(sdcardPath, signature)
+            print(f"INFO: Built the event index of {count} events in {time.monotonic() - start} seconds.")
+        eventIndex.load(sdcardPath, secrets, events, skipBefore)
+        indexed = True
     except OSError as e:
-        print(f"ERROR: Could not read text file.\r\n{e}")
+        print(f"WARN: Could not use the event index, reading config.json.\r\n{e}")
+        events.clear()
+        indexed = False
+    except (ValueError, KeyError) as e:
+        print(f"ERROR: Could not parse config.json.\r\n{e}")
+        return
 
-    if len(events) > 0:
-        events.sort()
+    # Attempt to load config.json from SD Card. The file is read a chunk at a
+    # time and each event is stored as soon as it has been parsed.
+    if not indexed:
+        try:
+            loadConfig(sdcardPath + "/config.json", secrets, events.addRecord, skipBefore)
+        except OSError as e:
+            print(f"ERROR: Could not read text file.\r\n{e}")
+        except (ValueError, KeyError) as e:
+            print(f"ERROR: Could not parse config.json.\r\n{e}")
+
+    # The feed holds no secrets, so none are taken from it
+    if feedSync.configured(secrets):
+        try:
+            loadConfig(sdcardPath + "/" + FEED_FILE, {}, addFeedRecord, skipBefore)
+        except OSError:
+            # Not fetched yet
+            pass
+        except (ValueError, KeyError) as e:
+            print(f"ERROR: Could not parse {FEED_FILE}.\r\n{e}")
+
+    for name in calendarFiles(sdcardPath):
+        try:
+            readCalendar(sdcardPath + "/" + name, addCalendarRecord, skipBefore)
+        except OSError as e:
+            print(f"ERROR: Could not read {name}.\r\n{e}")
+        except (ValueError, KeyError) as e:
+            print(f"ERROR: Could not parse {name}.\r\n{e}")
 
+    events.sort()
 
-def networkQuality():
-    if eventWindow is None:
-        return
 
-    retval = -1
-    dBm = -100
+def onLinkChanged(connected):
+    if connected:
+        print(f"INFO: Wi-Fi link up ({link_monitor.dBm()} dBm)")
+    else:
+        print("INFO: Wi-Fi link down")
 
-    if pyportal.network._wifi.is_connected:
-        dBm = pyportal.network._wifi.esp.rssi
 
-        if dBm <= -90:
-            retval = 0
-        elif dBm >= -30:
-            retval = 100
-        else:
-            retval = 2 * (dBm + 100)
-
-    if eventWindow.spritesWifi:
-        if dBm >= -30:
-            eventWindow.spritesWifi[0] = 4
-        elif dBm >= -55:
-            eventWindow.spritesWifi[0] = 3
-        elif dBm >= -70:
-            eventWindow.spritesWifi[0] = 2
-        elif dBm >= -90:
-            eventWindow.spritesWifi[0] = 1
-        else:
-            eventWindow.spritesWifi[0] = 0
+def prefetchNeighbors():
+    """Decode the next and previous events' backgrounds into RAM, the next
+    one first, so that swiping to them does not have to read the SD card."""
+    if events.count() < 2:
+        return
 
-    return retval
+    eventWindow.prefetchBackgrounds(
+        (events.imageCountDown(events.neighbor(1)),
+         events.imageCountDown(events.neighbor(-1))))
 
 
 def playTouchSound():
     try:
-        pyportal.play_file(cwd + "/touch.wav", True)
+        # Do not wait for the sound to finish, the other tasks keep running
+        pyportal.play_file(cwd + "/touch.wav", False)
     except Exception as e:
         print(f"ERROR: Failed to play touch sound\r\n{e}")
 
 
+def printRepeat(i, nextEpoch):
+    d = time.localtime(nextEpoch)
+    print(f"INFO: Item {i} repeats on {d.tm_mon}/{d.tm_mday}/{d.tm_year}: {events.describe(i)}")
+
+
 def removePastEvents():
-    if len(events) == 0:
+    global last_event_index
+
+    # The events are sorted, so the ones that ended more than a day ago are
+    # all at the front of the store. A repeating event moves on to its next
+    # occurrence instead. The store keeps pointing at the event that was
+    # selected, also when it moved on, or at the first one left if the
+    # current event was removed or never chosen.
+    now = time.time()
+    removeCount = events.expireBefore(
+        now - 86400,
+        lambda i: print(f"INFO: Removing item {i}: {events.describe(i, now)}"),
+        printRepeat)
+
+    if removeCount > 0:
+        last_event_index = None
+
+    return removeCount
+
+
+def printUpcoming():
+    # The repeating events are expanded as the occurrences are taken
+    print(f"INFO: The next {UPCOMING_COUNT} occurrences:")
+    now = int(time.time())
+    taken = 0
+    for epoch, i in events.upcoming(now - 86400):
+        d = time.localtime(epoch)
+        print(f"  {d.tm_mon}/{d.tm_mday}/{d.tm_year} {d.tm_hour:02}:{d.tm_min:02}  {events.title(i)}")
+        taken += 1
+        if taken == UPCOMING_COUNT:
+            break
+
+
+def agendaOccurrence(position, start):
+    # The occurrence at position of those from start on, or None
+    for occurrence in events.upcoming(start):
+        if position == 0:
+            return occurrence
+        position -= 1
+    return None
+
+
+def agendaRow(row, epoch, i, now):
+    # The title, then the time to the occurrence ("123d 04h"), or "Today"
+    # once it started. The numbers are written as digits, not strings.
+    column = eventWindow.AGENDA_COLUMNS - eventWindow.AGENDA_TIME_WIDTH
+    eventWindow.agendaText(0, row, events.title(i), column - 1)
+    seconds = epoch - now
+    if seconds <= 0:
+        eventWindow.agendaText(column, row, "   Today")
         return
+    eventWindow.agendaNumber(column, row, seconds // 86400, 3)
+    eventWindow.agendaText(column + 3, row, "d ")
+    eventWindow.agendaNumber(column + 5, row, seconds // 3600 % 24, 2, "0")
+    eventWindow.agendaText(column + 7, row, "h")
 
-    global event_index, last_event_index
 
-    removeCount = 0
-    currentEvent = events[event_index]
+def fillAgenda(now):
+    """
+    Writes the rows of the agenda from the occurrence agenda_first on, as
+    from the u console command. Only the cells that show another character
+    change, so a minute where no hour went by redraws nothing.
+    """
+    rows = eventWindow.AGENDA_ROWS
+    row = 0
+    position = 0
+    for epoch, i in events.upcoming(now - 86400):
+        if position >= agenda_first:
+            agendaRow(row, epoch, i, now)
+            row += 1
+            if row == rows:
+                break
+        position += 1
+    while row < rows:
+        eventWindow.agendaText(0, row, "", eventWindow.AGENDA_COLUMNS)
+        row += 1
+
+
+def scrollAgenda(lines):
+    """
+    Scrolls the agenda by one row, down for 1 and up for -1, through the
+    first AGENDA_COUNT occurrences. The rows shown move in the grid and
+    only the one that comes into view is written.
+    """
+    global agenda_first
+
+    rows = eventWindow.AGENDA_ROWS
+    first = agenda_first + lines
+    if not clock_set or first < 0 or first + rows > AGENDA_COUNT:
+        return
+    now = int(time.time())
+    if lines > 0:
+        position = first + rows - 1
+        row = rows - 1
+    else:
+        position = first
+        row = 0
+    occurrence = agendaOccurrence(position, now - 86400)
+    if occurrence is None:
+        return
+    eventWindow.agendaScroll(lines)
+    agenda_first = first
+    agendaRow(row, occurrence[0], occurrence[1], now)
 
-    for i, e in reversed(list(enumerate(events))):
-        e.remainingUpdate()
-        if e.remainingTime < -86400:
-            print(f"INFO: Removing item {i}: {e}")
-            events.pop(i)
-            removeCount = removeCount + 1
 
-    if removeCount > 0:
-        # Does the array pointer point to the same object?
-        if currentEvent != events[event_index]:
-            for idx, item in enumerate(events):
-                if item == currentEvent:
-                    event_index = idx
-                    break
-            last_event_index = -1
+def showAgenda(show):
+    global agenda_shown, agenda_first, agenda_minute
+
+    if not eventWindow.showAgenda(show):
+        return
+    # It opens at the next occurrence, and the event is brought up to date
+    # when it closes
+    agenda_shown = show
+    agenda_first = 0
+    agenda_minute = None
+    timeline.invalidate()
+    updateClock()
+
+
+def stateStorage():
+    # The NVM of the board when it has room for the state, else a file on
+    # the SD card
+    nvm = microcontroller.nvm
+    if nvm is not None and len(nvm) >= stateStore.bytesNeeded():
+        return nvm
+    try:
+        return fileStorage(sdcardPath + "/" + STATE_FILE, stateStore.bytesNeeded())
+    except OSError as e:
+        print(f"WARN: The settings will not be kept across resets\r\n{e}")
+        return None
+
+
+def restoreClock():
+    """
+    Returns True if the clock holds a time before the first time sync: the
+    RTC kept running through the reset, or it was cleared and is set to the
+    time of the last record of the state, so that the events can be shown
+    at once. The time sync corrects it.
+    """
+    lastSync = state_store.lastSync
+    if lastSync is None:
+        return False
+    if time.time() >= lastSync:
+        print(f"INFO: The clock kept running through the reset "
+              f"(off by {state_store.correction} s at the last sync)")
+        return True
+    # How long the board was off is not known, so this is at least that far behind
+    estimate = max(lastSync, state_store.savedAt)
+    rtc.RTC().datetime = time.localtime(estimate)
+    print("INFO: The clock is estimated from the last run until the time sync")
+    return True
+
+
+def restoreEvent():
+    # The event selected in the last run, found by its time if config.json
+    # changed since
+    i = state_store.eventIndex
+    epoch = state_store.eventEpoch
+    if not 0 <= i < events.count() or events.epoch(i) != epoch:
+        i = events.bisect(epoch)
+        if i >= events.count() or events.epoch(i) != epoch:
+            return
+    events.select(i)
+
+
+def saveState():
+    # Written only when a setting or the event changed and then held for a
+    # minute, or once a day for the time sync (stateStore.save())
+    i = events.current()
+    epoch = 0
+    if i >= 0:
+        epoch = events.epoch(i)
+    try:
+        state_store.save(i, epoch, backlightAuto, backlightVal, temperatureInF,
+                         timeFormat24, last_sync_epoch, clock_correction, int(time.time()))
+    except OSError as e:
+        print(f"ERROR: Could not save the settings.\r\n{e}")
+
+
+def showEvent(now):
+    global last_event_index, last_event_phase, prefetch_pending
+
+    # Show the events with countdown
+    event_index = events.current()
+    if event_index < 0:
+        if event_index != last_event_index:
+            eventWindow.changeBackground(
+                eventWindow.IMG_FILE_NO_EVENTS_BACKGROUND, False)
+            last_event_index = event_index
+        timeline.plan(events, now)
+        return
+
+    if event_index != last_event_index:
+        # Remove the text
+        eventWindow.clearAllText()
+        eventWindow.setText(eventWindow.statusEventCount,
+                            f"{event_index + 1} of {events.count()}")
+        eventWindow.setColor(eventWindow.title,
+                             events.forecolor(event_index))
+        eventWindow.setText(eventWindow.title, events.title(event_index))
+        eventWindow.setColor(eventWindow.subtitle,
+                             events.forecolor(event_index))
+        eventWindow.setText(eventWindow.subtitle,
+                            events.subtitle(event_index))
+        last_event_index = event_index
+        last_event_phase = None
+        prefetch_pending = True
+
+    # The background and the labels change with the phase of the event: the
+    # countdown, then the event day with its own image when it has one
+    events.remainingUpdate(now)
+    phase = timeline.plan(events, now)
+    if phase != last_event_phase:
+        if phase == COUNTDOWN:
+            eventWindow.changeBackground(events.imageCountDown(event_index))
+            eventWindow.updateLabels((
+                (eventWindow.countlabelDays, "Days"),
+                (eventWindow.countlabelHours, "Hours"),
+                (eventWindow.countlabelMinutes, "Mins."),
+                (eventWindow.eventDayText, ""),
+            ))
         else:
-            last_event_index = -1
+            if events.hasEventDayImage(event_index):
+                eventWindow.changeBackground(events.imageEventDay(event_index))
+            else:
+                eventWindow.changeBackground(events.imageCountDown(event_index))
+            eventWindow.updateLabels((
+                (eventWindow.countlabelDays, ""),
+                (eventWindow.countlabelHours, ""),
+                (eventWindow.countlabelMinutes, ""),
+                (eventWindow.countDays, ""),
+                (eventWindow.countHours, ""),
+                (eventWindow.countMinutes, ""),
+                (eventWindow.eventDayText, "It's Today!!!"),
+            ))
+        last_event_phase = phase
+
+    if phase != COUNTDOWN:
+        return
 
-    return removeCount
+    # The numbers come from clock_text's table, so a tick allocates nothing
+    eventWindow.setText(eventWindow.countDays, clock_text.number(events.remainingDays))
+    eventWindow.setText(eventWindow.countHours, clock_text.number(events.remainingHours))
+    eventWindow.setText(eventWindow.countMinutes, clock_text.number(events.remainingMinutes))
+
+
+def updateClock():
+    global agenda_minute
+
+    eventWindow.setText(eventWindow.statusDateTime, clock_text.datetime(
+        time.localtime(), timeFormat24))
+
+    # The events are only shown once the clock holds a time (set by a time
+    # sync or restored after a reset), and only updated at the transitions
+    # of the timeline (a minute boundary of the countdown, the start or the
+    # expiry of an event) or when another event was selected. The agenda
+    # is written once a minute while it is shown.
+    if clock_set:
+        now = time.time()
+        if agenda_shown:
+            if now // 60 != agenda_minute:
+                agenda_minute = now // 60
+                fillAgenda(now)
+        elif timeline.due(now, events.current()):
+            removePastEvents()
+            showEvent(now)
+
+
+def updateSensors():
+    global backlightVal
+
+    profile.start("light")
+    light_sensor.update()
+    profile.stop("light")
+    profile.start("backlight")
+    backlightVal = adjustBacklight(backlightVal)
+    profile.stop("backlight")
 
 
 def updateTemperature(showFahrenheit):
@@ -237,41 +529,69 @@ def updateTemperature(showFahrenheit):
     sensor with 16-bit 0.0078°C temperature resolution and 0.5°C temperature tolerance. 
     The sensor is I2C connected, use the Arduino or CircuitPython libraries to read it.
     """
-    if (eventWindow is None) or (adt is None):
+    global temperatureShown, temperatureShownInF
+
+    if (eventWindow is None) or (temperature_sensor is None):
         return
 
-    # read the temperature sensor
-    # tempOffset = -10.5  # Added offset due to the heat from backlight
-    # Gave up and set this to zero as the temperature is all over the place.
-    # Never really expected this to work well but it ended being worse that doing nothing.
-    tempOffset = 0
-    temperature = adt.temperature + tempOffset
-    tempText = "{0:5.1f}° C".format(temperature)
-    # print("INFO: Temperature = " + tempText)
+    # The readings are averaged by temperatureSensor; the label only changes
+    # when the tenth of a degree it shows does
+    tenths = temperature_sensor.tenths(showFahrenheit)
+    if tenths is None or (tenths == temperatureShown and showFahrenheit == temperatureShownInF):
+        return
+    temperatureShown = tenths
+    temperatureShownInF = showFahrenheit
 
     if showFahrenheit:
-        temperature = (temperature * 1.8) + 32
-        tempText = "{0:5.1f}° F".format(temperature)
-        # print("INFO: Temperature = " + tempText)
+        tempText = "{0:5.1f}° F".format(tenths / 10)
+    else:
+        tempText = "{0:5.1f}° C".format(tenths / 10)
+    # print("INFO: Temperature = " + tempText)
 
-    eventWindow.statusTemperature.text = tempText
+    eventWindow.setText(eventWindow.statusTemperature, tempText)
 
 
 # Set root locations
 cwd = ("/"+__file__).rsplit('/', 1)[0]
 sdcardPath = "/sd"
 
-# Variables for the Events
-events = []
-# Keep track of the current event being displayed
-event_index = 0
-last_event_index = -1
+# Variables for the Events. The store keeps track of the current event and
+# last_event_index of the one on the display (None to redraw it).
+events = eventStore()
+last_event_index = None
+# Set when the neighbors' backgrounds should be loaded into the cache
+prefetch_pending = False
+# The phase of the event on the display (countdown or event day), and when
+# it next changes
+last_event_phase = None
+timeline = eventTimeline()
+# The agenda, the next occurrences in a text grid, when shown: the
+# occurrence on its first row and the minute it was written at (None to
+# write it again)
+agenda_shown = False
+agenda_first = 0
+agenda_minute = None
 
 # Initialize the pyportal object and let us know what data to fetch and where
 # to display it
 pyportal = PyPortal(status_neopixel=board.NEOPIXEL)
 
-eventWindow = eventDisplay(cwd, sdcardPath)
+# ------------- State of the last run ------------- #
+# The selected event, the settings and the clock of the last time sync,
+# kept across resets in the NVM (or in STATE_FILE on the SD card)
+STATE_FILE = "state.bin"
+state_store = stateStore(stateStorage())
+# True once the clock holds a time, so that the events can be shown
+clock_set = restoreClock()
+# Epoch of the last time sync and the seconds it moved the clock by
+last_sync_epoch = state_store.lastSync
+clock_correction = state_store.correction
+
+# The titles of a remote feed are not known when the fonts are subset, so
+# the full fonts are used with one: here when secrets.py sets it, after
+# loadSdCard() when config.json does
+eventWindow = eventDisplay(cwd, sdcardPath,
+                           subsetFonts=not feedSync.configured(secrets))
 eventWindow.clearAllText()
 
 # Touchscreen setup
@@ -289,140 +609,349 @@ try:
     i2c_bus = busio.I2C(board.SCL, board.SDA)
     adt = adafruit_adt7410.ADT7410(i2c_bus, address=0x48)
     adt.high_resolution = True
+    # tempOffset = -10.5  # Added offset due to the heat from backlight
+    # Gave up and set this to zero as the temperature is all over the place.
+    # Never really expected this to work well but it ended being worse that doing nothing.
+    # A minute of readings is averaged and the last 24 hours are kept.
+    temperature_sensor = temperatureSensor(adt, size=12, decimation=2,
+                                           offset=0, history=24)
+    temperature_sensor.sample()
 except ValueError:
     # Did not find ADT7410. Probably running on Titano or Pynt
     adt = None
+    temperature_sensor = None
 
 # ------------- Light Sensor Setup ------------- #
-light_sensor = AnalogIn(board.LIGHT)
-backlightAuto = True
+# Below about 5 lux for half a minute, the room is taken as dark: the display
+# is no longer refreshed and the clock ticks slower until the light comes
+# back or the screen is touched. Set DARK_ROOM_READING to None to turn it off.
+DARK_ROOM_READING = 160
+DARK_ROOM_DELAY = 30
+light_sensor = lightSensor(AnalogIn(board.LIGHT), darkBelow=DARK_ROOM_READING,
+                           darkAfter=DARK_ROOM_DELAY)
+light_sensor.update()
+backlightShown = None
+backlightShownAuto = None
+backlightAuto = state_store.backlightAuto
 backlightStepSize = 0.1
-backlightVal = adjustBacklight()
+# Step of each repeat while a brightness button is held
+backlightRampStep = 0.02
+backlightVal = adjustBacklight(state_store.backlightVal())
 
 # display the temperature
-temperatureInF = True
+temperatureInF = state_store.temperatureInF
+temperatureShown = None
+temperatureShownInF = None
 updateTemperature(temperatureInF)
 
 # Flag for time display in 24 hour format
-timeFormat24 = True
+timeFormat24 = state_store.timeFormat24
+# Keeps the date and the digits of the clock text between the ticks
+clock_text = clockFormat()
+
+# ------------- Touch Regions ------------- #
+# The raw corners of the screen were determined by touching the corners and
+# reading the reported values using a print statement.
+eventWindow.setTouchCalibration(20, 18, 319, 230)
+# Holding a brightness button ramps it after half a second, ten steps per
+# second. Holding previous or next scrolls the agenda four rows per second.
+eventWindow.addTouchRegion(eventWindow.touchTemperature, onTouchTemperature)
+eventWindow.addTouchRegion(eventWindow.touchTime, onTouchTime)
+eventWindow.addTouchRegion(eventWindow.touchEventPrevious, onTouchEventPrevious, 0.5, 0.25)
+eventWindow.addTouchRegion(eventWindow.touchAgenda, onTouchAgenda)
+eventWindow.addTouchRegion(eventWindow.touchEventNext, onTouchEventNext, 0.5, 0.25)
+eventWindow.addTouchRegion(eventWindow.touchBrightnessMinus, onTouchBrightnessMinus, 0.5, 0.1)
+eventWindow.addTouchRegion(eventWindow.touchBrightnessAuto, onTouchBrightnessAuto)
+eventWindow.addTouchRegion(eventWindow.touchBrightnessPlus, onTouchBrightnessPlus, 0.5, 0.1)
 
 # ------------------ Load Events from SD Card -------------------------
 loadSdCard()
+if feedSync.configured(secrets):
+    eventWindow.useFullFonts()
+restoreEvent()
+
+# ------------------ Main loop -------------------------
+# The loop is a set of cooperative tasks, each with its own interval. A task
+# only runs when it is due, so none of them waits for the others and the
+# processor sleeps in between.
+TOUCH_POLL_INTERVAL = 0.05
+CLOCK_INTERVAL = 1.0
+DARK_CLOCK_TICKS = 10
+SENSOR_INTERVAL = 1.0
+TEMPERATURE_INTERVAL = 5.0
+NETWORK_INTERVAL = 1.0
+NETWORK_STEADY_INTERVAL = 32.0
+TIME_SYNC_INTERVAL = 1.0
+TIME_SYNC_STEP_INTERVAL = 0.1
+FEED_SYNC_INTERVAL = 1.0
+CONFIG_WATCH_INTERVAL = 5.0
+CONSOLE_INTERVAL = 0.5
+STATE_SAVE_INTERVAL = 10.0
+# Occurrences printed by the u console command
+UPCOMING_COUNT = 10
+# Occurrences the agenda scrolls through
+AGENDA_COUNT = 30
+
+# Times each stage of the loop while switched on with "p" on the serial
+# console, and prints p50/p95/max once a minute. Set PROFILE_PATH to, e.g.,
+# sdcardPath + "/profile.txt" to append the summaries to a file instead.
+PROFILE_PATH = None
+profile = profiler(size=64, interval=60, path=PROFILE_PATH)
+
+# The ESP32 co-processor is only reachable through the PyPortal's network
+esp = pyportal.network._wifi.esp
+# Sets the clock in the background, once per hour (and on first run)
+clockSync = timeSync(esp, secrets, 3600)
+# Reads the Wi-Fi link every NETWORK_INTERVAL seconds while it is down or
+# changing, and up to NETWORK_STEADY_INTERVAL apart while it is steady. The
+# time sync hears when the link goes up or down.
+link_monitor = linkMonitor(esp, NETWORK_INTERVAL, NETWORK_STEADY_INTERVAL)
+link_monitor.addListener(clockSync.linkChanged)
+link_monitor.addListener(onLinkChanged)
+# Fetches the remote event feed once per hour when one is set up (events_url
+# or events_feed in secrets.py or the secrets of config.json)
+feed_sync = None
+if feedSync.configured(secrets):
+    feed_sync = feedSync(esp, secrets, sdcardPath, events, 3600)
+    link_monitor.addListener(feed_sync.linkChanged)
+# Applies the changes of config.json on the SD card without a reset
+config_watcher = configWatcher(sdcardPath)
+# Set by the other tasks when they changed what is on the display
+render_requested = asyncio.Event()
+
+
+async def touchTask():
+    while True:
+        # The handler of the region runs on the press and on each repeat
+        # while it is held; a held press is otherwise ignored
+        profile.start("touch")
+        now = time.monotonic()
+        result = eventWindow.touchUpdate(ts.touch_point, now)
+        if result:
+            if result == eventDisplay.TOUCH_PRESS:
+                playTouchSound()
+                # A touch lights a dark room back up
+                if light_sensor.wake(now):
+                    print("INFO: Woken up by a touch")
+                    updateClock()
+            render_requested.set()
+        profile.stop("touch")
+        await asyncio.sleep(TOUCH_POLL_INTERVAL)
+
+
+async def clockTask():
+    # Tick on a fixed schedule so that the time taken by a tick does not
+    # add up over the day
+    nextTick = time.monotonic()
+    ticks = 0
+    while True:
+        # In a dark room nobody reads the clock, so only every few ticks
+        if not light_sensor.dark or ticks % DARK_CLOCK_TICKS == 0:
+            profile.start("clock")
+            updateClock()
+            profile.stop("clock")
+            render_requested.set()
+        ticks += 1
+
+        nextTick += CLOCK_INTERVAL
+        await asyncio.sleep(max(0, nextTick - time.monotonic()))
+
+
+async def sensorTask():
+    while True:
+        wasDark = light_sensor.dark
+        updateSensors()
+        if light_sensor.dark != wasDark:
+            if light_sensor.dark:
+                print("INFO: Dark room, display refreshes paused")
+            else:
+                print("INFO: Light is back, display refreshes resumed")
+                updateClock()
+        render_requested.set()
+        await asyncio.sleep(SENSOR_INTERVAL)
+
+
+async def temperatureTask():
+    # No sensor on the Titano or Pynt
+    if temperature_sensor is None:
+        return
+    while True:
+        profile.start("temperature")
+        if temperature_sensor.sample():
+            updateTemperature(temperatureInF)
+            render_requested.set()
+        profile.stop("temperature")
+        await asyncio.sleep(TEMPERATURE_INTERVAL)
+
+
+async def networkTask():
+    while True:
+        profile.start("network")
+        if link_monitor.poll() and eventWindow.spritesWifi:
+            # Only when the number of bars changed
+            eventWindow.setIcon(eventWindow.spritesWifi, eventWindow.ICON_WIFI, link_monitor.bars)
+            render_requested.set()
+        profile.stop("network")
+        await asyncio.sleep(link_monitor.wait())
+
+
+async def timeSyncTask():
+    global clock_set, last_sync_epoch, clock_correction
+
+    while True:
+        lastState = clockSync.state
+        profile.start("timeSync")
+        synced = clockSync.poll()
+        profile.stop("timeSync")
+        if synced:
+            print("INFO: Success the time has been set.")
+            clock_set = True
+            last_sync_epoch = int(time.time())
+            clock_correction = clockSync.correction
+            # The clock may have jumped past or back over a transition
+            timeline.invalidate()
+            updateClock()
+            render_requested.set()
+
+        # Until the clock holds a time, show how the sync is going. After
+        # that the last good time stays on the screen while syncing.
+        if not clock_set and clockSync.state != lastState:
+            if clockSync.state == CONNECTING:
+                eventWindow.changeBackground(
+                    eventWindow.IMG_FILE_CONNECTING_BACKGROUND, False)
+                render_requested.set()
+            elif clockSync.state == BACKING_OFF:
+                eventWindow.changeBackground(
+                    eventWindow.IMG_FILE_CONNECT_FAILED_BACKGROUND, False)
+                render_requested.set()
 
-# ------------------ Get the time -------------------------
-# Declare the variable to let us know when the time was last acquired
-refresh_time = None
-refresh_time = getTime(refresh_time, 3600)
-
-timeLastSeconds = time.time()
-
-while True:
-    # Check for touch events
-    touch = ts.touch_point
-
-    if touch:
-        touchAdj = adjustTouch(touch)
-        touchHandled = False
-
-        if eventDisplay.pointInside(eventWindow.touchTemperature, touchAdj):
-            temperatureInF = not temperatureInF
-            touchHandled = True
-        elif eventDisplay.pointInside(eventWindow.touchTime, touchAdj):
-            timeFormat24 = not timeFormat24
-            touchHandled = True
-        elif eventDisplay.pointInside(eventWindow.touchEventPrevious, touchAdj):
-            event_index = event_index - 1
-            if event_index < 0:
-                event_index = len(events) - 1
-            touchHandled = True
-        elif eventDisplay.pointInside(eventWindow.touchEventNext, touchAdj):
-            event_index = event_index + 1
-            if event_index > len(events) - 1:
-                event_index = 0
-            touchHandled = True
-        elif eventDisplay.pointInside(eventWindow.touchBrightnessMinus, touchAdj):
-            backlightAuto = False
-            backlightVal = backlightVal - backlightStepSize
-            touchHandled = True
-        elif eventDisplay.pointInside(eventWindow.touchBrightnessAuto, touchAdj):
-            backlightAuto = True
-            touchHandled = True
-        elif eventDisplay.pointInside(eventWindow.touchBrightnessPlus, touchAdj):
-            backlightAuto = False
-            backlightVal = backlightVal + backlightStepSize
-            touchHandled = True
-
-        if touchHandled:
-            playTouchSound()
-            # print(f"{touch} Adj -> {touchAdj}")
-            time.sleep(0.5)
-
-    # Update the display once per second
-    timeCurrentSeconds = time.time()
-    if (timeCurrentSeconds - timeLastSeconds) < 1.0:
-        continue
-
-    timeLastSeconds = timeCurrentSeconds
-
-    eventWindow.display.auto_refresh = False
-    eventWindow.statusDateTime.text = eventDisplay.format_datetime(
-        time.localtime(), timeFormat24)
-    networkQuality()
-    updateTemperature(temperatureInF)
-    backlightVal = adjustBacklight(backlightVal)
-    eventWindow.display.auto_refresh = True
+        # Step quickly while a sync is in flight, else only check if one is due
+        if clockSync.state == IDLE:
+            await asyncio.sleep(TIME_SYNC_INTERVAL)
+        else:
+            await asyncio.sleep(TIME_SYNC_STEP_INTERVAL)
 
-    # only query the online time once per hour (and on first run)
-    refresh_time = getTime(refresh_time, 3600)
 
-    if (refresh_time is None):
-        time.sleep(3)
-        continue
+async def feedTask():
+    global last_event_index, agenda_minute
 
-    eventWindow.display.auto_refresh = False
-    # Show the events with countdown
-    if event_index != last_event_index:
-        if len(events) == 0:
-            eventWindow.changeBackground(
-                eventWindow.IMG_FILE_NO_EVENTS_BACKGROUND, False)
-            last_event_index = event_index
+    if feed_sync is None:
+        return
+    while True:
+        # A fetch starts once the clock is set and not while it is being
+        # set, so the two do not connect at the same time
+        if feed_sync.state != IDLE or (clockSync.lastSync is not None and clockSync.state == IDLE):
+            profile.start("feed")
+            changed = feed_sync.poll()
+            profile.stop("feed")
+            if changed:
+                # The event on the display may have changed or be gone
+                last_event_index = None
+                agenda_minute = None
+                timeline.invalidate()
+                updateClock()
+                render_requested.set()
+
+        if feed_sync.state == IDLE:
+            await asyncio.sleep(FEED_SYNC_INTERVAL)
         else:
-            # Remove the text
-            eventWindow.clearAllText()
-            eventWindow.statusEventCount.text = f"{event_index + 1} of {len(events)}"
-            eventWindow.changeBackground(events[event_index].imageCountDown)
-            eventWindow.title.color = events[event_index].forecolor
-            eventWindow.title.text = events[event_index].title
-            eventWindow.subtitle.color = events[event_index].forecolor
-            eventWindow.subtitle.text = events[event_index].subtitle
-            events[event_index].remainingUpdate()
-
-            if events[event_index].remainingTime > 0:
-                eventWindow.countlabelDays.text = "Days"
-                eventWindow.countlabelHours.text = "Hours"
-                eventWindow.countlabelMinutes.text = "Mins."
-
-            last_event_index = event_index
-
-    if len(events) == 0:
-        eventWindow.display.auto_refresh = True
-        continue
-
-    # Update the remaining time
-    events[event_index].remainingUpdate()
-    if events[event_index].remainingTime <= 0:
-        eventWindow.countlabelDays.text = ""
-        eventWindow.countlabelHours.text = ""
-        eventWindow.countlabelMinutes.text = ""
-        eventWindow.countDays.text = ""
-        eventWindow.countHours.text = ""
-        eventWindow.countMinutes.text = ""
-        eventWindow.eventDayText.text = "It's Today!!!"
-
-        eventWindow.display.auto_refresh = True
-        continue
-
-    eventWindow.countDays.text = f"{events[event_index].remainingDays}"
-    eventWindow.countHours.text = f"{events[event_index].remainingHours}"
-    eventWindow.countMinutes.text = f"{events[event_index].remainingMinutes}"
-    eventWindow.display.auto_refresh = True
+            await asyncio.sleep(TIME_SYNC_STEP_INTERVAL)
+
+
+async def configTask():
+    global last_event_index, agenda_minute
+
+    while True:
+        # One os.stat() every CONFIG_WATCH_INTERVAL seconds
+        if config_watcher.hasChanged():
+            start = time.monotonic()
+            try:
+                changed = config_watcher.apply(secrets, events, expiredBefore())
+            except OSError as e:
+                print(f"ERROR: Could not read config.json.\r\n{e}")
+            except (ValueError, KeyError) as e:
+                # Likely still being written, tried again on the next check
+                print(f"ERROR: Could not parse config.json.\r\n{e}")
+            else:
+                print(f"INFO: Reloaded config.json: {config_watcher.added} added, "
+                      f"{config_watcher.changed} changed, {config_watcher.removed} removed "
+                      f"in {time.monotonic() - start:.2f} seconds")
+                if changed:
+                    last_event_index = None
+                    agenda_minute = None
+                    timeline.invalidate()
+                    updateClock()
+                    render_requested.set()
+        await asyncio.sleep(CONFIG_WATCH_INTERVAL)
+
+
+async def renderTask():
+    global prefetch_pending
+
+    while True:
+        await render_requested.wait()
+        render_requested.clear()
+
+        # Nothing is drawn in a dark room; what changed meanwhile is drawn
+        # as soon as it is lit again
+        if light_sensor.dark:
+            continue
+
+        # Redraw only what changed, once for all the tasks that were due
+        profile.start("render")
+        eventWindow.refresh()
+        profile.stop("render")
+
+        # Load the neighbors' backgrounds after the frame is on the screen
+        if prefetch_pending:
+            prefetch_pending = False
+            prefetchNeighbors()
+
+
+async def stateTask():
+    while True:
+        # Checked once per interval; stateStore writes a change only once
+        # the user stopped stepping through the events or the backlight
+        await asyncio.sleep(STATE_SAVE_INTERVAL)
+        saveState()
+
+
+async def consoleTask():
+    # Single key commands typed on the serial console:
+    #   p  switches the profiler on or off
+    #   r  prints the profile now
+    #   u  prints the next occurrences of the events
+    #   a  shows or hides the agenda
+    while True:
+        while supervisor.runtime.serial_bytes_available:
+            command = sys.stdin.read(1)
+            if command == "p":
+                profile.enable(not profile.enabled)
+            elif command == "r":
+                profile.report()
+            elif command == "u":
+                printUpcoming()
+            elif command == "a":
+                showAgenda(not agenda_shown)
+                render_requested.set()
+        profile.poll()
+        await asyncio.sleep(CONSOLE_INTERVAL)
+
+
+async def main():
+    await asyncio.gather(
+        asyncio.create_task(touchTask()),
+        asyncio.create_task(clockTask()),
+        asyncio.create_task(sensorTask()),
+        asyncio.create_task(temperatureTask()),
+        asyncio.create_task(networkTask()),
+        asyncio.create_task(timeSyncTask()),
+        asyncio.create_task(feedTask()),
+        asyncio.create_task(configTask()),
+        asyncio.create_task(renderTask()),
+        asyncio.create_task(stateTask()),
+        asyncio.create_task(consoleTask()),
+    )
+
+
+asyncio.run(main())
@@ -0,0 +1,257 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Reads config.json from the SD card a fixed size chunk at a time and yields
+one record at a time (the secrets, then each event), so the raw text of the
+whole file and the parsed tree never have to be in memory at once.
+"""
+
+import gc
+import json
+import time
+
+# Byte values, as indexing bytes returns an int
+WHITESPACE = (32, 9, 13, 10)
+QUOTE = 34        # "
+BACKSLASH = 92    # \
+NUMBER_CHARS = tuple(b"+-0123456789.eE")
+LITERAL_CHARS = tuple(b"tfn")
+# Entries of the "secrets" object copied into the secrets dictionary. The
+# events_url (a JSON URL) or events_feed (an Adafruit IO feed key) of the
+# remote event feed may be set here as well as in secrets.py.
+SECRET_NAMES = ("ssid", "password", "timezone", "aio_username", "aio_key",
+                "events_url", "events_feed")
+
+
+# **************** CLASS ******************
+class configReader:
+    def __init__(self, fp, chunkSize=256):
+        self.fp = fp
+        self.chunkSize = chunkSize
+        self.buffer = b""
+        self.pos = 0
+        self.bytesRead = 0
+
+    # **************** INTERNAL METHODS ******************
+    def _error(self, message):
+        offset = self.bytesRead - len(self.buffer) + self.pos
+        return ValueError(f"config.json: {message} at byte {offset}")
+
+    def _fill(self):
+        # Keep the unread part of the buffer and append the next chunk
+        chunk = self.fp.read(self.chunkSize)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        self.bytesRead += len(chunk)
+        return True
+
+    def _peek(self):
+        # Returns the next byte that is not white space, or -1 at the end
+        while True:
+            buffer = self.buffer
+            while self.pos < len(buffer):
+                c = buffer[self.pos]
+                if c not in WHITESPACE:
+                    return c
+                self.pos += 1
+            if not self._fill():
+                return -1
+
+    def _expect(self, ch):
+        if self._peek() != ord(ch):
+            raise self._error(f"expected '{ch}'")
+        self.pos += 1
+
+    def _string(self):
+        self._expect('"')
+        offset = 0
+        while True:
+            end = self.buffer.find(b'"', self.pos + offset)
+            if end < 0:
+                offset = len(self.buffer) - self.pos
+                if not self._fill():
+                    raise self._error("unterminated string")
+                continue
+            # A quote preceded by an odd number of backslashes is escaped
+            k = end - 1
+            while k >= self.pos and self.buffer[k] == BACKSLASH:
+                k -= 1
+            if (end - 1 - k) % 2 == 0:
+                break
+            offset = end - self.pos + 1
+
+        raw = self.buffer[self.pos:end]
+        self.pos = end + 1
+        if raw.find(b"\\") >= 0:
+            return json.loads('"' + raw.decode("utf-8") + '"')
+        return raw.decode("utf-8")
+
+    def _number(self):
+        # The number may continue in the next chunk, so only move past it
+        # once its end is in the buffer
+        length = 0
+        while True:
+            end = self.pos + length
+            while end < len(self.buffer) and self.buffer[end] in NUMBER_CHARS:
+                end += 1
+            length = end - self.pos
+            if end < len(self.buffer) or not self._fill():
+                break
+        text = self.buffer[self.pos:self.pos + length].decode("utf-8")
+        self.pos += length
+        if not text:
+            raise self._error("unexpected character")
+        if "." in text or "e" in text or "E" in text:
+            return float(text)
+        return int(text)
+
+    def _literal(self):
+        for word, value in ((b"true", True), (b"false", False), (b"null", None)):
+            while len(self.buffer) - self.pos < len(word):
+                if not self._fill():
+                    break
+            if self.buffer[self.pos:self.pos + len(word)] == word:
+                self.pos += len(word)
+                return value
+        raise self._error("unexpected character")
+
+    def _object(self):
+        self._expect("{")
+        result = {}
+        if self._peek() == ord("}"):
+            self.pos += 1
+            return result
+        while True:
+            key = self._string()
+            self._expect(":")
+            result[key] = self._value()
+            c = self._peek()
+            self.pos += 1
+            if c == ord("}"):
+                return result
+            if c != ord(","):
+                raise self._error("expected ',' or '}'")
+
+    def _array(self):
+        self._expect("[")
+        result = []
+        if self._peek() == ord("]"):
+            self.pos += 1
+            return result
+        while True:
+            result.append(self._value())
+            c = self._peek()
+            self.pos += 1
+            if c == ord("]"):
+                return result
+            if c != ord(","):
+                raise self._error("expected ',' or ']'")
+
+    def _value(self):
+        c = self._peek()
+        if c == QUOTE:
+            return self._string()
+        if c == ord("{"):
+            return self._object()
+        if c == ord("["):
+            return self._array()
+        if c in LITERAL_CHARS:
+            return self._literal()
+        if c < 0:
+            raise self._error("unexpected end of file")
+        return self._number()
+
+    # **************** PUBLIC METHODS ******************
+    def records(self):
+        """
+        Yields (key, value) for each top level entry of the file, except
+        that each element of the "events" array is yielded on its own as
+        ("event", record) instead of the whole array.
+        """
+        self._expect("{")
+        if self._peek() == ord("}"):
+            return
+        while True:
+            key = self._string()
+            self._expect(":")
+            if key == "events" and self._peek() == ord("["):
+                self.pos += 1
+                if self._peek() == ord("]"):
+                    self.pos += 1
+                else:
+                    while True:
+                        yield ("event", self._object())
+                        c = self._peek()
+                        self.pos += 1
+                        if c == ord("]"):
+                            break
+                        if c != ord(","):
+                            raise self._error("expected ',' or ']'")
+            else:
+                yield (key, self._value())
+            c = self._peek()
+            self.pos += 1
+            if c == ord("}"):
+                return
+            if c != ord(","):
+                raise self._error("expected ',' or '}'")
+
+
+# **************** FUNCTIONS ******************
+def toInt(value):
+    """int() of a config value, accepting the "0xF0C810" form of the colors."""
+    if isinstance(value, str) and value[:2] in ("0x", "0X"):
+        return int(value[2:], 16)
+    return int(value)
+
+
+def eventEpoch(record):
+    """Seconds since the epoch of an event record, without building the event."""
+    return int(time.mktime((toInt(record["year"]), toInt(record["month"]), toInt(record["day"]),
+                            toInt(record["hour"]), toInt(record["minute"]), 0, -1, -1, -1)))
+
+
+def loadConfig(path, secrets, onEvent, skipBefore=None, chunkSize=256, reportEvery=50):
+    """
+    Streams the config file at path. The secrets found in it are copied into
+    the secrets dictionary and onEvent(record) is called for each event that
+    does not start before skipBefore (seconds since the epoch, or None to keep
+    all) or repeats. Prints the parse time and peak heap use every reportEvery events.
+    Returns (eventsLoaded, eventsSkipped).
+    """
+    loaded = 0
+    skipped = 0
+    gc.collect()
+    freeAtStart = gc.mem_free()
+    peakUsed = 0
+    start = time.monotonic_ns()
+
+    with open(path, "rb") as fp:
+        for key, value in configReader(fp, chunkSize).records():
+            if key == "secrets":
+                for name in SECRET_NAMES:
+                    if name in value:
+                        secrets[name] = value[name]
+            elif key == "event":
+                if (skipBefore is not None and not value.get("repeat")
+                        and eventEpoch(value) < skipBefore):
+                    skipped += 1
+                else:
+                    onEvent(value)
+                    loaded += 1
+
+                used = freeAtStart - gc.mem_free()
+                if used > peakUsed:
+                    peakUsed = used
+                count = loaded + skipped
+                if reportEvery and count % reportEvery == 0:
+                    elapsed = (time.monotonic_ns() - start) // 1000000
+                    print(f"INFO: config.json: {count} events parsed in {elapsed} ms, peak heap use {peakUsed} bytes")
+
+    elapsed = (time.monotonic_ns() - start) // 1000000
+    print(f"INFO: config.json: {loaded} events loaded, {skipped} skipped in {elapsed} ms, peak heap use {peakUsed} bytes")
+    return (loaded, skipped)
@@ -0,0 +1,122 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Applies the changes of config.json to the events without a reset.
+
+hasChanged() compares the size and time stamp of config.json with the ones
+they had when the events were loaded, one os.stat() call, so it can be
+called every few seconds. apply() then streams the new file and looks up
+each event in the eventStore by its epoch and title:
+
+- an event with the same fields is kept as it is (its text may stay in the
+  strings file of the index),
+- a new or changed event is added with its text in RAM,
+- the events of config.json that are no longer in it, and the old rows of
+  the changed ones, are removed.
+
+The events of the remote feed and of the calendars are left alone, the
+selected event stays selected and the display keeps its fonts and cached
+backgrounds. The index is rebuilt on the next boot, as config.json no
+longer matches it.
+"""
+
+from configLoader import SECRET_NAMES, configReader, eventEpoch
+from eventIndex import CONFIG_FILE, jsonSignature
+from eventStore import SOURCE_CONFIG
+
+
+# **************** CLASS ******************
+class configWatcher:
+    def __init__(self, folder):
+        self.folder = folder
+        self.signature = self._signature()
+        # Events of the last change applied
+        self.added = 0
+        self.changed = 0
+        self.removed = 0
+        self.reloads = 0
+
+    # **************** INTERNAL METHODS ******************
+    def _signature(self):
+        try:
+            return jsonSignature(self.folder)
+        except OSError:
+            # No card or no config.json
+            return None
+
+    # **************** PUBLIC METHODS ******************
+    def hasChanged(self):
+        """True if config.json is not the one the events were loaded from."""
+        signature = self._signature()
+        return signature is not None and signature != self.signature
+
+    def apply(self, secrets, events, skipBefore=None):
+        """
+        Applies config.json to the events, skipping the events that do not
+        start before skipBefore and do not repeat, as when loading. The
+        secrets found in it are copied into the secrets dictionary. Returns
+        True if the events changed. Raises OSError or ValueError (e.g. while
+        the file is being written) with the events as they were, in which
+        case hasChanged() stays True and apply() can be called again.
+        """
+        signature = self._signature()
+        count = len(events)
+        # Events of the store found unchanged in config.json
+        seen = bytearray(count)
+        added = 0
+        changed = 0
+        newRecords = []
+
+        with open(self.folder + "/" + CONFIG_FILE, "rb") as fp:
+            for key, value in configReader(fp).records():
+                if key == "secrets":
+                    for name in SECRET_NAMES:
+                        if name in value:
+                            secrets[name] = value[name]
+                elif key == "event":
+                    epoch = eventEpoch(value)
+                    if (skipBefore is not None and not value.get("repeat")
+                            and epoch < skipBefore):
+                        continue
+                    i = events.find(epoch, value["title"], SOURCE_CONFIG, seen)
+                    if i >= 0 and events.matches(i, value):
+                        seen[i] = 1
+                        continue
+                    if i >= 0:
+                        changed += 1
+                    else:
+                        added += 1
+                    newRecords.append(value)
+
+        removed = 0
+        for i in range(count):
+            if not seen[i] and events.source(i) == SOURCE_CONFIG:
+                removed += 1
+        self.signature = signature
+        self.reloads += 1
+        self.added = added
+        self.changed = changed
+        self.removed = removed - changed
+        if not newRecords and not removed:
+            return False
+
+        # The selected event stays selected, in its new version if it changed,
+        # and only counts as chosen by the user if it was before
+        selected = events.current()
+        chosen = events.chosen
+        selectedKey = None
+        if selected >= 0:
+            selectedKey = (events.epoch(selected), events.title(selected))
+        for i in range(count - 1, -1, -1):
+            if not seen[i] and events.source(i) == SOURCE_CONFIG:
+                events.remove(i)
+        for record in newRecords:
+            events.addRecord(record)
+        events.compact()
+        events.sort()
+        if selectedKey is not None:
+            events.select(events.find(selectedKey[0], selectedKey[1]))
+            events.chosen = chosen
+        return True
@@ -7,26 +7,78 @@ Sets up the display layout and provides methods for
 updating various items on the display.
 """
 
+import binascii
+import gc
+import os
+import struct
 import board
 import displayio
 import adafruit_imageload
 from adafruit_bitmap_font import bitmap_font
 from adafruit_display_shapes.rect import Rect
 from adafruit_display_text.label import Label
+from textGrid import textGrid
+from calendarLoader import calendarFiles
+from feedSync import FEED_FILE
 
 
 # **************** CLASS ******************
 class eventDisplay:
     # **************** CONSTANTS ******************
     IMG_FILE_DEFAULT_BACKGROUND = "background.bmp"
-    IMG_FILE_DIM_ICON = "bright_decrease.bmp"
-    IMG_FILE_BRIGHT_ICON = "bright_increase.bmp"
     IMG_FILE_CONNECT_FAILED_BACKGROUND = "connect_failed.bmp"
     IMG_FILE_CONNECTING_BACKGROUND = "connecting.bmp"
     IMG_FILE_NO_EVENTS_BACKGROUND = "no_events.bmp"
     IMG_FILE_NOT_FOUND = "not_found.bmp"
     IMG_FILE_TITLE_BACKGROUND = "title.bmp"
-    IMG_FILE_WIFI_SPRITES = "wifi.bmp"
+    # The icons packed into one sprite atlas by Host/buildIconAtlas.py, and
+    # its manifest: the tile size, then "name firstTile tiles" per icon
+    IMG_FILE_ICONS = "icons.bmp"
+    IMG_FILE_ICONS_MANIFEST = "icons.txt"
+    ICON_DIM = "bright_decrease"
+    ICON_BRIGHT = "bright_increase"
+    ICON_WIFI = "wifi"
+    # The agenda: a textGrid between the header and the footer over the
+    # status font drawn into fixed cells by Host/buildGridFont.py
+    FONT_GRID = "Helvetica-Bold-16-grid.bmp"
+    FONT_GRID_MANIFEST = "Helvetica-Bold-16-grid.txt"
+    AGENDA_COLUMNS = 32
+    AGENDA_ROWS = 10
+    AGENDA_TOP = 20
+    AGENDA_COLOR = 0xF0C810
+    # Cells of the remaining time at the end of a row, e.g. " 12d 04h"
+    AGENDA_TIME_WIDTH = 8
+    FONT_STATUS = "Helvetica-Bold-16.bdf"
+    FONT_LARGE = "MicrosoftSansSerif-36.bdf"
+    FONT_MEDIUM = "MicrosoftSansSerif-20.bdf"
+    # Glyphs preloaded from the full fonts when there is no subset
+    GLYPHS_DEFAULT = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ-!,. "\'?!'
+    # Characters of the interface texts in each font. Host/subsetFonts.py adds
+    # the characters of the event titles (large) and subtitles (medium).
+    GLYPHS_STATUS = "0123456789 /:.-%°CF AMPMonTueWedThuFriSatSun of No Time Info Events Auto"
+    GLYPHS_LARGE = "0123456789 It's Today!"
+    GLYPHS_MEDIUM = "Days Hours Mins."
+    # Written next to the subset fonts: "source name crc" for each file of the
+    # SD card whose texts they hold, then one line per font with its glyphs
+    FONT_GLYPHS_FILE = "glyphs.txt"
+    FONT_GLYPHS_SOURCE = "source "
+    # Free memory to leave after decoding a background into RAM. The bytes
+    # of decoded backgrounds kept in RAM are what is free at start up less
+    # this: one 320x240 8 bit image (76,800) on a PyPortal, so the
+    # neighbours are only prefetched beside the one on screen when the
+    # backgrounds are 4 bit ones (38,400), as Host/compileAssets.py writes
+    BACKGROUND_CACHE_RESERVE = 24000
+    # Touch regions are found through a grid of cells of this many pixels
+    TOUCH_CELL_SIZE = 20
+    # Grid value of a cell that more than one region covers
+    TOUCH_CELL_SHARED = 255
+    # A press ends once no point has been read for this long (the resistive
+    # panel misses readings while it is pressed)
+    TOUCH_RELEASE_TIME = 0.15
+    # Results of touchUpdate()
+    TOUCH_NONE = 0
+    TOUCH_PRESS = 1
+    TOUCH_REPEAT = 2
     DOW = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
     MONTHNAME = ["Jan", "Feb", "Mar", "Apr", "May",
                  "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
@@ -60,38 +112,90 @@ class eventDisplay:
             )
 
     def pointInside(rect, pt):
-        if (pt[0] > rect.x and pt[0] < (rect.x + rect.width) and pt[1] > rect.y and pt[1] < (rect.y + rect.height)):
+        # rect is (x, y, width, height)
+        if (pt[0] > rect[0] and pt[0] < (rect[0] + rect[2]) and pt[1] > rect[1] and pt[1] < (rect[1] + rect[3])):
             # print(f"Point {pt} is in rectangle [({self.topLeftPoint.x}, {self.topLeftPoint.y}), ({self.bottomRightPoint.x}, {self.bottomRightPoint.y})]")
             return True
         else:
             return False
 
+    def textSources(folder):
+        """Names of the files of the SD card folder whose event texts are
+        shown: config.json, the last version of the feed and the calendars."""
+        names = ["config.json"]
+        try:
+            os.stat(folder + "/" + FEED_FILE)
+            names.append(FEED_FILE)
+        except OSError:
+            pass
+        return names + calendarFiles(folder)
+
+    def fileCrc(path):
+        """CRC-32 of the content of a file, read a block at a time."""
+        crc = 0
+        buffer = bytearray(512)
+        view = memoryview(buffer)
+        with open(path, "rb") as fp:
+            while True:
+                count = fp.readinto(buffer)
+                if not count:
+                    break
+                crc = binascii.crc32(view[:count], crc)
+        return crc
+
     # **************** CLASS INITIALIZATION ******************
-    def __init__(self, imgFolder="", eventImagesFolder=""):
+    def __init__(self, imgFolder="", eventImagesFolder="", backgroundCacheBytes=None,
+                 subsetFonts=True):
         self.display = board.DISPLAY
 
         # **************** FONTS ******************
-        self.fontStatus = bitmap_font.load_font(
-            imgFolder + "/fonts/Helvetica-Bold-16.bdf")
-        self.fontLarge = bitmap_font.load_font(
-            imgFolder + "/fonts/MicrosoftSansSerif-36.bdf")
-        self.fontMedium = bitmap_font.load_font(
-            imgFolder + "/fonts/MicrosoftSansSerif-20.bdf")
-
-        # pre-load glyphs for fast printing
-        self.fontStatus.load_glyphs(
-            b'0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ-!,. "\'?!')
-        # pre-load glyphs for fast printing
-        self.fontLarge.load_glyphs(
-            b'0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ-!,. "\'?!')
-        # pre-load glyphs for fast printing
-        self.fontMedium.load_glyphs(
-            b'0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ-!,. "\'?!')
-
+        # The fonts subset to the texts of the SD card (by Host/subsetFonts.py)
+        # are used when they are there and made for its files as they are now,
+        # else the full fonts. A label shown a character its subset font does
+        # not have switches to the full font (loaded then).
         self.imageFolderPath = imgFolder
+        self._subsetFonts = {}
+        self._fullFonts = {}
+        subset = self._fontSubset(eventImagesFolder) if subsetFonts else None
+        self.fontStatus = self._loadFont(eventImagesFolder, self.FONT_STATUS, subset)
+        self.fontLarge = self._loadFont(eventImagesFolder, self.FONT_LARGE, subset)
+        self.fontMedium = self._loadFont(eventImagesFolder, self.FONT_MEDIUM, subset)
+
         self.eventImageFolderPath = eventImagesFolder
 
         self.spritesWifi = None
+        # Sprite atlas of the icons, each a range of its tiles
+        self.icons = {}
+        self.iconSheet = None
+        self.iconPalette = None
+        self.iconWidth = 0
+        self.iconHeight = 0
+
+        # The text grid of the agenda, made the first time it is shown
+        self.agenda = None
+
+        # LRU cache of decoded backgrounds, least recently used first.
+        # Each entry is [fullFileName, bitmap, palette, bytes].
+        self.backgroundCache = []
+        if backgroundCacheBytes is None:
+            gc.collect()
+            backgroundCacheBytes = max(0, gc.mem_free() - self.BACKGROUND_CACHE_RESERVE)
+        self.backgroundCacheBytes = backgroundCacheBytes
+        self.backgroundCacheUsed = 0
+        self.backgroundCacheHits = 0
+        self.backgroundCacheMisses = 0
+        # Neighbors not prefetched because they did not fit beside the
+        # background on screen
+        self.backgroundPrefetchSkipped = 0
+        self._backgroundShown = None
+
+        # Counters of what was redrawn, for the whole run and the last refresh
+        self.labelsRedrawn = 0
+        self.pixelsRedrawn = 0
+        self.lastRefreshLabels = 0
+        self.lastRefreshPixels = 0
+        self._dirtyLabels = 0
+        self._dirtyPixels = 0
 
         self.gpWindow = displayio.Group()       # Group to hold all groups
         self.gpBackground = displayio.Group()   # Group for the background image
@@ -102,10 +206,16 @@ class eventDisplay:
         self.gpButtonDim = displayio.Group()    # Group for the backlight dim icon
         # Group for the backlight increase icon
         self.gpButtonBright = displayio.Group()
+        # Group for the agenda, over the event while it is shown
+        self.gpAgenda = displayio.Group()
+        self.gpAgenda.hidden = True
 
         # Load the inital background
         self.changeBackground(self.IMG_FILE_TITLE_BACKGROUND, False)
 
+        # Load the icons
+        self._loadIcons()
+
         # Load the Header
         self._loadHeader()
 
@@ -211,37 +321,250 @@ class eventDisplay:
         self.gpWindow.append(self.countHours)
         self.gpWindow.append(self.countMinutes)
         self.gpWindow.append(self.eventDayText)
-        # Add the Group to the Display
+        self.gpWindow.append(self.gpAgenda)
+        # Add the Group to the Display. The display is only refreshed when
+        # refresh() is called and something changed since the last refresh.
+        self.display.auto_refresh = False
         self.display.show(self.gpWindow)
+        self.refresh(True)
 
         # ------------- TOUCH AREAS ------------- #
-        self.touchTemperature = Rect(0, 0, 40, 40)
-        self.touchTime = Rect(60, 0, 200, 40)
-        self.touchEventPrevious = Rect(0, 60, 150, 120)
-        self.touchEventNext = Rect(170, 60, 150, 120)
-        self.touchBrightnessMinus = Rect(0, 200, 40, 40)
-        self.touchBrightnessAuto = Rect(80, 200, 160, 40)
-        self.touchBrightnessPlus = Rect(280, 200, 40, 40)
+        # (x, y, width, height). Plain tuples, as a Rect shape would
+        # allocate a bitmap of its size.
+        self.touchTemperature = (0, 0, 40, 40)
+        self.touchTime = (60, 0, 200, 40)
+        self.touchEventPrevious = (0, 60, 120, 120)
+        self.touchAgenda = (120, 60, 80, 120)
+        self.touchEventNext = (200, 60, 120, 120)
+        self.touchBrightnessMinus = (0, 200, 40, 40)
+        self.touchBrightnessAuto = (80, 200, 160, 40)
+        self.touchBrightnessPlus = (280, 200, 40, 40)
+
+        # Registered regions, each (rect, handler, repeatDelay, repeatInterval),
+        # and the grid holding the index + 1 of the region over each cell
+        self.touchRegions = []
+        self._touchCols = (self.display.width + self.TOUCH_CELL_SIZE - 1) // self.TOUCH_CELL_SIZE
+        self._touchRows = (self.display.height + self.TOUCH_CELL_SIZE - 1) // self.TOUCH_CELL_SIZE
+        self._touchGrid = bytearray(self._touchCols * self._touchRows)
+        self._touchActive = False
+        self._touchPressed = -1
+        self._touchLastSeen = 0
+        self._touchNextRepeat = None
+        self.setTouchCalibration(0, 0, self.display.width, self.display.height)
 
     # **************** INTERNAL METHODS ******************
+    def _labelArea(self, label):
+        bb = label.bounding_box
+        return (label.x + bb[0], label.y + bb[1], bb[2], bb[3])
+
+    def _markDirty(self, pixels, labels=0):
+        self._dirtyPixels += pixels
+        self._dirtyLabels += labels
+
+    def _bitmapBytes(self, fullFileName):
+        """
+        Reads the BMP header and returns the bytes a displayio.Bitmap of the
+        image needs, or None if the file cannot be decoded into RAM (only
+        palette based images are loaded by adafruit_imageload).
+        """
+        with open(fullFileName, "rb") as fp:
+            header = fp.read(30)
+        if len(header) < 30 or header[0:2] != b"BM":
+            return None
+        width, height, planes, bpp = struct.unpack_from("<iiHH", header, 18)
+        if bpp > 8:
+            return None
+        # displayio packs 1, 2, 4 or 8 bits per pixel into 32 bit words
+        return ((width * bpp + 31) // 32) * 4 * abs(height) + 4 * (1 << bpp)
+
+    def _cacheFind(self, fullFileName):
+        for entry in self.backgroundCache:
+            if entry[0] == fullFileName:
+                # Move to the most recently used end
+                self.backgroundCache.remove(entry)
+                self.backgroundCache.append(entry)
+                return entry
+        return None
+
+    def _cacheEvict(self, keep=()):
+        """Drops the least recently used entry that is neither on screen nor
+        in keep. Returns False if there was nothing to drop."""
+        for i, entry in enumerate(self.backgroundCache):
+            if entry[0] in keep or entry[0] == self._backgroundShown:
+                continue
+            self.backgroundCache.pop(i)
+            self.backgroundCacheUsed -= entry[3]
+            return True
+        return False
+
+    def _cacheFits(self, size, keep=()):
+        """True if the image fits both the budget and the free memory once
+        the entries that are neither on screen nor in keep are dropped."""
+        evictable = 0
+        for entry in self.backgroundCache:
+            if entry[0] not in keep and entry[0] != self._backgroundShown:
+                evictable += entry[3]
+        if self.backgroundCacheUsed - evictable + size > self.backgroundCacheBytes:
+            return False
+        return gc.mem_free() + evictable >= size + self.BACKGROUND_CACHE_RESERVE
+
+    def _cacheLoad(self, fullFileName, keep=()):
+        """
+        Decodes a background into RAM and adds it to the cache. Returns the
+        cache entry, or None when the image does not fit the budget or the
+        free memory, in which case the caller uses an OnDiskBitmap. Nothing
+        is evicted for an image that would not fit anyway.
+        """
+        try:
+            size = self._bitmapBytes(fullFileName)
+        except OSError:
+            return None
+        if size is None or size > self.backgroundCacheBytes:
+            return None
+        gc.collect()
+        if not self._cacheFits(size, keep):
+            return None
+
+        # Evict the least recently used entries that are not needed until
+        # the image fits both the budget and the free memory
+        while self.backgroundCacheUsed + size > self.backgroundCacheBytes:
+            if not self._cacheEvict(keep):
+                return None
+        gc.collect()
+        while gc.mem_free() < size + self.BACKGROUND_CACHE_RESERVE:
+            if not self._cacheEvict(keep):
+                return None
+            gc.collect()
+
+        try:
+            bitmap, palette = adafruit_imageload.load(
+                fullFileName, bitmap=displayio.Bitmap, palette=displayio.Palette)
+        except (MemoryError, NotImplementedError, ValueError, OSError) as e:
+            print(f"WARN: Could not cache the image {fullFileName}\r\n{e}")
+            return None
+
+        entry = [fullFileName, bitmap, palette, size]
+        self.backgroundCache.append(entry)
+        self.backgroundCacheUsed += size
+        return entry
+
+    def _fullFileName(self, filename, useEventImageLocation=True, filenameContainsPath=False):
+        if filenameContainsPath:
+            return filename
+        if useEventImageLocation:
+            return self.eventImageFolderPath + "/" + filename
+        return self.imageFolderPath + "/" + filename
+
+    def _loadIcons(self):
+        """Reads the icon atlas into RAM, once. The icons are tiles of it, so
+        they are not read from the flash again when they are redrawn."""
+        with open(self.imageFolderPath + "/" + self.IMG_FILE_ICONS_MANIFEST, "r") as fp:
+            size = fp.readline().split()
+            self.iconWidth = int(size[0])
+            self.iconHeight = int(size[1])
+            for line in fp:
+                name, first, count = line.split()
+                self.icons[name] = (int(first), int(count))
+        (self.iconSheet, self.iconPalette) = adafruit_imageload.load(
+            self.imageFolderPath + "/" + self.IMG_FILE_ICONS,
+            bitmap=displayio.Bitmap, palette=displayio.Palette)
+
+    def _iconSprite(self, name, frame=0):
+        # A one tile TileGrid of the atlas showing the icon
+        return displayio.TileGrid(self.iconSheet, pixel_shader=self.iconPalette,
+                                  width=1,
+                                  height=1,
+                                  tile_width=self.iconWidth,
+                                  tile_height=self.iconHeight,
+                                  default_tile=self.iconTile(name, frame))
+
+    def _loadAgenda(self):
+        """Reads the grid font and makes the text grid of the agenda."""
+        fonts = self.imageFolderPath + "/fonts/"
+        self.agenda = textGrid(fonts + self.FONT_GRID, fonts + self.FONT_GRID_MANIFEST,
+                               self.AGENDA_COLUMNS, self.AGENDA_ROWS, 0, self.AGENDA_TOP)
+        self.agenda.setColor(self.AGENDA_COLOR)
+        self.gpAgenda.append(self.agenda.grid)
+
+    def _markCells(self, cells):
+        # Cells of the agenda that show another character
+        if cells:
+            self._markDirty(cells * self.agenda.cellWidth * self.agenda.cellHeight)
+        return cells
+
     def _loadWifiSprites(self):
         # ------------- GROUP - gpWifi ------------- #
-        # Create a TileGrid to hold the bitmap
-        # Load the sprite sheet (bitmap)
-        (sprite_sheet, palette) = adafruit_imageload.load(self.imageFolderPath + "/" + self.IMG_FILE_WIFI_SPRITES,
-                                                          bitmap=displayio.Bitmap, palette=displayio.Palette)
-        # Create a sprite (tilegrid)
-        self.spritesWifi = displayio.TileGrid(sprite_sheet, pixel_shader=palette,
-                                              width=1,
-                                              height=1,
-                                              tile_width=20,
-                                              tile_height=20)
+        # One tile per signal level
+        self.spritesWifi = self._iconSprite(self.ICON_WIFI)
         # Set sprite location
         self.gpWifi.x = 300
         self.gpWifi.y = 0
 
         return self.spritesWifi
 
+    def _fontSubset(self, folder):
+        """Glyphs of each subset font on the SD card, or None if there are
+        none or the files they were made from changed since."""
+        sources = {}
+        subset = {}
+        try:
+            with open(folder + "/fonts/" + self.FONT_GLYPHS_FILE, "r") as fp:
+                for line in fp:
+                    line = line.rstrip("\r\n")
+                    if line.startswith(self.FONT_GLYPHS_SOURCE):
+                        name, crc = line[len(self.FONT_GLYPHS_SOURCE):].rsplit(" ", 1)
+                        sources[name] = int(crc, 16)
+                    else:
+                        name, _, glyphs = line.partition(" ")
+                        subset[name] = glyphs
+            names = eventDisplay.textSources(folder)
+            if len(names) != len(sources):
+                changed = True
+            else:
+                changed = False
+                for name in names:
+                    if sources.get(name) != eventDisplay.fileCrc(folder + "/" + name):
+                        changed = True
+                        break
+        except (OSError, ValueError):
+            return None
+        if changed:
+            print("WARN: The subset fonts were made for other texts than those "
+                  "of the SD card, run Host/subsetFonts.py again")
+            return None
+        return subset
+
+    def _fullFont(self, name):
+        font = self._fullFonts.get(name)
+        if font is None:
+            font = bitmap_font.load_font(self.imageFolderPath + "/fonts/" + name)
+            # pre-load glyphs for fast printing
+            font.load_glyphs(self.GLYPHS_DEFAULT)
+            self._fullFonts[name] = font
+        return font
+
+    def _loadFont(self, eventImagesFolder, name, subset):
+        if subset is None or name not in subset:
+            return self._fullFont(name)
+        font = bitmap_font.load_font(eventImagesFolder + "/fonts/" + name)
+        # pre-load glyphs for fast printing
+        font.load_glyphs(subset[name])
+        self._subsetFonts[font] = (name, subset[name])
+        return font
+
+    def _fitFont(self, label, text):
+        """Moves a label from its subset font to the full font when the
+        text has a character the subset does not."""
+        subset = self._subsetFonts.get(label.font)
+        if subset is None:
+            return
+        for character in text:
+            if character not in subset[1]:
+                print(f"INFO: {subset[0]} has no {character!r} in its subset, "
+                      "using the full font")
+                label.font = self._fullFont(subset[0])
+                return
+
     def _loadHeader(self):
         # ------------- GROUP - gpHeader ------------- #
         rectHead = Rect(0, 0, 320, 20, fill=0xffffff)
@@ -281,14 +604,12 @@ class eventDisplay:
         self.gpFooter.append(rectFoot)
 
         # ------------- GROUP - gpbacklightMinus ------------- #
-        self._set_image(self.gpButtonDim, self.imageFolderPath +
-                        "/" + self.IMG_FILE_DIM_ICON)
+        self.gpButtonDim.append(self._iconSprite(self.ICON_DIM))
         self.gpButtonDim.x = 0
         self.gpButtonDim.y = 220
 
         # ------------- GROUP - gpbacklightPlus ------------- #
-        self._set_image(self.gpButtonBright,
-                        self.imageFolderPath + "/" + self.IMG_FILE_BRIGHT_ICON)
+        self.gpButtonBright.append(self._iconSprite(self.ICON_BRIGHT))
         self.gpButtonBright.x = 300
         self.gpButtonBright.y = 220
 
@@ -351,32 +672,309 @@ class eventDisplay:
     # This function allows us to change the background image
     def changeBackground(self, filename, useEventImageLocation=True, filenameContainsPath=False):
         # ------------- GROUP - gpBackground ------------- #
-        fullFileName = self.imageFolderPath + "/" + filename
-
-        if useEventImageLocation:
-            fullFileName = self.eventImageFolderPath + "/" + filename
-        if filenameContainsPath:
-            fullFileName = filename
+        fullFileName = self._fullFileName(
+            filename, useEventImageLocation, filenameContainsPath)
 
         try:
-            self._set_image(self.gpBackground, fullFileName)
+            # Event backgrounds are decoded into RAM when they fit, so that
+            # redrawing over them does not read the SD card again
+            entry = None
+            if useEventImageLocation:
+                entry = self._cacheFind(fullFileName)
+                if entry:
+                    self.backgroundCacheHits += 1
+                else:
+                    self.backgroundCacheMisses += 1
+                    # Release the image on screen first so its memory can
+                    # be reused when it is not cached
+                    if self.gpBackground:
+                        self.gpBackground.pop()
+                    self._backgroundShown = None
+                    entry = self._cacheLoad(fullFileName)
+
+            if entry:
+                if self.gpBackground:
+                    self.gpBackground.pop()
+                self.gpBackground.append(displayio.TileGrid(
+                    entry[1], pixel_shader=entry[2]))
+            else:
+                self._set_image(self.gpBackground, fullFileName)
+            self._backgroundShown = fullFileName
         except Exception as e:
             print(f"ERROR: Failed to load the image {fullFileName}\r\n{e}")
+            self._backgroundShown = None
             self._set_image(self.gpBackground,
                             self.imageFolderPath + "/" + self.IMG_FILE_NOT_FOUND)
 
         self.gpBackground.x = 0
         self.gpBackground.y = 0
+        self._markDirty(self.display.width * self.display.height)
 
         return
 
+    def prefetchBackgrounds(self, filenames, useEventImageLocation=True):
+        """
+        Decodes the given backgrounds into the cache ahead of time, typically
+        the next and previous events' images, in order of priority: an image
+        may evict the cached ones after it in the list, never the background
+        on screen or the images before it, and an image that does not fit
+        beside those is skipped (it is read from the SD card when shown).
+        Returns the number loaded.
+        """
+        keep = [self._fullFileName(f, useEventImageLocation) for f in filenames]
+        loaded = 0
+        for i, fullFileName in enumerate(keep):
+            if self._cacheFind(fullFileName):
+                continue
+            if self._cacheLoad(fullFileName, keep[:i + 1]) is None:
+                self.backgroundPrefetchSkipped += 1
+                continue
+            loaded += 1
+        return loaded
+
     def clearAllText(self):
-        self.title.text = ""
-        self.subtitle.text = ""
-        self.countDays.text = ""
-        self.countlabelDays.text = ""
-        self.countHours.text = ""
-        self.countlabelHours.text = ""
-        self.countMinutes.text = ""
-        self.countlabelMinutes.text = ""
-        self.eventDayText.text = ""
+        self.setText(self.title, "")
+        self.setText(self.subtitle, "")
+        self.setText(self.countDays, "")
+        self.setText(self.countlabelDays, "")
+        self.setText(self.countHours, "")
+        self.setText(self.countlabelHours, "")
+        self.setText(self.countMinutes, "")
+        self.setText(self.countlabelMinutes, "")
+        self.setText(self.eventDayText, "")
+
+    def setText(self, label, text):
+        """Sets the text of a label only if it differs from what is shown.
+        Returns True if the label was changed.
+        """
+        if label.text == text:
+            return False
+
+        before = self._labelArea(label)
+        # Only the title and subtitle show texts of the events, which may
+        # have changed since the fonts were subset
+        if label is self.title or label is self.subtitle:
+            self._fitFont(label, text)
+        label.text = text
+        after = self._labelArea(label)
+
+        # The dirty area is the union of the old and new text boxes
+        if before[2] == 0 or before[3] == 0:
+            before = after
+        elif after[2] == 0 or after[3] == 0:
+            after = before
+        x0 = min(before[0], after[0])
+        y0 = min(before[1], after[1])
+        x1 = max(before[0] + before[2], after[0] + after[2])
+        y1 = max(before[1] + before[3], after[1] + after[3])
+        self._markDirty((x1 - x0) * (y1 - y0), 1)
+        return True
+
+    def setColor(self, label, color):
+        """Sets the color of a label only if it differs from the current one."""
+        if label.color == color:
+            return False
+
+        label.color = color
+        area = self._labelArea(label)
+        self._markDirty(area[2] * area[3], 1)
+        return True
+
+    def setTile(self, tileGrid, tile, index=0):
+        """Sets a sprite tile only if it differs from the one shown."""
+        if tileGrid[index] == tile:
+            return False
+
+        tileGrid[index] = tile
+        self._markDirty(tileGrid.tile_width * tileGrid.tile_height)
+        return True
+
+    def iconTile(self, name, frame=0):
+        """Index in the icon atlas of a frame of an icon (e.g. a signal
+        level of the wifi icon)."""
+        first, count = self.icons[name]
+        if not 0 <= frame < count:
+            raise IndexError(f"{name} has no frame {frame}")
+        return first + frame
+
+    def setIcon(self, tileGrid, name, frame=0):
+        """Shows a frame of an icon on a sprite of the atlas, only if it
+        differs from the one shown."""
+        return self.setTile(tileGrid, self.iconTile(name, frame))
+
+    def useFullFonts(self):
+        """Moves the title and subtitle from their subset fonts to the full
+        fonts, e.g. once the settings read from the SD card turn out to set
+        a remote feed, whose titles are not known ahead."""
+        for label in (self.title, self.subtitle):
+            subset = self._subsetFonts.get(label.font)
+            if subset is not None:
+                label.font = self._fullFont(subset[0])
+
+    def showAgenda(self, show):
+        """
+        Shows the agenda over the event, or hides it. Its font is read the
+        first time. Returns False if it could not be.
+        """
+        if show and self.agenda is None:
+            try:
+                self._loadAgenda()
+            except (OSError, ValueError, MemoryError) as e:
+                print(f"ERROR: Could not load the agenda font\r\n{e}")
+                return False
+        if self.gpAgenda.hidden != show:
+            return True
+
+        self.gpAgenda.hidden = not show
+        self._markDirty(self.display.width * self.AGENDA_ROWS * self.agenda.cellHeight)
+        return True
+
+    def agendaText(self, column, row, text, width=None):
+        """Writes text into the agenda (see textGrid.write). Returns the
+        number of cells changed."""
+        return self._markCells(self.agenda.write(column, row, text, width))
+
+    def agendaNumber(self, column, row, value, width, fill=" "):
+        """Writes a number into the agenda without allocating (see
+        textGrid.writeNumber). Returns the number of cells changed."""
+        return self._markCells(self.agenda.writeNumber(column, row, value, width, fill))
+
+    def agendaScroll(self, lines):
+        """Moves the rows of the agenda up by lines (down if negative).
+        Returns the number of cells changed."""
+        return self._markCells(self.agenda.scroll(lines))
+
+    def updateLabels(self, values):
+        """Batched update from a sequence of (label, text) pairs. Only the
+        labels whose text changed are touched. Returns the number changed.
+        """
+        changed = 0
+        for label, text in values:
+            if self.setText(label, text):
+                changed += 1
+        return changed
+
+    def refresh(self, force=False):
+        """Redraws the display once if anything changed since the last call.
+        Returns True if the display was refreshed.
+        """
+        self.lastRefreshLabels = self._dirtyLabels
+        self.lastRefreshPixels = self._dirtyPixels
+        if not (force or self._dirtyLabels or self._dirtyPixels):
+            return False
+
+        self.labelsRedrawn += self._dirtyLabels
+        self.pixelsRedrawn += self._dirtyPixels
+        self._dirtyLabels = 0
+        self._dirtyPixels = 0
+        self.display.refresh(target_frames_per_second=None)
+        return True
+
+    # **************** TOUCH ******************
+    def setTouchCalibration(self, minX, minY, maxX, maxY):
+        """Maps the range of points the touchscreen reports onto the screen.
+        The coefficients are computed once here rather than per reading.
+        """
+        self._touchMinX = minX
+        self._touchMinY = minY
+        self._touchScaleX = self.display.width / (maxX - minX)
+        self._touchScaleY = self.display.height / (maxY - minY)
+
+    def calibrateTouch(self, point):
+        x = (point[0] - self._touchMinX) * self._touchScaleX
+        y = (point[1] - self._touchMinY) * self._touchScaleY
+
+        if x < 0:
+            x = 0
+        elif x > self.display.width:
+            x = self.display.width
+        if y < 0:
+            y = 0
+        elif y > self.display.height:
+            y = self.display.height
+
+        return (x, y, point[2])
+
+    def addTouchRegion(self, rect, handler, repeatDelay=0, repeatInterval=0):
+        """
+        Calls handler(repeat) when rect (x, y, width, height) is pressed. With
+        a repeatInterval, holding the press calls handler(True) every
+        repeatInterval seconds once repeatDelay seconds have passed.
+        Returns the index of the region.
+        """
+        index = len(self.touchRegions)
+        self.touchRegions.append((rect, handler, repeatDelay, repeatInterval))
+
+        size = self.TOUCH_CELL_SIZE
+        col0 = max(0, rect[0] // size)
+        col1 = min(self._touchCols - 1, (rect[0] + rect[2]) // size)
+        row0 = max(0, rect[1] // size)
+        row1 = min(self._touchRows - 1, (rect[1] + rect[3]) // size)
+        for row in range(row0, row1 + 1):
+            for col in range(col0, col1 + 1):
+                cell = row * self._touchCols + col
+                if self._touchGrid[cell] == 0:
+                    self._touchGrid[cell] = index + 1
+                else:
+                    self._touchGrid[cell] = self.TOUCH_CELL_SHARED
+        return index
+
+    def touchRegionAt(self, point):
+        """Index of the region under the point (screen coordinates), or -1."""
+        col = int(point[0]) // self.TOUCH_CELL_SIZE
+        row = int(point[1]) // self.TOUCH_CELL_SIZE
+        if col >= self._touchCols or row >= self._touchRows:
+            return -1
+
+        cell = self._touchGrid[row * self._touchCols + col]
+        if cell == 0:
+            return -1
+        if cell != self.TOUCH_CELL_SHARED:
+            if eventDisplay.pointInside(self.touchRegions[cell - 1][0], point):
+                return cell - 1
+            return -1
+        for index, region in enumerate(self.touchRegions):
+            if eventDisplay.pointInside(region[0], point):
+                return index
+        return -1
+
+    def touchUpdate(self, rawPoint, now):
+        """
+        Takes one reading of the touchscreen (None when not pressed) made at
+        now (time.monotonic()). The handler of the region runs on the first
+        reading of a press and then at its repeat rate while it is held. A
+        press ends once no point has been read for TOUCH_RELEASE_TIME, which
+        debounces the panel without sleeping.
+        Returns TOUCH_PRESS, TOUCH_REPEAT or TOUCH_NONE.
+        """
+        if rawPoint is None:
+            if self._touchActive and (now - self._touchLastSeen) >= self.TOUCH_RELEASE_TIME:
+                self._touchActive = False
+                self._touchPressed = -1
+            return self.TOUCH_NONE
+
+        self._touchLastSeen = now
+        if not self._touchActive:
+            self._touchActive = True
+            self._touchPressed = self.touchRegionAt(self.calibrateTouch(rawPoint))
+            self._touchNextRepeat = None
+            if self._touchPressed < 0:
+                return self.TOUCH_NONE
+            rect, handler, repeatDelay, repeatInterval = self.touchRegions[self._touchPressed]
+            if repeatInterval:
+                self._touchNextRepeat = now + repeatDelay
+            handler(False)
+            return self.TOUCH_PRESS
+
+        # Held: repeat while the point stays on the region pressed
+        if self._touchNextRepeat is None or now < self._touchNextRepeat:
+            return self.TOUCH_NONE
+        if self.touchRegionAt(self.calibrateTouch(rawPoint)) != self._touchPressed:
+            return self.TOUCH_NONE
+        rect, handler, repeatDelay, repeatInterval = self.touchRegions[self._touchPressed]
+        self._touchNextRepeat += repeatInterval
+        if self._touchNextRepeat < now:
+            # Do not catch up with a burst after a stall
+            self._touchNextRepeat = now + repeatInterval
+        handler(True)
+        return self.TOUCH_REPEAT
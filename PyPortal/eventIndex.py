@@ -0,0 +1,185 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Compiled binary index of the events in config.json.
+
+events.idx holds a header (with the size and modification time of the
+config.json it was built from), references to the secrets and one fixed
+width record per event (epoch, color, flags, recurrence rule and references
+into the strings file): the repeating events first, then the others sorted
+by epoch. events.str holds the text of the titles,
+subtitles, image names and secrets, each distinct string stored once.
+
+Loading the index reads only the fixed width records into an eventStore.
+The strings are read from the SD card when an event is actually displayed.
+"""
+
+import os
+import struct
+from configLoader import SECRET_NAMES, configReader, eventEpoch, toInt
+from eventRecurrence import recordRule
+from eventStore import FLAG_EVENT_DAY_IMAGE
+
+INDEX_FILE = "events.idx"
+STRINGS_FILE = "events.str"
+CONFIG_FILE = "config.json"
+MAGIC = b"PEVI"
+VERSION = 3
+
+# magic, version, record size, event count, repeating event count,
+# config.json size, config.json mtime
+HEADER_FORMAT = "<4sHHIIII"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+# Offsets then lengths of the secrets in the strings file
+SECRET_COUNT = len(SECRET_NAMES)
+SECRETS_FORMAT = "<{0}I{0}H".format(SECRET_COUNT)
+SECRETS_SIZE = struct.calcsize(SECRETS_FORMAT)
+# epoch, color, flags, recurrence rule, end of the rule, offsets then
+# lengths of title, subtitle, imageCountDown and imageEventDay
+RECORD_FORMAT = "<iIHHi4I4H"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+RECORDS_OFFSET = HEADER_SIZE + SECRETS_SIZE
+
+
+# **************** CLASS ******************
+class stringBlob:
+    """Reads strings from the strings file on demand."""
+
+    def __init__(self, path):
+        self.path = path
+        self.reads = 0
+
+    def read(self, offset, length):
+        if length == 0:
+            return ""
+        self.reads += 1
+        with open(self.path, "rb") as fp:
+            fp.seek(offset)
+            return fp.read(length).decode("utf-8")
+
+
+# **************** FUNCTIONS ******************
+def jsonSignature(folder):
+    """(size, mtime) of config.json, the mtime rounded to the 2 second
+    resolution of FAT file systems."""
+    st = os.stat(folder + "/" + CONFIG_FILE)
+    return (st[6], int(st[8]) & ~1)
+
+
+def isCurrent(folder, signature):
+    """True if the index exists and was built from config.json as it is now."""
+    try:
+        with open(folder + "/" + INDEX_FILE, "rb") as fp:
+            header = fp.read(HEADER_SIZE)
+    except OSError:
+        return False
+    if len(header) < HEADER_SIZE:
+        return False
+    magic, version, recordSize, count, repeating, size, mtime = struct.unpack(HEADER_FORMAT, header)
+    return (magic == MAGIC and version == VERSION and recordSize == RECORD_SIZE
+            and size == signature[0] and mtime == signature[1])
+
+
+def build(folder, signature=None, chunkSize=256):
+    """
+    Builds the index and strings files from config.json in folder. The
+    config is streamed, so only the fixed width records are kept in memory.
+    Returns the number of events indexed.
+    """
+    if signature is None:
+        signature = jsonSignature(folder)
+
+    records = []
+    offsets = {}
+    secretRefs = [0] * (2 * SECRET_COUNT)
+    end = 0
+
+    with open(folder + "/" + STRINGS_FILE, "wb") as blob:
+        def ref(text):
+            nonlocal end
+            text = text or ""
+            if text not in offsets:
+                data = text.encode("utf-8")
+                blob.write(data)
+                offsets[text] = (end, len(data))
+                end += len(data)
+            return offsets[text]
+
+        with open(folder + "/" + CONFIG_FILE, "rb") as fp:
+            for key, value in configReader(fp, chunkSize).records():
+                if key == "secrets":
+                    for i, name in enumerate(SECRET_NAMES):
+                        if name in value:
+                            secretRefs[i], secretRefs[i + SECRET_COUNT] = ref(value[name])
+                elif key == "event":
+                    refs = [ref(value.get(name)) for name in
+                            ("title", "subtitle", "imageCountDown", "imageEventDay")]
+                    flags = FLAG_EVENT_DAY_IMAGE if value.get("imageEventDay") else 0
+                    rule, until = recordRule(value)
+                    records.append((eventEpoch(value),
+                                    toInt(value.get("forecolor", 0xF0C810)),
+                                    flags, rule, until,
+                                    tuple(r[0] for r in refs) + tuple(r[1] for r in refs)))
+        offsets = None
+
+    # The repeating events first, as they are loaded whatever their epoch
+    records.sort(key=lambda r: (r[3] == 0, r[0]))
+    repeating = 0
+    while repeating < len(records) and records[repeating][3]:
+        repeating += 1
+    with open(folder + "/" + INDEX_FILE, "wb") as fp:
+        fp.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, RECORD_SIZE,
+                             len(records), repeating, signature[0], signature[1]))
+        fp.write(struct.pack(SECRETS_FORMAT, *secretRefs))
+        for epoch, color, flags, rule, until, refs in records:
+            fp.write(struct.pack(RECORD_FORMAT, epoch, color, flags, rule, until, *refs))
+
+    return len(records)
+
+
+def load(folder, secrets, store, skipBefore=None):
+    """
+    Reads the index in folder. The secrets are copied into the secrets
+    dictionary and each event that does not start before skipBefore is added
+    to the eventStore, in time order after the repeating events, which are
+    all added. Returns the number loaded.
+    """
+    blob = stringBlob(folder + "/" + STRINGS_FILE)
+    store.blob = blob
+    loaded = 0
+    with open(folder + "/" + INDEX_FILE, "rb") as fp:
+        magic, version, recordSize, count, repeating, size, mtime = struct.unpack(
+            HEADER_FORMAT, fp.read(HEADER_SIZE))
+        secretRefs = struct.unpack(SECRETS_FORMAT, fp.read(SECRETS_SIZE))
+        for i, name in enumerate(SECRET_NAMES):
+            if secretRefs[i + SECRET_COUNT]:
+                secrets[name] = blob.read(secretRefs[i], secretRefs[i + SECRET_COUNT])
+
+        for i in range(repeating):
+            r = struct.unpack(RECORD_FORMAT, fp.read(RECORD_SIZE))
+            store.addIndexed(r[0], r[1], r[2], r[5:], r[3], r[4])
+            loaded += 1
+
+        # The other records are sorted, so seek to the first one that is not past
+        first = repeating
+        if skipBefore is not None:
+            lo = repeating
+            hi = count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                fp.seek(RECORDS_OFFSET + mid * RECORD_SIZE)
+                if struct.unpack("<i", fp.read(4))[0] < skipBefore:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            first = lo
+
+        fp.seek(RECORDS_OFFSET + first * RECORD_SIZE)
+        for i in range(first, count):
+            r = struct.unpack(RECORD_FORMAT, fp.read(RECORD_SIZE))
+            store.addIndexed(r[0], r[1], r[2], r[5:], r[3], r[4])
+            loaded += 1
+
+    return loaded
@@ -0,0 +1,161 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Recurrence rules of the events, expanded one occurrence at a time.
+
+An event of config.json repeats when it has a "repeat" entry:
+
+    "repeat": "yearly", "interval": "1", "until": "2030-12-31"
+
+repeat is daily, weekly, monthly or yearly, interval the number of days,
+weeks, months or years from one occurrence to the next (1 if left out) and
+until the last day it may occur on (no end if left out). "Every 10 days" is
+daily with an interval of 10. The date and time of the event are those of
+its first occurrence.
+
+The eventStore keeps a repeating event as one row at its next occurrence,
+with the rule packed into 16 bits and the end as an epoch. nextOccurrence()
+works out the first occurrence from a given time, so an event with
+thousands of occurrences costs no more memory than one that happens once.
+As in iCalendar, a monthly or yearly event on a day that some months do not
+have (the 31st, February 29th) skips those months.
+"""
+
+import time
+from configLoader import toInt
+
+# Frequencies, in the low FREQUENCY_BITS of a rule; the interval is above
+NONE = 0
+DAILY = 1
+WEEKLY = 2
+MONTHLY = 3
+YEARLY = 4
+FREQUENCIES = ("", "daily", "weekly", "monthly", "yearly")
+FREQUENCY_BITS = 3
+FREQUENCY_MASK = (1 << FREQUENCY_BITS) - 1
+MAX_INTERVAL = 0xFFFF >> FREQUENCY_BITS
+
+SECONDS_PER_DAY = 24 * 60 * 60
+DAYS_IN_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+# A monthly or yearly rule that finds no date in this many steps has ended
+MAX_STEPS = 400
+
+
+# **************** FUNCTIONS ******************
+def makeRule(frequency, interval=1):
+    if not DAILY <= frequency <= YEARLY:
+        raise ValueError(f"unknown frequency {frequency}")
+    if not 1 <= interval <= MAX_INTERVAL:
+        raise ValueError(f"interval {interval} is out of range")
+    return frequency | (interval << FREQUENCY_BITS)
+
+
+def frequencyOf(rule):
+    return rule & FREQUENCY_MASK
+
+
+def intervalOf(rule):
+    return rule >> FREQUENCY_BITS
+
+
+def daysInMonth(year, month):
+    if month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
+        return 29
+    return DAYS_IN_MONTH[month - 1]
+
+
+def untilEpoch(year, month, day):
+    """Epoch of the last second of a day, the end of a rule."""
+    return int(time.mktime((year, month, day, 23, 59, 59, -1, -1, -1)))
+
+
+def parseDate(text):
+    """(year, month, day) of a "2030-12-31" date."""
+    parts = text.split("-")
+    if len(parts) != 3:
+        raise ValueError(f"date {text} is not year-month-day")
+    return (int(parts[0]), int(parts[1]), int(parts[2]))
+
+
+def recordRule(record):
+    """
+    (rule, until) of an event record of config.json, (0, 0) if it does not
+    repeat. until is 0 when the rule has no end.
+    """
+    repeat = record.get("repeat")
+    if not repeat:
+        return (0, 0)
+    repeat = repeat.lower()
+    if repeat not in FREQUENCIES:
+        raise ValueError(f"unknown repeat {repeat}")
+    rule = makeRule(FREQUENCIES.index(repeat), toInt(record.get("interval") or 1))
+    until = 0
+    if record.get("until"):
+        until = untilEpoch(*parseDate(record["until"]))
+    return (rule, until)
+
+
+def nextOccurrence(epoch, rule, until, notBefore):
+    """
+    The first occurrence that is not before notBefore of the event that
+    occurs at epoch and repeats by rule, or None if the rule ended first.
+    """
+    frequency = rule & FREQUENCY_MASK
+    interval = rule >> FREQUENCY_BITS
+    if epoch >= notBefore or frequency == NONE:
+        occurrence = epoch
+    elif frequency == DAILY or frequency == WEEKLY:
+        # The device clock has no daylight saving time, so a day is always
+        # the same number of seconds
+        step = interval * SECONDS_PER_DAY
+        if frequency == WEEKLY:
+            step *= 7
+        occurrence = epoch + (notBefore - epoch + step - 1) // step * step
+    else:
+        months = interval
+        if frequency == YEARLY:
+            months *= 12
+        d = time.localtime(epoch)
+        after = time.localtime(notBefore)
+        # Start from the last occurrence before notBefore's month at the
+        # latest, then step over the months without the day
+        elapsed = (after.tm_year - d.tm_year) * 12 + after.tm_mon - d.tm_mon
+        k = max(0, elapsed // months)
+        occurrence = None
+        for _ in range(MAX_STEPS):
+            total = d.tm_mon - 1 + k * months
+            year = d.tm_year + total // 12
+            month = total % 12 + 1
+            k += 1
+            if until and int(time.mktime((year, month, 1, 0, 0, 0, -1, -1, -1))) > until:
+                return None
+            if d.tm_mday > daysInMonth(year, month):
+                continue
+            t = int(time.mktime((year, month, d.tm_mday, d.tm_hour, d.tm_min, 0, -1, -1, -1)))
+            if t >= notBefore:
+                occurrence = t
+                break
+        if occurrence is None:
+            return None
+    if until and occurrence > until:
+        return None
+    return occurrence
+
+
+def describeRule(rule, until=0):
+    """e.g. "every 2 weeks until 12/31/2030"."""
+    frequency = rule & FREQUENCY_MASK
+    if frequency == NONE:
+        return "once"
+    interval = rule >> FREQUENCY_BITS
+    if interval == 1:
+        text = FREQUENCIES[frequency]
+    else:
+        unit = ("", "days", "weeks", "months", "years")[frequency]
+        text = f"every {interval} {unit}"
+    if until:
+        d = time.localtime(until)
+        text += f" until {d.tm_mon}/{d.tm_mday}/{d.tm_year}"
+    return text
@@ -0,0 +1,479 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Compact storage for the list of events.
+
+The numbers of each event (epoch, color, flags and the references to its
+four strings) are kept in array columns instead of one object per event.
+The strings are either kept in the events.str file of the compiled index or
+packed, each distinct string once, into one bytearray in RAM. A str object
+is only built when a string is asked for.
+
+A repeating event (eventRecurrence) is one row at its next occurrence, with
+its rule and end in two more columns. When the occurrence expires the row
+moves on to the next one instead of being removed, and upcoming() yields the
+occurrences of all the events in time order, working out only the next one
+of each repeating event.
+
+A single store holds the position of the event being shown and the
+remaining time of that event, which is updated in place.
+"""
+
+from array import array
+import time
+from configLoader import eventEpoch, toInt
+from eventRecurrence import describeRule, nextOccurrence, recordRule
+
+# Strings of the event are in the stringPool (else in the strings file)
+FLAG_IN_RAM = 0x8000
+FLAG_EVENT_DAY_IMAGE = 0x0001
+# Where the event comes from, in the flags
+SOURCE_CONFIG = 0x0000
+SOURCE_FEED = 0x0002
+SOURCE_CALENDAR = 0x0004
+SOURCE_MASK = 0x0006
+
+SECONDS_PER_DAY = 24 * 60 * 60
+# Next occurrence of a repeating event that has ended, in upcoming()
+NEVER = 0x7FFFFFFF
+
+
+# **************** CLASSES ******************
+class stringPool:
+    """
+    Strings packed into one bytearray, read back as (offset, length). While
+    interning, a string that was added before is stored only once.
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self._interned = {}
+
+    def add(self, text):
+        text = text or ""
+        if self._interned is not None and text in self._interned:
+            return self._interned[text]
+        data = text.encode("utf-8")
+        ref = (len(self.data), len(data))
+        self.data.extend(data)
+        if self._interned is not None:
+            self._interned[text] = ref
+        return ref
+
+    def read(self, offset, length):
+        if length == 0:
+            return ""
+        return str(self.data[offset:offset + length], "utf-8")
+
+    def stopInterning(self):
+        self._interned = None
+
+
+class eventStore:
+    """
+    Events sorted by epoch, stored in columns.
+
+    Event i has epochs[i], colors[i], flags[i], the offsets of its title,
+    subtitle, imageCountDown and imageEventDay in offsets[4 * i:4 * i + 4]
+    and their lengths in lengths[4 * i:4 * i + 4]. rules[i] is its
+    recurrence rule (0 if it happens once) and untils[i] the end of the
+    rule (0 if none); both are None until an event that repeats is added,
+    so that a store without one does not pay for them.
+    """
+
+    __slots__ = ("epochs", "colors", "flags", "offsets", "lengths",
+                 "rules", "untils",
+                 "blob", "pool", "index", "chosen",
+                 "remainingTime", "remainingDays", "remainingHours",
+                 "remainingMinutes", "remainingSeconds")
+
+    def __init__(self, blob=None):
+        # blob reads the strings of the compiled index (eventIndex.stringBlob)
+        self.blob = blob
+        self.clear()
+
+    def __len__(self):
+        return len(self.epochs)
+
+    # **************** INTERNAL METHODS ******************
+    def _append(self, epoch, forecolor, flags, refs, rule, until):
+        if rule and self.rules is None:
+            self.rules = array("H", (0 for i in range(len(self.epochs))))
+            self.untils = array("l", (0 for i in range(len(self.epochs))))
+        self.epochs.append(epoch)
+        self.colors.append(forecolor)
+        self.flags.append(flags)
+        if self.rules is not None:
+            self.rules.append(rule)
+            self.untils.append(until)
+        for i in range(4):
+            self.offsets.append(refs[i])
+        for i in range(4, 8):
+            self.lengths.append(refs[i])
+
+    def _string(self, i, field):
+        k = 4 * i + field
+        if self.flags[i] & FLAG_IN_RAM:
+            return self.pool.read(self.offsets[k], self.lengths[k])
+        return self.blob.read(self.offsets[k], self.lengths[k])
+
+    def _candidate(self, i, source, skip):
+        # For find(): event i is from source and not skipped
+        if source is not None and (self.flags[i] & SOURCE_MASK) != source:
+            return False
+        return skip is None or i >= len(skip) or not skip[i]
+
+    def _compactPool(self):
+        # Drop the text of the events that were removed
+        pool = stringPool()
+        for i in range(len(self.epochs)):
+            if self.flags[i] & FLAG_IN_RAM:
+                for field in range(4):
+                    k = 4 * i + field
+                    self.offsets[k], self.lengths[k] = pool.add(
+                        self.pool.read(self.offsets[k], self.lengths[k]))
+        pool.stopInterning()
+        self.pool = pool
+
+    def _reorder(self, order):
+        # Keeps the events in order, a list of their indexes
+        self.epochs = array("l", (self.epochs[i] for i in order))
+        self.colors = array("L", (self.colors[i] for i in order))
+        self.flags = array("H", (self.flags[i] for i in order))
+        if self.rules is not None:
+            self.rules = array("H", (self.rules[i] for i in order))
+            self.untils = array("l", (self.untils[i] for i in order))
+        self.offsets = array("L", (self.offsets[4 * i + k] for i in order for k in range(4)))
+        self.lengths = array("H", (self.lengths[4 * i + k] for i in order for k in range(4)))
+
+    # **************** LOADING ******************
+    def clear(self):
+        self.epochs = array("l")
+        self.colors = array("L")
+        self.flags = array("H")
+        self.offsets = array("L")
+        self.lengths = array("H")
+        self.rules = None
+        self.untils = None
+        self.pool = stringPool()
+        self.index = 0
+        # False while the selection is the first event by default
+        self.chosen = False
+        self.remainingTime = 365 * SECONDS_PER_DAY
+        self.remainingDays = 365
+        self.remainingHours = 0
+        self.remainingMinutes = 0
+        self.remainingSeconds = 0
+
+    def add(self, epoch, forecolor, title, subtitle, imageCountDown, imageEventDay,
+            rule=0, until=0, source=SOURCE_CONFIG):
+        """Adds an event with its strings kept in RAM. Call sort() after adding."""
+        refs = []
+        for text in (title, subtitle, imageCountDown, imageEventDay):
+            refs.extend(self.pool.add(text))
+        flags = FLAG_IN_RAM | source | (FLAG_EVENT_DAY_IMAGE if imageEventDay else 0)
+        self._append(epoch, forecolor, flags,
+                     (refs[0], refs[2], refs[4], refs[6],
+                      refs[1], refs[3], refs[5], refs[7]), rule, until)
+
+    def addRecord(self, record, source=SOURCE_CONFIG):
+        """Adds an event record of config.json (or of source)."""
+        rule, until = recordRule(record)
+        self.add(eventEpoch(record),
+                 toInt(record.get("forecolor", 0xF0C810)),
+                 record["title"],
+                 record["subtitle"],
+                 record["imageCountDown"],
+                 record["imageEventDay"],
+                 rule, until, source)
+
+    def addIndexed(self, epoch, forecolor, flags, refs, rule=0, until=0):
+        """Adds an event of the compiled index; refs are the offsets then the
+        lengths of its strings in the strings file."""
+        self._append(epoch, forecolor, flags & ~FLAG_IN_RAM, refs, rule, until)
+
+    def sort(self):
+        """
+        Sorts the events by epoch, keeping the current one selected, and
+        stops interning strings as loading is complete.
+        """
+        self.pool.stopInterning()
+        count = len(self.epochs)
+        if all(self.epochs[i - 1] <= self.epochs[i] for i in range(1, count)):
+            return
+
+        epochs = self.epochs
+        order = sorted(range(count), key=lambda i: epochs[i])
+        if count:
+            self.index = order.index(self.index)
+        self._reorder(order)
+
+    # **************** NAVIGATION ******************
+    def count(self):
+        return len(self.epochs)
+
+    def current(self):
+        """Index of the selected event, or -1 when there are no events."""
+        if len(self.epochs) == 0:
+            return -1
+        return self.index
+
+    def neighbor(self, step):
+        """Index of the event step places from the selected one, wrapping."""
+        return (self.index + step) % len(self.epochs)
+
+    def select(self, i):
+        if 0 <= i < len(self.epochs):
+            self.index = i
+            self.chosen = True
+        return self.index
+
+    def next(self):
+        if len(self.epochs):
+            self.index = self.neighbor(1)
+            self.chosen = True
+        return self.index
+
+    def previous(self):
+        if len(self.epochs):
+            self.index = self.neighbor(-1)
+            self.chosen = True
+        return self.index
+
+    def bisect(self, epoch):
+        """Index of the first event that is not before epoch."""
+        epochs = self.epochs
+        lo = 0
+        hi = len(epochs)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if epochs[mid] < epoch:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def expireBefore(self, epoch, onRemove=None, onRepeat=None):
+        """
+        Removes the events before epoch, calling onRemove(i) for each one
+        first. A repeating event moves on to its next occurrence instead,
+        calling onRepeat(i, nextEpoch), unless its rule has ended. The same
+        event stays selected, at its next occurrence if it repeats and was
+        selected with select(), next() or previous(); otherwise the first
+        one left is. Returns the number
+        of events removed or moved on.
+        """
+        expireCount = self.bisect(epoch)
+        if expireCount == 0:
+            return 0
+
+        inRam = False
+        repeated = None
+        for i in range(expireCount):
+            if self.rules is not None and self.rules[i]:
+                nextEpoch = nextOccurrence(self.epochs[i], self.rules[i], self.untils[i], epoch)
+                if nextEpoch is not None:
+                    if onRepeat:
+                        onRepeat(i, nextEpoch)
+                    self.epochs[i] = nextEpoch
+                    if repeated is None:
+                        repeated = []
+                    repeated.append(i)
+                    continue
+            if onRemove:
+                onRemove(i)
+            if self.flags[i] & FLAG_IN_RAM:
+                inRam = True
+
+        moved = self.chosen and repeated is not None and self.index in repeated
+        expired = self.index < expireCount and not moved
+        if repeated:
+            # The repeating events go back in at their next occurrence
+            self._reorder(repeated + list(range(expireCount, len(self.epochs))))
+            if moved:
+                self.index = repeated.index(self.index)
+            else:
+                self.index = 0 if expired else self.index - expireCount + len(repeated)
+            self.sort()
+        else:
+            self.epochs = self.epochs[expireCount:]
+            self.colors = self.colors[expireCount:]
+            self.flags = self.flags[expireCount:]
+            if self.rules is not None:
+                self.rules = self.rules[expireCount:]
+                self.untils = self.untils[expireCount:]
+            self.offsets = self.offsets[4 * expireCount:]
+            self.lengths = self.lengths[4 * expireCount:]
+            self.index = max(0, self.index - expireCount)
+        if expired:
+            self.index = 0
+        if inRam:
+            self._compactPool()
+        return expireCount
+
+    def find(self, epoch, title, source=None, skip=None):
+        """
+        Index of the event at epoch with this title, or -1. A repeating
+        event is found by the epoch of any of its occurrences up to the one
+        it is at. Only the events of source are looked at if it is not
+        None, and not event i if skip[i] is set.
+        """
+        i = self.bisect(epoch)
+        while i < len(self.epochs) and self.epochs[i] == epoch:
+            if self._candidate(i, source, skip) and self.title(i) == title:
+                return i
+            i += 1
+        if self.rules is None:
+            return -1
+        for i in range(len(self.epochs)):
+            if (self.rules[i] and self.epochs[i] > epoch
+                    and self._candidate(i, source, skip)
+                    and nextOccurrence(epoch, self.rules[i], self.untils[i],
+                                       self.epochs[i]) == self.epochs[i]
+                    and self.title(i) == title):
+                return i
+        return -1
+
+    def matches(self, i, record):
+        """True if event i, found by the epoch and title of an event record,
+        has all its other fields."""
+        rule, until = recordRule(record)
+        return (self.colors[i] == toInt(record.get("forecolor", 0xF0C810))
+                and self.rule(i) == rule and self.until(i) == until
+                and self.subtitle(i) == record["subtitle"]
+                and self.imageCountDown(i) == record["imageCountDown"]
+                and self.imageEventDay(i) == record["imageEventDay"])
+
+    def remove(self, i):
+        """
+        Removes event i. The same event stays selected, or the one after it
+        (the first one at the end) if it was the one removed. Call compact()
+        once done removing.
+        """
+        self.epochs = self.epochs[:i] + self.epochs[i + 1:]
+        self.colors = self.colors[:i] + self.colors[i + 1:]
+        self.flags = self.flags[:i] + self.flags[i + 1:]
+        if self.rules is not None:
+            self.rules = self.rules[:i] + self.rules[i + 1:]
+            self.untils = self.untils[:i] + self.untils[i + 1:]
+        self.offsets = self.offsets[:4 * i] + self.offsets[4 * i + 4:]
+        self.lengths = self.lengths[:4 * i] + self.lengths[4 * i + 4:]
+        if i < self.index:
+            self.index -= 1
+        if self.index >= len(self.epochs):
+            self.index = 0
+
+    def compact(self):
+        """Drops the text of the removed events from the strings in RAM."""
+        self._compactPool()
+
+    def upcoming(self, start=None):
+        """
+        Yields (epoch, i) for the occurrences of the events in time order,
+        from start on (from the first event if None), a repeating event at
+        each of its occurrences. Endless while an event repeats without an
+        end, so take as many as needed. Only the next occurrence of each
+        repeating event is kept. Do not change the store while iterating.
+        """
+        count = len(self.epochs)
+        first = 0 if start is None else self.bisect(start)
+        rules = self.rules
+        if rules is None:
+            # Nothing repeats: the events in order
+            for i in range(first, count):
+                yield (self.epochs[i], i)
+            return
+        repeating = [i for i in range(count) if rules[i]]
+        nexts = array("l")
+        for i in repeating:
+            nextEpoch = self.epochs[i]
+            if start is not None:
+                nextEpoch = nextOccurrence(nextEpoch, self.rules[i], self.untils[i], start)
+            nexts.append(NEVER if nextEpoch is None else nextEpoch)
+        i = first
+
+        while True:
+            # The next event that happens once, as they are sorted
+            while i < count and rules[i]:
+                i += 1
+            # The earliest of the next occurrences of the repeating events
+            k = -1
+            for j in range(len(nexts)):
+                if nexts[j] != NEVER and (k < 0 or nexts[j] < nexts[k]):
+                    k = j
+            if i < count and (k < 0 or self.epochs[i] <= nexts[k]):
+                yield (self.epochs[i], i)
+                i += 1
+            elif k >= 0:
+                epoch = nexts[k]
+                r = repeating[k]
+                yield (epoch, r)
+                nextEpoch = nextOccurrence(epoch, self.rules[r], self.untils[r], epoch + 1)
+                nexts[k] = NEVER if nextEpoch is None else nextEpoch
+            else:
+                return
+
+    # **************** FIELDS ******************
+    def epoch(self, i):
+        return self.epochs[i]
+
+    def forecolor(self, i):
+        return self.colors[i]
+
+    def title(self, i):
+        return self._string(i, 0)
+
+    def subtitle(self, i):
+        return self._string(i, 1)
+
+    def imageCountDown(self, i):
+        return self._string(i, 2)
+
+    def imageEventDay(self, i):
+        return self._string(i, 3)
+
+    def hasEventDayImage(self, i):
+        return bool(self.flags[i] & FLAG_EVENT_DAY_IMAGE)
+
+    def source(self, i):
+        return self.flags[i] & SOURCE_MASK
+
+    def rule(self, i):
+        if self.rules is None:
+            return 0
+        return self.rules[i]
+
+    def until(self, i):
+        if self.untils is None:
+            return 0
+        return self.untils[i]
+
+    def describe(self, i, now=None):
+        if now is None:
+            now = int(time.time())
+        d = time.localtime(self.epochs[i])
+        text = f"event(title: {self.title(i)}, subtitle: {self.subtitle(i)}, remainingTime: {self.epochs[i] - now}) for {d.tm_mon}/{d.tm_mday}/{d.tm_year} {d.tm_hour:02}:{d.tm_min:02}"
+        if self.rule(i):
+            text += ", repeats " + describeRule(self.rule(i), self.until(i))
+        return text
+
+    def remainingUpdate(self, now=None):
+        """Updates the remaining time of the selected event in place."""
+        if len(self.epochs) == 0:
+            return 0
+        if now is None:
+            now = time.time()
+        remaining = self.epochs[self.index] - now
+        self.remainingTime = remaining
+
+        self.remainingSeconds = remaining % 60
+        remaining //= 60
+        self.remainingMinutes = remaining % 60
+        remaining //= 60
+        self.remainingHours = remaining % 24
+        remaining //= 24
+        self.remainingDays = remaining
+
+        return self.remainingTime
@@ -0,0 +1,87 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+The instants at which what the display shows of the events changes.
+
+The countdown shows days, hours and minutes, so the display of an event
+only changes at a few instants, all known in advance from its epoch:
+
+- each minute boundary of the remaining time while counting down,
+- the start of the event, when the event day image replaces the countdown,
+- the end of the event day, a day after the start, when the event expires,
+
+and the expiry of the first event of the store, which changes the count.
+
+    timeline = eventTimeline()
+    if timeline.due(now, events.current()):
+        ...redraw the event...
+        timeline.plan(events, now)
+
+plan() works out the phase of the selected event and the next of these
+instants, so the clock only does the work of the events when due() says it
+is time instead of on every tick: at most once a minute while counting down,
+and once a day on the event day. invalidate() makes the next due() true,
+e.g. after the clock was set or the events were reloaded.
+"""
+
+from eventStore import SECONDS_PER_DAY
+
+# Phases of the selected event
+NO_EVENTS = 0
+COUNTDOWN = 1
+EVENT_DAY = 2
+
+# Events are removed a day after they started
+EXPIRE_AFTER = SECONDS_PER_DAY
+
+
+def phaseOf(remainingTime):
+    """Phase of an event from its remaining time (eventStore.remainingTime)."""
+    if remainingTime > 0:
+        return COUNTDOWN
+    return EVENT_DAY
+
+
+# **************** CLASS ******************
+class eventTimeline:
+    def __init__(self):
+        self.phase = NO_EVENTS
+        self.index = None
+        # Time of the next transition, None to recompute on the next tick
+        self.nextAt = None
+        self.transitions = 0
+
+    def invalidate(self):
+        self.nextAt = None
+
+    def due(self, now, index):
+        """True if the events need to be updated: a transition was reached,
+        another event was selected or the timeline was invalidated."""
+        return self.nextAt is None or now >= self.nextAt or index != self.index
+
+    def plan(self, events, now):
+        """Works out the phase of the selected event and the time of the next
+        transition. Returns the phase."""
+        self.transitions += 1
+        self.index = events.current()
+        if self.index < 0:
+            # Nothing changes until events are loaded
+            self.phase = NO_EVENTS
+            self.nextAt = now + SECONDS_PER_DAY
+            return self.phase
+
+        epoch = events.epoch(self.index)
+        # The first event expires once now - EXPIRE_AFTER is past its epoch
+        nextAt = events.epoch(0) + EXPIRE_AFTER + 1
+        remaining = epoch - now
+        self.phase = phaseOf(remaining)
+        if self.phase == COUNTDOWN:
+            # The minutes shown change when the remaining seconds go from a
+            # whole minute to 59, and the countdown ends at the epoch
+            nextAt = min(nextAt, now + remaining % 60 + 1, epoch)
+        else:
+            nextAt = min(nextAt, epoch + EXPIRE_AFTER + 1)
+        self.nextAt = max(nextAt, now + 1)
+        return self.phase
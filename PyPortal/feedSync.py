@@ -0,0 +1,260 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Keeps the events of a remote feed in step with the device.
+
+The feed is a JSON document in the format of config.json (only its events
+are used), either at a URL (the events_url secret) or as the last value of
+an Adafruit IO feed (the events_feed secret, read with aio_username and
+aio_key). feedSync fetches it with the state machine of timeSync, once per
+interval, and sends the ETag and Last-Modified of the last version it got,
+so a feed that did not change costs one short request answered with
+304 Not Modified.
+
+A new version is written to the SD card as it arrives and then compared
+with the previous one by the key and a CRC-32 of each event, reading both
+files as streams: only the events added, changed or removed are applied to
+the eventStore. The new version is kept in FEED_FILE with its
+ETag and Last-Modified, and loadSdCard() adds its events to those of
+config.json on the next boot, so the device also starts without a network.
+"""
+
+import binascii
+import json
+import os
+import time
+from configLoader import configReader, eventEpoch
+from eventRecurrence import recordRule
+from eventStore import SECONDS_PER_DAY, SOURCE_FEED
+from timeSync import timeSync
+
+FEED_FILE = "feed.json"
+DOWNLOAD_FILE = "feed.tmp"
+AIO_FEED_URL = "https://io.adafruit.com/api/v2/{}/feeds/{}/data/last"
+# Fields of an event kept in FEED_FILE
+EVENT_FIELDS = ("year", "month", "day", "hour", "minute", "forecolor",
+                "title", "subtitle", "imageCountDown", "imageEventDay",
+                "repeat", "interval", "until")
+# Text fields that config.json requires, empty when the feed leaves them out
+TEXT_FIELDS = ("title", "subtitle", "imageCountDown", "imageEventDay")
+
+
+# **************** FUNCTIONS ******************
+def _feedEvent(value):
+    # (key, record) of an event of the feed, or None when it is not valid
+    record = {}
+    for name in EVENT_FIELDS:
+        if name in value:
+            record[name] = value[name]
+    for name in TEXT_FIELDS:
+        if record.get(name) is None:
+            record[name] = ""
+    try:
+        recordRule(record)
+        return ((eventEpoch(record), record["title"]), record)
+    except (KeyError, ValueError, TypeError):
+        print(f"WARN: Skipped an event of the feed without a valid date or repeat: {record['title']}")
+    return None
+
+
+def feedRecords(path):
+    """
+    Yields (key, record) for each valid event of a feed file, with key
+    (epoch, title), reading the file as it goes. The document of an Adafruit
+    IO reply is the string of its "value", so that one is parsed whole.
+    """
+    with open(path, "rb") as fp:
+        for key, value in configReader(fp).records():
+            if key == "event":
+                entry = _feedEvent(value)
+                if entry is not None:
+                    yield entry
+            elif key == "value" and isinstance(value, str):
+                for record in json.loads(value).get("events", ()):
+                    entry = _feedEvent(record)
+                    if entry is not None:
+                        yield entry
+
+
+def recordDigest(record):
+    """CRC-32 of the fields of a record, to tell whether an event changed."""
+    digest = 0
+    for name in EVENT_FIELDS:
+        digest = binascii.crc32(bytes(f"{name}={record.get(name)}\n", "utf-8"), digest)
+    return digest
+
+
+def feedDigests(path):
+    """
+    Dictionary of recordDigest() by (epoch, title) of the events of a feed
+    file. When two events have the same key, the first one counts.
+    """
+    digests = {}
+    for key, record in feedRecords(path):
+        if key not in digests:
+            digests[key] = recordDigest(record)
+    return digests
+
+
+def readValidators(path):
+    """(etag, lastModified) of FEED_FILE, which writeFeed() puts first."""
+    etag = None
+    lastModified = None
+    try:
+        with open(path, "rb") as fp:
+            for key, value in configReader(fp).records():
+                if key == "etag":
+                    etag = value
+                elif key == "lastModified":
+                    lastModified = value
+                else:
+                    break
+    except (OSError, ValueError):
+        pass
+    return (etag, lastModified)
+
+
+def writeFeed(path, etag, lastModified, records):
+    """Writes the event records to path, one per line, through a new file
+    so that a failed write leaves the last version."""
+    with open(path + ".new", "w") as fp:
+        fp.write(f'{{"etag": {json.dumps(etag)}, "lastModified": {json.dumps(lastModified)},\n"events": [')
+        separator = "\n"
+        for record in records:
+            fp.write(separator)
+            fp.write(json.dumps(record))
+            separator = ",\n"
+        fp.write("\n]}\n")
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    os.rename(path + ".new", path)
+
+
+# **************** CLASS ******************
+class feedSync(timeSync):
+    NAME = "Event feed sync"
+    WHAT = "events"
+
+    @staticmethod
+    def configured(secrets):
+        return bool(secrets.get("events_url") or secrets.get("events_feed"))
+
+    def __init__(self, esp, secrets, folder, events, interval=3600, **kwargs):
+        url = secrets.get("events_url")
+        self.aioFeed = None
+        if not url:
+            self.aioFeed = secrets["events_feed"]
+            url = AIO_FEED_URL.format(secrets["aio_username"], self.aioFeed)
+        super().__init__(esp, secrets, interval, url, **kwargs)
+        self.folder = folder
+        self.events = events
+        self.etag, self.lastModified = readValidators(self._path(FEED_FILE))
+        # Events changed by the last new version, and the replies so far
+        self.added = 0
+        self.changed = 0
+        self.removed = 0
+        self.notModified = 0
+        self._fp = None
+        self._written = 0
+
+    # **************** INTERNAL METHODS ******************
+    def _path(self, name):
+        return self.folder + "/" + name
+
+    def _closeSocket(self):
+        super()._closeSocket()
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+        self._written = 0
+
+    def _requestHeaders(self):
+        headers = ""
+        if self.aioFeed:
+            headers += f"X-AIO-Key: {self.secrets['aio_key']}\r\n"
+        if self.etag:
+            headers += f"If-None-Match: {self.etag}\r\n"
+        if self.lastModified:
+            headers += f"If-Modified-Since: {self.lastModified}\r\n"
+        return headers
+
+    def _receiveBody(self, data):
+        if self._fp is None:
+            if self._status() != 200:
+                self._response.extend(data)
+                return
+            # The body of a new version goes to the SD card as it arrives
+            self._fp = open(self._path(DOWNLOAD_FILE), "wb")
+        self._fp.write(data)
+        self._written += len(data)
+
+    def _bodyLength(self, body):
+        return self._written + len(body)
+
+    def _handleReply(self, body):
+        status = self._status()
+        if status == 304:
+            self.notModified += 1
+            print("INFO: The event feed has not changed")
+            return False
+        if status != 200:
+            raise ValueError(str(self._response[:self._response.find(b"\r\n")], "utf-8"))
+        if self._fp is None:
+            raise ValueError("empty reply")
+        self._fp.close()
+        self._fp = None
+        return self._apply(self._header("etag"), self._header("last-modified"))
+
+    def _apply(self, etag, lastModified):
+        # Compare the new version with the last one by key and digest, so
+        # that neither document is held in memory, and apply the difference
+        download = self._path(DOWNLOAD_FILE)
+        new = feedDigests(download)
+        try:
+            old = feedDigests(self._path(FEED_FILE))
+        except OSError:
+            old = {}
+        removed = [key for key in old if key not in new]
+        added = [key for key in new if key not in old]
+        changed = [key for key in new if key in old and new[key] != old[key]]
+        old = None
+
+        for key in removed + changed:
+            i = self.events.find(key[0], key[1], SOURCE_FEED)
+            if i >= 0:
+                self.events.remove(i)
+        if removed or changed:
+            self.events.compact()
+        wanted = set(added + changed)
+        # As when loading, events that ended more than a day ago are skipped
+        # unless they repeat
+        skipBefore = time.time() - SECONDS_PER_DAY
+
+        def records():
+            # The events of the new version read once more, first of each
+            # key only: all of them go to FEED_FILE and the added and
+            # changed ones to the eventStore as well
+            for key, record in feedRecords(download):
+                if key not in new:
+                    continue
+                del new[key]
+                if key in wanted and (key[0] >= skipBefore or record.get("repeat")):
+                    self.events.addRecord(record, SOURCE_FEED)
+                yield record
+
+        try:
+            writeFeed(self._path(FEED_FILE), etag, lastModified, records())
+        finally:
+            self.events.sort()
+        os.remove(download)
+        self.etag = etag
+        self.lastModified = lastModified
+        self.added = len(added)
+        self.changed = len(changed)
+        self.removed = len(removed)
+        print(f"INFO: Event feed: {self.added} added, {self.changed} changed, {self.removed} removed")
+        return bool(added or changed or removed)
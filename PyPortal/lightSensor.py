@@ -0,0 +1,131 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Smoothed ambient light reading and the auto brightness it maps to.
+
+Each update() reads the ADC three times and keeps the median, which drops
+a single noisy sample, then feeds it to an exponential moving average. The
+average is mapped to a backlight level through a table built once at import
+(the log curve of the Analog Devices design note), so no logarithm is taken
+per reading. The level only moves when the target is HYSTERESIS away from
+it, so the PWM is not rewritten for every small change of the light.
+
+With darkBelow set, the sensor also reports a "dark room" once the reading
+has stayed below it for darkAfter seconds, until the light comes back (twice
+darkBelow) or wake() is called.
+"""
+
+import math
+import time
+from array import array
+
+# https://www.analog.com/en/design-notes/a-simple-implementation-of-lcd-brightness-control-using-the-max44009-ambientlight-sensor.html
+MAXIMUM_LUX_BREAKPOINT = 1254.0
+# Levels are in thousandths of full brightness
+LEVEL_MIN = 10
+LEVEL_MAX = 1000
+# Entries of the table are 256 readings apart
+TABLE_SHIFT = 8
+# Weight of a new reading in the moving average is 1 / 2**EMA_SHIFT
+EMA_SHIFT = 2
+# Change of level (in thousandths) needed before the backlight follows
+HYSTERESIS = 20
+
+
+def _levelOf(reading):
+    # The sensor reads 0 to 65535 for about 0 to 2000 lux
+    lux = (reading / 65536) * 2000
+    if lux >= MAXIMUM_LUX_BREAKPOINT:
+        return LEVEL_MAX
+    if lux <= 0:
+        return LEVEL_MIN
+    level = int((9.9323 * math.log(lux) + 27.059) * 10)
+    return max(LEVEL_MIN, min(LEVEL_MAX, level))
+
+
+# Level of every 256th reading, with one extra entry to interpolate to 65536
+LEVELS = array("H", [_levelOf(i << TABLE_SHIFT) for i in range((65536 >> TABLE_SHIFT) + 1)])
+
+
+# **************** CLASS ******************
+class lightSensor:
+    def __init__(self, analogIn, hysteresis=HYSTERESIS, darkBelow=None, darkAfter=30):
+        self.analogIn = analogIn
+        self.hysteresis = hysteresis
+        self.darkBelow = darkBelow
+        self.darkAfter = darkAfter
+
+        self.reading = None         # smoothed reading, 0 to 65535
+        self.level = LEVEL_MAX      # backlight level, in thousandths
+        self.dark = False
+        self._darkSince = None
+
+    # **************** INTERNAL METHODS ******************
+    def _sample(self):
+        # Median of three readings
+        a = self.analogIn.value
+        b = self.analogIn.value
+        c = self.analogIn.value
+        return a + b + c - min(a, b, c) - max(a, b, c)
+
+    def _updateDark(self, now):
+        if self.reading < self.darkBelow:
+            if self._darkSince is None:
+                self._darkSince = now
+            elif not self.dark and (now - self._darkSince) >= self.darkAfter:
+                self.dark = True
+        else:
+            self._darkSince = None
+            if self.dark and self.reading >= 2 * self.darkBelow:
+                self.dark = False
+
+    # **************** PUBLIC METHODS ******************
+    def brightness(self):
+        return self.level / 1000
+
+    def levelOf(self, reading):
+        """Backlight level (thousandths) of a reading, from the table."""
+        i = reading >> TABLE_SHIFT
+        low = LEVELS[i]
+        return low + (((LEVELS[i + 1] - low) * (reading & 0xFF)) >> TABLE_SHIFT)
+
+    def update(self, now=None):
+        """
+        Takes one reading. Returns True if the backlight level changed.
+        """
+        if now is None:
+            now = time.monotonic()
+
+        sample = self._sample()
+        if self.reading is None:
+            self.reading = sample
+            self.level = self.levelOf(sample)
+            changed = True
+        else:
+            self.reading += (sample - self.reading) >> EMA_SHIFT
+            target = self.levelOf(self.reading)
+            changed = abs(target - self.level) >= self.hysteresis
+            # The ends of the range are always reached
+            if not changed and target != self.level:
+                changed = target in (LEVEL_MIN, LEVEL_MAX)
+            if changed:
+                self.level = target
+
+        if self.darkBelow is not None:
+            self._updateDark(now)
+        return changed
+
+    def wake(self, now=None):
+        """
+        Leaves the dark room state (e.g. on a touch); it is entered again
+        after darkAfter more seconds of darkness. Returns True if it was dark.
+        """
+        if now is None:
+            now = time.monotonic()
+        wasDark = self.dark
+        self.dark = False
+        if self._darkSince is not None:
+            self._darkSince = now
+        return wasDark
@@ -0,0 +1,144 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+State and signal strength of the Wi-Fi link, read as seldom as possible.
+
+Each reading of the ESP32 co-processor is an SPI transaction on the bus the
+SD card also uses. poll() only reads the link when it is due: every
+fastInterval seconds while the link is down or the signal is moving, and
+twice as long after each steady reading, up to slowInterval.
+
+The signal is smoothed with an exponential moving average and shown as 0 to
+4 bars. The first reading after the link comes up sets the bars at once.
+After that they move one level at a time, each time the average is
+HYSTERESIS dB past the threshold next to the current count, so poll()
+reports a change (and the caller sets the sprite) only when there is a
+different bar count to show.
+
+Functions added with addListener() are called with True or False when the
+link comes up or goes down, e.g. timeSync.linkChanged.
+"""
+
+import time
+
+# Weight of a new reading in the moving average is 1 / 2**EMA_SHIFT
+EMA_SHIFT = 2
+# The average is kept in 1/16 dBm
+SCALE_SHIFT = 4
+# dB the average has to pass a threshold by before the bars change
+HYSTERESIS = 3
+# A reading within this many dB of the average counts as steady
+STEADY_DB = 4
+# Lowest dBm of 4, 3, 2 and 1 bars
+BAR_THRESHOLDS = (-30, -55, -70, -90)
+NO_SIGNAL = -100
+
+
+def barsOf(dBm):
+    bars = len(BAR_THRESHOLDS)
+    for threshold in BAR_THRESHOLDS:
+        if dBm >= threshold:
+            return bars
+        bars -= 1
+    return 0
+
+
+# **************** CLASS ******************
+class linkMonitor:
+    def __init__(self, esp, fastInterval=1, slowInterval=30):
+        self.esp = esp
+        self.fastInterval = fastInterval
+        self.slowInterval = slowInterval
+
+        self.connected = None       # None until the first reading
+        self.bars = 0
+        self.interval = fastInterval
+        self.reads = 0              # SPI transactions so far
+        self._average = None        # 1/16 dBm
+        self._pollAt = 0
+        self._listeners = []
+
+    # **************** INTERNAL METHODS ******************
+    def _setConnected(self, connected):
+        if connected == self.connected:
+            return
+        self.connected = connected
+        for listener in self._listeners:
+            listener(connected)
+
+    def _updateBars(self, dBm):
+        # The bar count moves a level at a time, while the average is clearly
+        # past the threshold next to it
+        bars = self.bars
+        top = len(BAR_THRESHOLDS)
+        while bars < top and dBm >= BAR_THRESHOLDS[top - 1 - bars] + HYSTERESIS:
+            bars += 1
+        while bars > 0 and dBm < BAR_THRESHOLDS[top - bars] - HYSTERESIS:
+            bars -= 1
+        if bars == self.bars:
+            return False
+        self.bars = bars
+        return True
+
+    # **************** PUBLIC METHODS ******************
+    def addListener(self, listener):
+        self._listeners.append(listener)
+
+    def dBm(self):
+        """The smoothed signal strength, or NO_SIGNAL while disconnected."""
+        if self._average is None:
+            return NO_SIGNAL
+        return self._average >> SCALE_SHIFT
+
+    def due(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        return now >= self._pollAt
+
+    def wait(self, now=None):
+        """Seconds until the next reading is due."""
+        if now is None:
+            now = time.monotonic()
+        return max(0, self._pollAt - now)
+
+    def poll(self, now=None):
+        """
+        Reads the link if it is due. Returns True if the bars to show changed.
+        """
+        if now is None:
+            now = time.monotonic()
+        if now < self._pollAt:
+            return False
+
+        self.reads += 1
+        connected = self.esp.is_connected
+        steady = False
+        if connected:
+            self.reads += 1
+            sample = self.esp.rssi << SCALE_SHIFT
+            if self._average is None:
+                # Nothing to smooth yet, the bars start from this reading
+                self._average = sample
+                bars = barsOf(sample >> SCALE_SHIFT)
+                changed = bars != self.bars
+                self.bars = bars
+            else:
+                steady = abs(sample - self._average) <= (STEADY_DB << SCALE_SHIFT)
+                self._average += (sample - self._average) >> EMA_SHIFT
+                changed = self._updateBars(self._average >> SCALE_SHIFT)
+        else:
+            # Start over from the first reading once the link is back
+            self._average = None
+            changed = self.bars != 0
+            self.bars = 0
+        self._setConnected(connected)
+
+        # Back off while the signal is steady, look again soon when it is not
+        if steady and not changed:
+            self.interval = min(self.slowInterval, self.interval * 2)
+        else:
+            self.interval = self.fastInterval
+        self._pollAt = now + self.interval
+        return changed
@@ -0,0 +1,148 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Times named stages of the main loop.
+
+    profile = profiler(size=64, interval=60)
+    profile.enabled = True
+    profile.start("touch")
+    ...
+    profile.stop("touch")
+    profile.poll()      # prints the summary once per interval
+
+Each stage keeps its last `size` durations (microseconds, from
+time.monotonic_ns()) and the change of gc.mem_free() over each span in
+fixed arrays, so timing allocates nothing once a stage exists. The summary
+gives the count, p50, p95 and maximum of each stage, and is printed to the
+serial console or appended to a file (e.g. on /sd).
+
+While disabled, start() and stop() return at once, so the spans can stay in
+the code.
+"""
+
+import gc
+import time
+from array import array
+
+
+# **************** STAGE ******************
+class stage:
+    def __init__(self, name, size):
+        self.name = name
+        self.durations = array("L", [0] * size)     # microseconds
+        self.allocated = array("l", [0] * size)     # bytes taken from the heap
+        self.next = 0
+        self.count = 0
+        self.started = 0
+        self.memFree = 0
+
+    def add(self, duration, allocated):
+        self.durations[self.next] = duration
+        self.allocated[self.next] = allocated
+        self.next = (self.next + 1) % len(self.durations)
+        if self.count < len(self.durations):
+            self.count += 1
+
+    def clear(self):
+        self.next = 0
+        self.count = 0
+
+
+def percentile(values, fraction):
+    # values is sorted
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+# **************** CLASS ******************
+class profiler:
+    def __init__(self, size=64, interval=60, path=None, enabled=False, trackMemory=True):
+        self.size = size
+        self.interval = interval
+        self.path = path
+        self.enabled = enabled
+        self.trackMemory = trackMemory
+        self.stages = {}
+        self._order = []
+        self._reportAt = time.monotonic() + interval
+
+    # **************** PUBLIC METHODS ******************
+    def clear(self):
+        for s in self._order:
+            s.clear()
+
+    def enable(self, enabled=True):
+        """Switches the timing on or off. Switching it on starts over."""
+        if enabled and not self.enabled:
+            self.clear()
+            self._reportAt = time.monotonic() + self.interval
+        self.enabled = enabled
+        print(f"INFO: Profiler {'on' if enabled else 'off'}")
+
+    def poll(self, now=None):
+        """Writes the summary if the interval has passed. Returns True if it did."""
+        if not self.enabled:
+            return False
+        if now is None:
+            now = time.monotonic()
+        if now < self._reportAt:
+            return False
+        self._reportAt = now + self.interval
+        self.report()
+        return True
+
+    def report(self):
+        lines = self.summary()
+        if self.path is None:
+            for line in lines:
+                print(line)
+            return
+        try:
+            with open(self.path, "a") as fp:
+                for line in lines:
+                    fp.write(line + "\n")
+        except OSError as e:
+            print(f"ERROR: Failed to write the profile to {self.path}\r\n{e}")
+
+    def start(self, name):
+        if not self.enabled:
+            return
+        s = self.stages.get(name)
+        if s is None:
+            s = stage(name, self.size)
+            self.stages[name] = s
+            self._order.append(s)
+        if self.trackMemory:
+            s.memFree = gc.mem_free()
+        s.started = time.monotonic_ns()
+
+    def stop(self, name):
+        if not self.enabled:
+            return
+        now = time.monotonic_ns()
+        s = self.stages.get(name)
+        # Switched on in the middle of the span
+        if s is None or s.started == 0:
+            return
+        allocated = 0
+        if self.trackMemory:
+            allocated = s.memFree - gc.mem_free()
+        s.add((now - s.started) // 1000, allocated)
+        s.started = 0
+
+    def summary(self):
+        """One line per stage: the count and the p50/p95/max of the duration
+        (microseconds) and of the memory taken (bytes)."""
+        lines = ["PROFILE: stage n p50/p95/max us  mem p50/p95/max bytes"]
+        for s in self._order:
+            if not s.count:
+                continue
+            durations = sorted(s.durations[:s.count])
+            allocated = sorted(s.allocated[:s.count])
+            lines.append(f"PROFILE: {s.name} {s.count} "
+                         f"{percentile(durations, 0.5)}/{percentile(durations, 0.95)}/"
+                         f"{durations[-1]}  "
+                         f"{percentile(allocated, 0.5)}/{percentile(allocated, 0.95)}/"
+                         f"{allocated[-1]}")
+        return lines
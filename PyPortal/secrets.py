@@ -9,4 +9,8 @@ secrets = {
     'timezone' : "America/New_York",  # http://worldtimeapi.org/timezones
     'aio_username' : 'YOUR_ADAFRUIT_ACCOUNT_USERNAME',
     'aio_key' : 'YOUR_ADAFRUITIO_KEY',
+    # Optional remote event feed, polled hourly: a JSON URL in the format of
+    # config.json, or the name of an Adafruit IO feed holding that JSON
+    # 'events_url' : 'https://example.com/events.json',
+    # 'events_feed' : 'countdown-events',
     }
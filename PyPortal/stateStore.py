@@ -0,0 +1,223 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Keeps the settings and the clock of the last run across resets.
+
+The state is one small record: the selected event, the backlight, the
+temperature unit, the clock format, the time of the last time sync and how
+far that sync moved the clock (the RTC error). It is written to
+microcontroller.nvm, or to a file on the SD card when there is no NVM, and
+only when a setting or the selected event changed and then held for
+SETTLE_TIME: stepping through the events or the backlight levels by touch
+writes one record when the user stops, not one per step. The backlight
+level set by the light sensor is not a setting: it is only written with
+another change while the backlight is automatic. A time sync alone is
+written once every SYNC_SAVE_INTERVAL, the first one at once: the time it
+keeps only needs to be close enough to show the events after a power
+cycle, until the next sync sets the clock.
+
+The records go to a ring of SLOTS fixed size slots, each written in turn
+with a sequence number and a checksum, and at boot the valid record with
+the highest sequence number is the state. The ring does not spread the
+wear of the flash: on the SAMD51 of the PyPortal, microcontroller.nvm
+erases and rewrites its whole flash block on every write, whatever the
+slot, and that block takes a limited number of erases. So the writes are
+kept few rather than spread. A reset between the erase and the rewrite of
+that block loses every slot, and the board starts cold as from an erased
+NVM. On the SD card, where the card spreads the writes itself, a record
+written halfway is skipped for the one before it.
+"""
+
+import struct
+
+MAGIC = 0x5053
+SLOTS = 64
+# Seconds between the records written only because of a new time sync
+SYNC_SAVE_INTERVAL = 86400
+# Seconds a changed setting or event must hold before it is written
+SETTLE_TIME = 60
+# magic, sequence, flags, backlight (thousandths), selected event, its
+# epoch, epoch of the last time sync, seconds the sync moved the clock,
+# epoch the record was written at, checksum of the bytes before it
+RECORD_FORMAT = "<HIBxHhiiiiH"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+SLOT_SIZE = 32
+CHECKSUM_OFFSET = RECORD_SIZE - 2
+
+FLAG_BACKLIGHT_AUTO = 0x01
+FLAG_FAHRENHEIT = 0x02
+FLAG_24_HOUR = 0x04
+FLAG_SYNCED = 0x08
+
+
+# **************** FUNCTIONS ******************
+def checksum(data, start, end):
+    """Fletcher-16 of data[start:end]."""
+    a = 0
+    b = 0
+    for i in range(start, end):
+        a = (a + data[i]) % 255
+        b = (b + a) % 255
+    return (b << 8) | a
+
+
+# **************** CLASSES ******************
+class fileStorage:
+    """
+    A file used like microcontroller.nvm (slices of bytes), for the boards
+    without NVM. Created filled with 0xFF, as erased flash is.
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        try:
+            with open(path, "rb") as fp:
+                if len(fp.read()) >= size:
+                    return
+        except OSError:
+            pass
+        with open(path, "wb") as fp:
+            fp.write(b"\xff" * size)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, s):
+        with open(self.path, "rb") as fp:
+            fp.seek(s.start)
+            return fp.read(s.stop - s.start)
+
+    def __setitem__(self, s, data):
+        with open(self.path, "r+b") as fp:
+            fp.seek(s.start)
+            fp.write(data)
+
+
+class stateStore:
+    def __init__(self, storage, offset=0, slots=SLOTS, syncInterval=SYNC_SAVE_INTERVAL,
+                 settleTime=SETTLE_TIME):
+        self.storage = storage
+        self.offset = offset
+        self.slots = slots
+        self.syncInterval = syncInterval
+        self.settleTime = settleTime
+        self.sequence = 0
+        self.slot = -1
+        self.writes = 0
+        self._record = bytearray(SLOT_SIZE)
+        # The values last passed to save() and the epoch they changed at
+        self._pending = None
+        self._pendingSince = 0
+
+        # The state, the defaults until a record is found
+        self.eventIndex = 0
+        self.eventEpoch = 0
+        self.backlightAuto = True
+        self.backlight = 1000
+        self.temperatureInF = True
+        self.timeFormat24 = True
+        self.lastSync = None
+        self.correction = 0
+        self.savedAt = 0
+
+        self.loaded = storage is not None and self._load()
+
+    @staticmethod
+    def bytesNeeded(slots=SLOTS):
+        return slots * SLOT_SIZE
+
+    # **************** INTERNAL METHODS ******************
+    def _load(self):
+        # One read of the whole ring
+        data = self.storage[self.offset:self.offset + self.slots * SLOT_SIZE]
+        best = None
+        for slot in range(self.slots):
+            start = slot * SLOT_SIZE
+            if data[start] | (data[start + 1] << 8) != MAGIC:
+                continue
+            fields = struct.unpack_from(RECORD_FORMAT, data, start)
+            if fields[9] != checksum(data, start, start + CHECKSUM_OFFSET):
+                continue
+            if best is None or fields[1] > best[1]:
+                best = fields
+                self.slot = slot
+        if best is None:
+            return False
+
+        (_, self.sequence, flags, self.backlight, self.eventIndex, self.eventEpoch,
+         lastSync, self.correction, self.savedAt, _) = best
+        self.backlightAuto = bool(flags & FLAG_BACKLIGHT_AUTO)
+        self.temperatureInF = bool(flags & FLAG_FAHRENHEIT)
+        self.timeFormat24 = bool(flags & FLAG_24_HOUR)
+        self.lastSync = lastSync if flags & FLAG_SYNCED else None
+        return True
+
+    # **************** PUBLIC METHODS ******************
+    def backlightVal(self):
+        return self.backlight / 1000
+
+    def save(self, eventIndex, eventEpoch, backlightAuto, backlightVal,
+             temperatureInF, timeFormat24, lastSync, correction, now):
+        """
+        Writes the state to the next slot if a setting or the event changed
+        since the last record (the backlight level only when it is not
+        automatic) and has held for settleTime, or if lastSync is the
+        first time sync or syncInterval after the one recorded. now is the
+        epoch written with it. Returns True if a record was written.
+        """
+        backlight = int(backlightVal * 1000 + 0.5)
+        pending = (eventIndex, eventEpoch, backlightAuto, backlightAuto or backlight,
+                   temperatureInF, timeFormat24)
+        if pending != self._pending:
+            self._pending = pending
+            self._pendingSince = now
+        # A clock set back by a time sync does not hold the change back
+        settling = 0 <= now - self._pendingSince < self.settleTime
+        if (self.slot >= 0
+                and (settling or (eventIndex == self.eventIndex
+                                  and eventEpoch == self.eventEpoch
+                                  and backlightAuto == self.backlightAuto
+                                  and (backlightAuto or backlight == self.backlight)
+                                  and temperatureInF == self.temperatureInF
+                                  and timeFormat24 == self.timeFormat24))
+                and (lastSync == self.lastSync
+                     or (lastSync is not None and self.lastSync is not None
+                         and 0 <= lastSync - self.lastSync < self.syncInterval))):
+            return False
+        if self.storage is None:
+            return False
+
+        flags = 0
+        if backlightAuto:
+            flags |= FLAG_BACKLIGHT_AUTO
+        if temperatureInF:
+            flags |= FLAG_FAHRENHEIT
+        if timeFormat24:
+            flags |= FLAG_24_HOUR
+        if lastSync is not None:
+            flags |= FLAG_SYNCED
+        record = self._record
+        struct.pack_into(RECORD_FORMAT, record, 0, MAGIC, self.sequence + 1, flags,
+                         backlight, eventIndex, eventEpoch,
+                         0 if lastSync is None else lastSync, correction, now, 0)
+        struct.pack_into("<H", record, CHECKSUM_OFFSET, checksum(record, 0, CHECKSUM_OFFSET))
+        slot = (self.slot + 1) % self.slots
+        start = self.offset + slot * SLOT_SIZE
+        self.storage[start:start + SLOT_SIZE] = record
+
+        self.sequence += 1
+        self.slot = slot
+        self.writes += 1
+        self.eventIndex = eventIndex
+        self.eventEpoch = eventEpoch
+        self.backlightAuto = backlightAuto
+        self.backlight = backlight
+        self.temperatureInF = temperatureInF
+        self.timeFormat24 = timeFormat24
+        self.lastSync = lastSync
+        self.correction = correction
+        self.savedAt = now
+        return True
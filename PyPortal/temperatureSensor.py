@@ -0,0 +1,120 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Buffered sampling of the ADT7410 temperature sensor.
+
+sample() reads the sensor into a ring buffer of the last `size` readings,
+kept in 1/128 °C steps (the high resolution step of the ADT7410) so that
+the buffer is an array of short ints and the running sum is exact. The
+average of the buffer is only taken every `decimation` readings, and
+tenths() gives it in the tenths of a degree that the label shows, so the
+label only has to change when that number does.
+
+With history set, the minimum, maximum and average of each hour of the day
+are kept in fixed arrays of that many hours.
+"""
+
+import time
+from array import array
+
+# Readings are kept in 1/128 °C
+STEPS_PER_DEGREE = 128
+
+
+# **************** CLASS ******************
+class temperatureSensor:
+    def __init__(self, adt, size=12, decimation=2, offset=0, history=None):
+        self.adt = adt
+        self.decimation = decimation
+        self.offset = offset
+
+        self._buffer = array("h", [0] * size)
+        self._next = 0
+        self._count = 0
+        self._sum = 0
+        self._sinceAverage = 0
+        self.average = None         # in 1/128 °C
+        self.reads = 0
+
+        self.history = history
+        if history:
+            self._historyMin = array("h", [0] * history)
+            self._historyMax = array("h", [0] * history)
+            self._historySum = array("l", [0] * history)
+            self._historyCount = array("H", [0] * history)
+            self._historyHour = None
+
+    # **************** INTERNAL METHODS ******************
+    def _addHistory(self, reading):
+        hour = time.localtime().tm_hour % self.history
+        if hour != self._historyHour:
+            # A new hour starts over the one of the day before
+            self._historyHour = hour
+            self._historyMin[hour] = reading
+            self._historyMax[hour] = reading
+            self._historySum[hour] = 0
+            self._historyCount[hour] = 0
+        if reading < self._historyMin[hour]:
+            self._historyMin[hour] = reading
+        if reading > self._historyMax[hour]:
+            self._historyMax[hour] = reading
+        if self._historyCount[hour] < 0xFFFF:
+            self._historySum[hour] += reading
+            self._historyCount[hour] += 1
+
+    # **************** PUBLIC METHODS ******************
+    def celsius(self):
+        if self.average is None:
+            return None
+        return self.average / STEPS_PER_DEGREE
+
+    def hourly(self, hour):
+        """
+        (minimum, maximum, average) in °C of an hour of the day, or None if
+        there is no reading for it.
+        """
+        if not self.history or not self._historyCount[hour]:
+            return None
+        return (self._historyMin[hour] / STEPS_PER_DEGREE,
+                self._historyMax[hour] / STEPS_PER_DEGREE,
+                self._historySum[hour] / self._historyCount[hour] / STEPS_PER_DEGREE)
+
+    def sample(self):
+        """
+        Reads the sensor once. Returns True if the average was updated.
+        """
+        reading = int(round((self.adt.temperature + self.offset) * STEPS_PER_DEGREE))
+        self.reads += 1
+
+        size = len(self._buffer)
+        if self._count < size:
+            self._count += 1
+        else:
+            self._sum -= self._buffer[self._next]
+        self._buffer[self._next] = reading
+        self._sum += reading
+        self._next = (self._next + 1) % size
+
+        if self.history:
+            self._addHistory(reading)
+
+        # The first reading is shown at once, then every decimation readings
+        self._sinceAverage += 1
+        if self.average is not None and self._sinceAverage < self.decimation:
+            return False
+        self._sinceAverage = 0
+        self.average = self._sum // self._count
+        return True
+
+    def tenths(self, fahrenheit=False):
+        """The average in tenths of a degree, rounded, or None before the
+        first reading."""
+        if self.average is None:
+            return None
+        if fahrenheit:
+            # F = C * 9 / 5 + 32
+            return (self.average * 90 // 5 + 320 * STEPS_PER_DEGREE
+                    + STEPS_PER_DEGREE // 2) // STEPS_PER_DEGREE
+        return (self.average * 10 + STEPS_PER_DEGREE // 2) // STEPS_PER_DEGREE
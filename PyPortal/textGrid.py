@@ -0,0 +1,145 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Text in fixed size cells, drawn as the tiles of one TileGrid.
+
+The font is one bitmap with a cell per character, drawn from a BDF font by
+Host/buildGridFont.py, and a manifest: the cell size, then the characters
+in cell order. Writing text only writes the tile index of each cell that
+shows another character, and scrolling moves the indices between rows, so
+neither allocates nor redraws the cells that did not change. However much
+text it shows, the grid is one TileGrid with a byte per cell, where a Label
+makes a TileGrid per character.
+
+The characters not in the font are shown as "?".
+"""
+
+import displayio
+import adafruit_imageload
+
+UNKNOWN = "?"
+
+
+# **************** CLASS ******************
+class textGrid:
+    def __init__(self, bitmapFile, manifestFile, columns, rows, x=0, y=0):
+        with open(manifestFile, "r") as fp:
+            size = fp.readline().split()
+            self.cellWidth = int(size[0])
+            self.cellHeight = int(size[1])
+            characters = fp.readline().rstrip("\r\n")
+        (self.bitmap, self.palette) = adafruit_imageload.load(
+            bitmapFile, bitmap=displayio.Bitmap, palette=displayio.Palette)
+
+        # Tile of each ASCII character, and of the others the font has
+        self._ascii = bytearray(128)
+        self._others = {}
+        self.unknown = max(0, characters.find(UNKNOWN))
+        for i in range(128):
+            self._ascii[i] = self.unknown
+        for tile, character in enumerate(characters):
+            if ord(character) < 128:
+                self._ascii[ord(character)] = tile
+            else:
+                self._others[character] = tile
+        self.blank = self._ascii[32]
+
+        self.columns = columns
+        self.rows = rows
+        self.grid = displayio.TileGrid(self.bitmap, pixel_shader=self.palette,
+                                       width=columns,
+                                       height=rows,
+                                       tile_width=self.cellWidth,
+                                       tile_height=self.cellHeight,
+                                       default_tile=self.blank,
+                                       x=x,
+                                       y=y)
+
+    # **************** INTERNAL METHODS ******************
+    def _set(self, index, tile):
+        if self.grid[index] == tile:
+            return 0
+        self.grid[index] = tile
+        return 1
+
+    # **************** PUBLIC METHODS ******************
+    def tile(self, character):
+        code = ord(character)
+        if code < 128:
+            return self._ascii[code]
+        return self._others.get(character, self.unknown)
+
+    def setColor(self, color):
+        """Color of the text; the cells are filled with black."""
+        self.palette[1] = color
+
+    def write(self, column, row, text, width=None):
+        """
+        Writes text from a cell into width cells (the length of the text by
+        default): cut when longer, blanked after it when shorter, and never
+        past the end of the row. Returns the number of cells changed.
+        """
+        if width is None:
+            width = len(text)
+        width = min(width, self.columns - column)
+        index = row * self.columns + column
+        changed = 0
+        count = 0
+        for character in text:
+            if count == width:
+                break
+            changed += self._set(index + count, self.tile(character))
+            count += 1
+        while count < width:
+            changed += self._set(index + count, self.blank)
+            count += 1
+        return changed
+
+    def writeNumber(self, column, row, value, width, fill=" "):
+        """
+        Writes a number of at most width digits right aligned in width
+        cells, the cells before it filled with fill (e.g. "0"). Allocates
+        nothing. A larger number shows as width nines. Returns the number of
+        cells changed.
+        """
+        index = row * self.columns + column + width - 1
+        digits = self._ascii
+        if value >= 10 ** width:
+            value = 10 ** width - 1
+        changed = self._set(index, digits[48 + value % 10])
+        for i in range(1, width):
+            value //= 10
+            tile = digits[48 + value % 10] if value else self.tile(fill)
+            changed += self._set(index - i, tile)
+        return changed
+
+    def scroll(self, lines):
+        """
+        Moves the text up by lines rows, or down when lines is negative,
+        and blanks the rows left behind. Returns the number of cells
+        changed.
+        """
+        columns = self.columns
+        grid = self.grid
+        if lines >= 0:
+            order = range(self.rows)
+        else:
+            order = range(self.rows - 1, -1, -1)
+        changed = 0
+        for row in order:
+            source = row + lines
+            for column in range(columns):
+                if 0 <= source < self.rows:
+                    tile = grid[source * columns + column]
+                else:
+                    tile = self.blank
+                changed += self._set(row * columns + column, tile)
+        return changed
+
+    def clear(self):
+        changed = 0
+        for index in range(self.columns * self.rows):
+            changed += self._set(index, self.blank)
+        return changed
@@ -0,0 +1,362 @@
+# SPDX-FileCopyrightText: 2023 Richard Teel for TeelSys
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Sets the clock from the Adafruit IO time service without blocking.
+
+pyportal.get_local_time() connects to Wi-Fi, sends the request and waits for
+the reply in one call, which takes seconds. timeSync does the same work one
+short step at a time: each call to poll() checks the Wi-Fi link or the
+socket, moves the state machine on and returns at once. A failed attempt is
+retried after an exponential backoff with jitter.
+
+The requests are HTTP/1.1, so a reply may come in chunks (Transfer-Encoding:
+chunked): the chunk sizes are taken out as the reply arrives and only the
+data of the chunks goes to the body.
+
+feedSync (feedSync.py) fetches the event feed with the same state machine,
+through the _requestHeaders(), _receiveBody(), _bodyLength() and
+_handleReply() hooks.
+
+    IDLE -> CONNECTING -> REQUESTING -> IDLE
+                 |             |
+                 +--> BACKING_OFF --> CONNECTING
+"""
+
+import random
+import time
+import rtc
+
+IDLE = 0
+CONNECTING = 1
+REQUESTING = 2
+BACKING_OFF = 3
+STATE_NAMES = ("idle", "connecting", "requesting", "backing off")
+
+# Same service and reply format as adafruit_portalbase
+TIME_SERVICE = ("https://io.adafruit.com/api/v2/{}/integrations/time/strftime"
+                "?x-aio-key={}&tz={}&fmt=%25Y-%25m-%25d+%25H%3A%25M%3A%25S.%25L+%25j+%25u+%25z+%25Z")
+
+# The ESP32 co-processor socket modes (adafruit_esp32spi)
+TCP_MODE = 0
+TLS_MODE = 2
+
+READ_SIZE = 256
+
+# What the next line of a chunked body is
+CHUNK_SIZE = -1
+CHUNK_END = -2
+
+
+# **************** CLASS ******************
+class timeSync:
+    # Used in the console messages
+    NAME = "Time sync"
+    WHAT = "time"
+
+    def __init__(self, esp, secrets, interval=3600, url=None,
+                 connectTimeout=20, requestTimeout=15,
+                 backoffBase=5, backoffMax=600):
+        self.esp = esp
+        self.secrets = secrets
+        self.interval = interval
+        self.url = url
+        self.connectTimeout = connectTimeout
+        self.requestTimeout = requestTimeout
+        self.backoffBase = backoffBase
+        self.backoffMax = backoffMax
+
+        self.state = IDLE
+        self.lastSync = None        # time.monotonic() of the last good sync
+        self.correction = 0         # seconds the last sync moved the clock by
+        self.failures = 0           # failed attempts in a row
+        self.lastError = None
+        self._started = 0
+        self._deadline = 0
+        self._retryAt = 0
+        self._socket = None
+        self._mode = TCP_MODE
+        self._requestBytes = None
+        self._sent = False
+        self._response = None
+        # Where the body starts in _response, once the headers are in
+        self._bodyStart = None
+        # Reading a chunked body: the bytes left of the chunk, CHUNK_SIZE
+        # or CHUNK_END when a line is expected, and the start of that line
+        self._chunked = False
+        self._chunkLeft = CHUNK_SIZE
+        self._chunkLine = None
+        self._bodyDone = False
+
+    # **************** INTERNAL METHODS ******************
+    def _request(self):
+        # Returns (host, port, path, mode) of the time service
+        url = self.url
+        if url is None:
+            url = TIME_SERVICE.format(self.secrets["aio_username"],
+                                      self.secrets["aio_key"],
+                                      self.secrets.get("timezone", ""))
+        mode = TCP_MODE
+        port = 80
+        if url.startswith("https://"):
+            mode = TLS_MODE
+            port = 443
+            url = url[8:]
+        elif url.startswith("http://"):
+            url = url[7:]
+        slash = url.find("/")
+        if slash < 0:
+            host, path = url, "/"
+        else:
+            host, path = url[:slash], url[slash:]
+        colon = host.find(":")
+        if colon >= 0:
+            port = int(host[colon + 1:])
+            host = host[:colon]
+        return (host, port, path, mode)
+
+    def _startConnecting(self, now):
+        self._started = now
+        if not self.esp.is_connected:
+            print("INFO: Connecting to Wi-Fi")
+            self.esp.wifi_set_passphrase(bytes(self.secrets["ssid"], "utf-8"),
+                                         bytes(self.secrets["password"], "utf-8"))
+        self.state = CONNECTING
+        self._deadline = now + self.connectTimeout
+
+    def _startRequest(self, now):
+        host, port, path, mode = self._request()
+        self._socket = self.esp.get_socket()
+        self.esp.socket_open(self._socket, host, port, mode)
+        self._sent = False
+        self._response = bytearray()
+        self._bodyStart = None
+        self._chunked = False
+        self._chunkLeft = CHUNK_SIZE
+        self._chunkLine = bytearray()
+        self._bodyDone = False
+        self._requestBytes = bytes(
+            f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n"
+            f"{self._requestHeaders()}\r\n", "utf-8")
+        self._mode = mode
+        self.state = REQUESTING
+        self._deadline = now + self.requestTimeout
+
+    def _closeSocket(self):
+        if self._socket is not None:
+            try:
+                self.esp.socket_close(self._socket)
+            except (RuntimeError, OSError):
+                pass
+            self._socket = None
+        self._response = None
+
+    def _fail(self, now, reason):
+        self._closeSocket()
+        self.failures += 1
+        self.lastError = reason
+        # Exponential backoff, half of it random so that devices that failed
+        # together do not retry together
+        delay = min(self.backoffMax, self.backoffBase * (2 ** (self.failures - 1)))
+        delay = delay / 2 + random.random() * delay / 2
+        self._retryAt = now + delay
+        self.state = BACKING_OFF
+        print(f"WARN: {self.NAME} failed ({reason}), retrying in {delay:.1f} seconds")
+
+    def _receive(self, data):
+        # Splits what was read into the headers and the body
+        if self._bodyStart is None:
+            self._response.extend(data)
+            end = self._response.find(b"\r\n\r\n")
+            if end < 0:
+                return
+            self._bodyStart = end + 4
+            encoding = self._header("transfer-encoding")
+            self._chunked = encoding is not None and "chunked" in encoding.lower()
+            data = self._response[self._bodyStart:]
+            self._response = self._response[:self._bodyStart]
+        if self._chunked:
+            self._receiveChunks(data)
+        elif data:
+            self._receiveBody(data)
+
+    def _receiveChunks(self, data):
+        # Passes the data of the chunks on to _receiveBody(), without the
+        # size line before each and the line end after it
+        i = 0
+        while i < len(data) and not self._bodyDone:
+            if self._chunkLeft > 0:
+                n = min(self._chunkLeft, len(data) - i)
+                self._receiveBody(data[i:i + n])
+                self._chunkLeft -= n
+                i += n
+                if self._chunkLeft == 0:
+                    self._chunkLeft = CHUNK_END
+                continue
+            stop = data.find(b"\n", i)
+            if stop < 0:
+                self._chunkLine.extend(data[i:])
+                return
+            self._chunkLine.extend(data[i:stop])
+            i = stop + 1
+            line = str(self._chunkLine, "utf-8").strip()
+            self._chunkLine = bytearray()
+            if self._chunkLeft == CHUNK_END:
+                self._chunkLeft = CHUNK_SIZE
+                continue
+            # e.g. "1a0" or "1a0;name=value"; the trailers after the last
+            # chunk are not needed
+            self._chunkLeft = int(line.split(";")[0], 16)
+            if self._chunkLeft == 0:
+                self._bodyDone = True
+
+    def _responseComplete(self, available):
+        # Returns the body once all of it has been received, else None
+        closed = available == 0 and not self.esp.socket_connected(self._socket)
+        if self._bodyStart is None:
+            if closed:
+                raise RuntimeError("connection closed before the reply")
+            return None
+        body = self._response[self._bodyStart:]
+        if self._chunked:
+            if self._bodyDone:
+                return body
+            if closed:
+                raise RuntimeError("connection closed inside a chunked reply")
+            return None
+        length = self._header("content-length")
+        if length is not None and self._bodyLength(body) >= int(length):
+            return body
+        if closed:
+            return body
+        return None
+
+    def _status(self):
+        # Status code of the response, e.g. 200
+        return int(str(self._response[:self._response.find(b"\r\n")], "utf-8").split(" ")[1])
+
+    def _header(self, name):
+        # Value of a response header (name in lower case), or None
+        end = self._response.find(b"\r\n\r\n")
+        headers = str(self._response[:end], "utf-8")
+        start = headers.lower().find("\r\n" + name + ":")
+        if start < 0:
+            return None
+        start += len(name) + 3
+        stop = headers.find("\r\n", start)
+        if stop < 0:
+            stop = len(headers)
+        return headers[start:stop].strip()
+
+    # Hooks for the requests of other services
+    def _requestHeaders(self):
+        # Extra header lines of the request, each ending in \r\n
+        return ""
+
+    def _receiveBody(self, data):
+        # Data of the body as it arrives, after the headers
+        self._response.extend(data)
+
+    def _bodyLength(self, body):
+        # Bytes of the body received so far
+        return len(body)
+
+    def _handleReply(self, body):
+        # Returns what poll() returns for the reply
+        self._setClock(body)
+        return True
+
+    def _setClock(self, body):
+        status = str(self._response[:self._response.find(b"\r\n")], "utf-8")
+        if status.split(" ")[1] != "200":
+            raise ValueError(status)
+        # e.g. "2023-05-26 20:00:03.123 146 5 -0400 EDT"
+        reply = str(body, "utf-8").split(" ")
+        year, month, mday = [int(x) for x in reply[0].split("-")]
+        hours, minutes, seconds = [int(x) for x in reply[1].split(".")[0].split(":")]
+        yearDay = int(reply[2])
+        weekDay = int(reply[3]) - 1
+        synced = time.struct_time(
+            (year, month, mday, hours, minutes, seconds, weekDay, yearDay, -1))
+        # How far the RTC was off, unless it had never been set (2000-01-01
+        # after a reset)
+        self.correction = 0
+        if time.localtime().tm_year >= 2020:
+            self.correction = int(time.mktime(synced)) - int(time.time())
+        rtc.RTC().datetime = synced
+
+    # **************** PUBLIC METHODS ******************
+    def due(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        return self.lastSync is None or (now - self.lastSync) >= self.interval
+
+    def linkChanged(self, connected, now=None):
+        """
+        Called (e.g. by linkMonitor) when the Wi-Fi link goes up or down. A
+        request in flight fails at once instead of waiting for its timeout,
+        and a sync that is backing off is retried as soon as the link is back.
+        """
+        if now is None:
+            now = time.monotonic()
+        if not connected and self.state == REQUESTING:
+            self._fail(now, "Wi-Fi link lost")
+        elif connected and self.state == BACKING_OFF:
+            self._retryAt = now
+
+    def poll(self, now=None):
+        """
+        Runs one short step of the sync. Returns True when the clock has just
+        been set.
+        """
+        if now is None:
+            now = time.monotonic()
+
+        try:
+            if self.state == IDLE:
+                if self.due(now):
+                    print(f"INFO: Getting {self.WHAT} from internet!")
+                    self._startConnecting(now)
+
+            elif self.state == BACKING_OFF:
+                if now >= self._retryAt:
+                    self._startConnecting(now)
+
+            elif self.state == CONNECTING:
+                if self.esp.is_connected:
+                    self._startRequest(now)
+                elif now >= self._deadline:
+                    self._fail(now, "Wi-Fi connect timed out")
+
+            elif self.state == REQUESTING:
+                if not self._sent:
+                    if self.esp.socket_connected(self._socket):
+                        self.esp.socket_write(self._socket, self._requestBytes, self._mode)
+                        self._sent = True
+                else:
+                    available = self.esp.socket_available(self._socket)
+                    if available:
+                        self._receive(self.esp.socket_read(
+                            self._socket, min(available, READ_SIZE)))
+                        available -= READ_SIZE
+                    body = self._responseComplete(max(0, available))
+                    if body is not None:
+                        result = self._handleReply(body)
+                        self._closeSocket()
+                        print(f"INFO: Getting {self.WHAT} took {now - self._started:.1f} seconds.")
+                        self.lastSync = now
+                        self.failures = 0
+                        self.lastError = None
+                        self.state = IDLE
+                        return result
+                if self.state == REQUESTING and now >= self._deadline:
+                    self._fail(now, "no reply from the time service")
+
+        except (RuntimeError, OSError, ValueError, IndexError) as e:
+            self._fail(now, e)
+
+        return False
+
+    def stateName(self):
+        return STATE_NAMES[self.state]